@@ -0,0 +1,117 @@
+"""
+Benchmark `hsaquery.overlaps.group_polygons` on synthetic footprints
+
+    python benchmarks/bench_group_polygons.py [N1 N2 ...]
+
+The groups are first checked against the original greedy grouping of
+`find_overlaps` on a smaller set of footprints.
+"""
+import copy
+import sys
+import time
+
+import numpy as np
+import shapely
+
+from hsaquery import overlaps
+
+def make_polygons(N=1000, seed=1, size=2./60, buffer=1./60):
+    """
+    Buffered square footprints clustered in fields across the sky
+    """
+    rng = np.random.RandomState(seed)
+
+    nfield = max(N//20, 1)
+    field_ra = rng.uniform(0, 360, nfield)
+    field_dec = np.degrees(np.arcsin(rng.uniform(-1, 1, nfield)))
+
+    field = rng.randint(0, nfield, N)
+    ra = field_ra[field] + rng.normal(0, 3./60, N)
+    dec = field_dec[field] + rng.normal(0, 3./60, N)
+
+    boxes = shapely.box(ra-size/2, dec-size/2, ra+size/2, dec+size/2)
+    return shapely.buffer(boxes, buffer)
+
+def baseline_group_polygons(polygons, min_area=0.5/3600.):
+    """
+    Greedy pairwise grouping of the original `find_overlaps`
+    """
+    match_poly = [polygons[0]]
+    match_ids = [[0]]
+
+    for i in range(1,len(polygons)):
+        has_match = False
+        for j in range(len(match_poly)):
+            isect = match_poly[j].intersection(polygons[i])
+            if isect.area > min_area:
+                match_poly[j] = match_poly[j].union(polygons[i])
+                match_ids[j].append(i)
+                has_match = True
+
+        if not has_match:
+            match_poly.append(polygons[i])
+            match_ids.append([i])
+
+    # Iterate joining polygons
+    for iter in range(3):
+        mpolygons = copy.deepcopy(match_poly)
+        mids = copy.deepcopy(match_ids)
+
+        match_poly = [mpolygons[0]]
+        match_ids = [mids[0]]
+
+        for i in range(1,len(mpolygons)):
+            has_match = False
+            for j in range(len(match_poly)):
+                isect = match_poly[j].intersection(mpolygons[i])
+                if isect.area > 0:
+                    match_poly[j] = match_poly[j].union(mpolygons[i])
+                    match_ids[j].extend(mids[i])
+                    has_match = True
+
+            if not has_match:
+                match_poly.append(mpolygons[i])
+                match_ids.append(mids[i])
+
+        if len(mpolygons) == len(match_poly):
+            break
+
+    return match_poly, match_ids
+
+def check_equivalence(N=2000):
+    """
+    Check that `group_polygons` gives the same groups as the greedy
+    baseline
+    """
+    polygons = make_polygons(N)
+
+    match_poly, match_ids = overlaps.group_polygons(polygons)
+    base_poly, base_ids = baseline_group_polygons(list(polygons))
+
+    groups = set([frozenset(ids) for ids in match_ids])
+    base_groups = set([frozenset(ids) for ids in base_ids])
+
+    if groups != base_groups:
+        raise AssertionError('group_polygons: N={0}, {1} groups differ from the baseline'.format(N, len(groups ^ base_groups)))
+
+    # The group unions cover the same area
+    for ids, poly in zip(match_ids, match_poly):
+        base = base_poly[[frozenset(b) for b in base_ids].index(frozenset(ids))]
+        if not np.isclose(poly.area, base.area, rtol=1.e-6):
+            raise AssertionError('group_polygons: union area differs for group {0}'.format(ids[0]))
+
+    print('group_polygons: N={0:>7d}  groups={1:>6d}  same as baseline'.format(N, len(groups)))
+
+if __name__ == '__main__':
+    sizes = [int(n) for n in sys.argv[1:]] or [1000, 10000, 100000]
+
+    check_equivalence(min(min(sizes), 2000))
+
+    for N in sizes:
+        polygons = make_polygons(N)
+
+        t0 = time.time()
+        match_poly, match_ids = overlaps.group_polygons(polygons)
+        dt = time.time() - t0
+
+        print('group_polygons: N={0:>7d}  groups={1:>6d}  {2:.2f} s'.format(N, len(match_poly), dt))
@@ -0,0 +1,160 @@
+"""
+Benchmark `hsaquery.query.process_table` on a synthetic raw query result
+
+    python benchmarks/bench_process_table.py [nrows]
+
+The result is first checked against the original row-by-row processing
+on a smaller table.
+"""
+import sys
+import time
+
+import numpy as np
+from astropy.table import Table
+
+from hsaquery import query, utils
+
+def make_raw_table(N=100000, seed=1):
+    """
+    Synthetic table with the columns and byte-string object dtypes of a
+    raw VOTable query result
+    """
+    rng = np.random.RandomState(seed)
+
+    dets = np.array(['IR', 'UVIS', 'WFC', 'HRC', '1'])
+    exts = np.array(['FLT', 'RAW', 'FLC', 'C1M', 'SPT'])
+
+    det = dets[rng.randint(0, len(dets), N)]
+    ext = exts[rng.randint(0, len(exts), N)]
+    exptime = rng.uniform(10, 3000, N)
+
+    obs_id = np.array(['i{0:08x}q'.format(i) for i in range(N)])
+
+    def to_bytes_object(strings):
+        col = np.empty(len(strings), dtype=object)
+        col[:] = [s.encode('utf-8') for s in strings]
+        return col
+
+    tab = Table()
+    tab['OBSERVATION_ID'] = to_bytes_object(obs_id[::-1])
+    tab['ARTIFACT_ID'] = to_bytes_object(['{0}_{1}.fits'.format(o, e.lower()) for o, e in zip(obs_id[::-1], ext)])
+    tab['INSTRUMENT_CONFIGURATION'] = to_bytes_object(['APERTURE={0}|DETECTOR={0}|OBSMODE=ACCUM|EXPTIME={1:.1f}'.format(d, t) for d, t in zip(det, exptime)])
+    tab['TARGET_NAME'] = to_bytes_object(['TARGET{0}'.format(i % 500) for i in range(N)])
+    tab['RA'] = rng.uniform(0, 360, N)
+    tab['DEC'] = rng.uniform(-80, 80, N)
+
+    return tab
+
+def baseline_process_table(tab, extensions=['RAW','C1M'], instruments=['WFC3-IR'], rename_columns=query.DEFAULT_RENAME, lower=True, sort_column=['OBSERVATION_ID']):
+    """
+    Row-by-row processing of the original `run_query`
+    """
+    # Compute file extension
+    if 'ARTIFACT_ID' in tab.colnames:
+        file_extension = [str(file).split('_')[-1].split('.')[0].upper() for file in tab['ARTIFACT_ID']]
+
+        tab['FILE_TYPE'] = file_extension
+
+        if len(extensions) > 0:
+            ext_test = np.array([tab['FILE_TYPE'] == ext for ext in extensions]).sum(axis=0) > 0
+            tab = tab[ext_test]
+
+    if len(tab) == 0:
+        return False
+
+    # Parse instrument configuration
+    if 'INSTRUMENT_CONFIGURATION' in tab.colnames:
+        config = {'APERTURE':[], 'DETECTOR':[], 'OBSMODE':[], 'EXPTIME':[]}
+        for conf in tab['INSTRUMENT_CONFIGURATION']:
+            spl = conf.decode('utf-8').strip().split('|')
+            splk = {}
+            for item in spl:
+                k = item.split('=')
+                splk[k[0]] = k[1]
+
+            for ck in config:
+                if ck in splk:
+                    config[ck].append(splk[ck])
+                else:
+                    config[ck].append('')
+
+        config['EXPTIME'] = np.asarray(config['EXPTIME'], dtype=float)
+
+        for ck in config:
+            tab[ck] = config[ck]
+
+        if len(instruments) > 0:
+            ins_test = np.array([tab['DETECTOR'] == query.INSTRUMENT_DETECTORS[ins] for ins in instruments]).sum(axis=0) > 0
+            tab = tab[ins_test]
+
+        swap_detector = {}
+        for k in query.INSTRUMENT_DETECTORS:
+            swap_detector[query.INSTRUMENT_DETECTORS[k]] = k
+
+        instdet = [swap_detector[det] if det in swap_detector else '' for det in tab['DETECTOR']]
+        tab['INSTDET'] = instdet
+
+    # Sort
+    tab.sort(sort_column)
+
+    # Add coordinate name
+    if 'RA' in tab.colnames:
+        jtargname = [utils.radec_to_targname(ra=tab['RA'][i], dec=tab['DEC'][i], scl=6) for i in range(len(tab))]
+        tab['JTARGNAME'] = jtargname
+
+    for col in tab.colnames:
+        if tab[col].dtype == np.dtype('O'):
+            strcol = [item.decode('utf-8') for item in tab[col]]
+            tab.remove_column(col)
+            tab[col] = strcol
+
+    for c in rename_columns:
+        if c in tab.colnames:
+            tab.rename_column(c, rename_columns[c])
+
+    if lower:
+        for c in tab.colnames:
+            tab.rename_column(c, c.lower())
+
+    return tab
+
+def check_equivalence(N=2000, **kwargs):
+    """
+    Check that `process_table` gives the same rows and values as the
+    row-by-row baseline
+    """
+    tab = query.process_table(make_raw_table(N), **kwargs)
+    base = baseline_process_table(make_raw_table(N), **kwargs)
+
+    if sorted(tab.colnames) != sorted(base.colnames):
+        raise AssertionError('process_table: columns differ from the baseline: {0} {1}'.format(tab.colnames, base.colnames))
+
+    if len(tab) != len(base):
+        raise AssertionError('process_table: {0} rows, baseline {1}'.format(len(tab), len(base)))
+
+    for c in base.colnames:
+        if base[c].dtype.kind == 'f':
+            same = np.allclose(tab[c], base[c], equal_nan=True)
+        else:
+            same = (np.asarray(tab[c]).astype(str) ==
+                    np.asarray(base[c]).astype(str)).all()
+
+        if not same:
+            raise AssertionError('process_table: column {0} differs from the baseline'.format(c))
+
+    print('process_table: {0} rows > {1} rows, same as baseline'.format(N, len(tab)))
+
+if __name__ == '__main__':
+    N = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    check_equivalence(min(N, 2000), extensions=['FLT','FLC'],
+                      instruments=['WFC3-IR', 'ACS-WFC'])
+
+    raw = make_raw_table(N)
+
+    t0 = time.time()
+    tab = query.process_table(raw, extensions=['FLT','FLC'],
+                              instruments=['WFC3-IR', 'ACS-WFC'])
+    dt = time.time() - t0
+
+    print('process_table: {0} rows > {1} rows in {2:.3f} s'.format(N, len(tab), dt))
@@ -0,0 +1,215 @@
+"""
+Persistent on-disk cache of `~hsaquery.query.run_query` results
+"""
+import os
+import time
+import hashlib
+import tempfile
+import pickle
+
+# Set with the HSAQUERY_CACHE environment variable
+CACHE_DIR = os.getenv('HSAQUERY_CACHE',
+                      os.path.join(os.path.expanduser('~'), '.hsaquery',
+                                   'query_cache'))
+
+# Time-to-live, seconds
+CACHE_TTL = 86400.
+
+# Maximum total size of the cache directory, bytes
+CACHE_MAX_SIZE = 512*1024**2
+
+CACHE_SUFFIX = '.pkl'
+
+def cache_key(query, **kwargs):
+    """
+    Generate a cache key from a query URL and any additional parameters
+    that change the post-processed table.
+
+    Parameters
+    ----------
+    query : str
+        Query URL, e.g., from `~hsaquery.query.run_query` with
+        `get_query_string=True`.
+
+    kwargs : dict
+        Additional parameters, which must have a deterministic `repr`.
+
+    Returns
+    -------
+    key : str
+        SHA1 hex digest.
+
+    """
+    keystr = query.strip()
+    for k in sorted(kwargs):
+        keystr += '&{0}={1}'.format(k, repr(kwargs[k]))
+
+    return hashlib.sha1(keystr.encode('utf-8')).hexdigest()
+
+def cache_file(key, cache_dir=CACHE_DIR):
+    """
+    Filename of a cache entry
+    """
+    return os.path.join(cache_dir, key+CACHE_SUFFIX)
+
+def read_cache(key, ttl=CACHE_TTL, cache_dir=CACHE_DIR):
+    """
+    Read a table from the cache
+
+    Parameters
+    ----------
+    key : str
+        Cache key from `cache_key`.
+
+    ttl : float
+        Entries older than `ttl` seconds are considered expired and are
+        removed.
+
+    cache_dir : str
+        Cache directory.
+
+    Returns
+    -------
+    tab : `~astropy.table.Table` or None
+        Cached table, or None if the entry is missing, expired or can't be
+        read.
+
+    """
+    file = cache_file(key, cache_dir=cache_dir)
+    if not os.path.exists(file):
+        return None
+
+    now = time.time()
+    st = os.stat(file)
+    if (now - st.st_mtime) > ttl:
+        remove_entry(file)
+        return None
+
+    try:
+        with open(file, 'rb') as fp:
+            tab = pickle.load(fp)
+    except Exception:
+        remove_entry(file)
+        return None
+
+    # Access time for LRU eviction, modification time stays the creation
+    # time used for the TTL
+    os.utime(file, (now, st.st_mtime))
+    return tab
+
+def write_cache(tab, key, cache_dir=CACHE_DIR, max_size=CACHE_MAX_SIZE, ttl=CACHE_TTL):
+    """
+    Write a table to the cache and evict old entries
+
+    Parameters
+    ----------
+    tab : `~astropy.table.Table`
+        Table to store.
+
+    key : str
+        Cache key from `cache_key`.
+
+    cache_dir : str
+        Cache directory.
+
+    max_size : int
+        Maximum total size of the cache, bytes.  See `evict_cache`.
+
+    ttl : float
+        Time-to-live, seconds.  See `evict_cache`.
+
+    Returns
+    -------
+    file : str
+        Cache filename.
+
+    """
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+
+    file = cache_file(key, cache_dir=cache_dir)
+
+    # Write to a temporary file so that concurrent readers never see a
+    # partial entry.  The name is unique across processes and threads.
+    with tempfile.NamedTemporaryFile(dir=cache_dir, suffix='.tmp',
+                                     delete=False) as fp:
+        pickle.dump(tab, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp_file = fp.name
+
+    os.replace(tmp_file, file)
+
+    evict_cache(cache_dir=cache_dir, max_size=max_size, ttl=ttl)
+    return file
+
+def remove_entry(file):
+    """
+    Remove a cache file, ignoring errors from concurrent removal
+    """
+    try:
+        os.remove(file)
+    except OSError:
+        pass
+
+def evict_cache(cache_dir=CACHE_DIR, max_size=CACHE_MAX_SIZE, ttl=CACHE_TTL):
+    """
+    Remove expired entries and then least-recently-used entries until the
+    total size of the cache is less than `max_size`.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Cache directory.
+
+    max_size : int
+        Maximum total size of the cache, bytes.
+
+    ttl : float
+        Time-to-live, seconds.
+
+    Returns
+    -------
+    removed : list
+        List of removed files.
+
+    """
+    if not os.path.exists(cache_dir):
+        return []
+
+    now = time.time()
+    entries = []
+    removed = []
+
+    for f in os.listdir(cache_dir):
+        if not f.endswith(CACHE_SUFFIX):
+            continue
+
+        file = os.path.join(cache_dir, f)
+        try:
+            st = os.stat(file)
+        except OSError:
+            continue
+
+        if (now - st.st_mtime) > ttl:
+            remove_entry(file)
+            removed.append(file)
+        else:
+            entries.append((st.st_atime, st.st_size, file))
+
+    total_size = sum([e[1] for e in entries])
+
+    # Oldest access first
+    for atime, size, file in sorted(entries):
+        if total_size <= max_size:
+            break
+
+        remove_entry(file)
+        removed.append(file)
+        total_size -= size
+
+    return removed
+
+def clear_cache(cache_dir=CACHE_DIR):
+    """
+    Remove all entries from the cache
+    """
+    return evict_cache(cache_dir=cache_dir, max_size=-1, ttl=-1)
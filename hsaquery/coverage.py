@@ -0,0 +1,510 @@
+"""
+HEALPix coverage of footprints as sorted ranges of nested pixel indices
+
+The coverage of a footprint is the set of nested HEALPix pixels at a given
+order that it touches, stored as sorted, non-overlapping half-open ranges
+``[start, stop)``.  This is the range representation of a multi-order
+coverage map (MOC, see `Coverage.to_multi_order`), and union, intersection,
+difference and overlap tests are vectorized integer operations on the
+range boundaries.
+
+Requires `healpy` for rasterizing the polygons, which is installed with
+the `coverage` extra, e.g., ``pip install hsaquery[coverage]``.  The 
+pixel indices of points (`healpix_index`) are also used by the dust cache
+and the sky partitioning and don't need `healpy`.
+"""
+import numpy as np
+
+# Default HEALPix order, 12.9 arcsec pixels
+COVERAGE_ORDER = 14
+
+# Full sky, square degrees
+FULL_SKY_DEG2 = 4*np.pi*(180/np.pi)**2
+
+def pixel_area(order):
+    """
+    Area of a HEALPix pixel, square arcminutes
+    """
+    return FULL_SKY_DEG2*3600./(12*4**order)
+
+def _spread_bits(x, order):
+    """
+    Spread the bits of integers `x` to the even bits of the result
+    """
+    x = np.asarray(x, dtype=np.int64)
+    result = np.zeros_like(x)
+    for b in range(order):
+        result |= ((x >> b) & 1) << (2*b)
+
+    return result
+
+def _healpix_nest(ra, dec, order):
+    """
+    Nested HEALPix index, numpy version of `ang2pix_nest_z_phi` of the
+    HEALPix C++ library
+    """
+    nside = 2**order
+    z = np.sin(dec/180*np.pi)
+    za = np.abs(z)
+    tt = ((ra % 360.)/90.) % 4.
+
+    face = np.zeros(len(z), dtype=np.int64)
+    ix = np.zeros(len(z), dtype=np.int64)
+    iy = np.zeros(len(z), dtype=np.int64)
+
+    # Equatorial region
+    eq = za <= 2./3
+    temp1 = nside*(0.5+tt[eq])
+    temp2 = nside*z[eq]*0.75
+    jp = (temp1-temp2).astype(np.int64)
+    jm = (temp1+temp2).astype(np.int64)
+    ifp = jp >> order
+    ifm = jm >> order
+    face[eq] = np.where(ifp == ifm, np.where(ifp == 4, 4, ifp+4),
+                        np.where(ifp < ifm, ifp, ifm+8))
+    ix[eq] = jm & (nside-1)
+    iy[eq] = nside - (jp & (nside-1)) - 1
+
+    # Polar caps
+    pol = ~eq
+    ntt = np.minimum(tt[pol].astype(np.int64), 3)
+    tp = tt[pol] - ntt
+    tmp = nside*np.sqrt(3*(1-za[pol]))
+    jp = np.minimum((tp*tmp).astype(np.int64), nside-1)
+    jm = np.minimum(((1.0-tp)*tmp).astype(np.int64), nside-1)
+    north = z[pol] >= 0
+    face[pol] = np.where(north, ntt, ntt+8)
+    ix[pol] = np.where(north, nside-jm-1, jp)
+    iy[pol] = np.where(north, nside-jp-1, jm)
+
+    return ((face << (2*order)) + _spread_bits(ix, order) +
+            (_spread_bits(iy, order) << 1))
+
+def healpix_index(ra, dec, order=COVERAGE_ORDER):
+    """
+    Nested HEALPix pixel indices of sky positions
+
+    Uses `astropy_healpix` if it is available and an equivalent numpy
+    implementation otherwise, so `healpy` is not needed.
+
+    Parameters
+    ----------
+    ra, dec : array-like
+        Sky coordinates in decimal degrees.
+
+    order : int
+        HEALPix order, i.e., nside = 2**order.
+
+    Returns
+    -------
+    pix : array of int
+        Pixel indices.
+
+    """
+    ra = np.atleast_1d(np.asarray(ra, dtype=float))
+    dec = np.atleast_1d(np.asarray(dec, dtype=float))
+
+    try:
+        import astropy.units as u
+        from astropy_healpix import HEALPix
+    except ImportError:
+        return _healpix_nest(ra, dec, order)
+
+    hp = HEALPix(nside=2**order, order='nested')
+    return np.asarray(hp.lonlat_to_healpix(ra*u.deg, dec*u.deg),
+                      dtype=np.int64)
+
+def pixels_to_ranges(pix):
+    """
+    Sorted ranges [start, stop) of a set of pixel indices
+    """
+    pix = np.unique(np.asarray(pix, dtype=np.int64))
+    if len(pix) == 0:
+        return np.zeros((0,2), dtype=np.int64)
+
+    breaks = np.where(np.diff(pix) != 1)[0]
+    starts = np.append(pix[0], pix[breaks+1])
+    stops = np.append(pix[breaks], pix[-1]) + 1
+    return np.array([starts, stops]).T
+
+def normalize_ranges(ranges):
+    """
+    Sort and merge overlapping or adjacent ranges
+    """
+    ranges = np.asarray(ranges, dtype=np.int64).reshape((-1,2))
+    ranges = ranges[ranges[:,1] > ranges[:,0]]
+    if len(ranges) == 0:
+        return ranges
+
+    ranges = ranges[np.argsort(ranges[:,0], kind='stable')]
+
+    # A new range starts where the start is beyond all previous stops
+    max_stop = np.maximum.accumulate(ranges[:,1])
+    new = np.append(True, ranges[1:,0] > max_stop[:-1])
+    group = np.cumsum(new) - 1
+
+    starts = ranges[new,0]
+    stops = np.zeros(new.sum(), dtype=np.int64)
+    np.maximum.at(stops, group, ranges[:,1])
+    return np.array([starts, stops]).T
+
+def _in_ranges(values, ranges):
+    """
+    Test if values are in a set of normalized ranges
+    """
+    idx = np.searchsorted(ranges[:,0], values, side='right') - 1
+    inside = idx >= 0
+    inside[inside] = values[inside] < ranges[idx[inside],1]
+    return inside
+
+def combine_ranges(a, b, op):
+    """
+    Boolean combination of two sets of normalized ranges
+
+    Parameters
+    ----------
+    a, b : array (N,2)
+        Normalized ranges.
+
+    op : function
+        Element-wise boolean function of the membership in `a` and `b`,
+        e.g., `numpy.logical_and` for the intersection.
+
+    Returns
+    -------
+    ranges : array (M,2)
+        Normalized ranges of the combination.
+
+    """
+    bounds = np.unique(np.hstack([a.flatten(), b.flatten()]))
+    if len(bounds) < 2:
+        return np.zeros((0,2), dtype=np.int64)
+
+    # Elementary segments between consecutive boundaries
+    seg_start, seg_stop = bounds[:-1], bounds[1:]
+    keep = op(_in_ranges(seg_start, a), _in_ranges(seg_start, b))
+
+    return normalize_ranges(np.array([seg_start[keep], seg_stop[keep]]).T)
+
+class Coverage(object):
+    """
+    HEALPix coverage, a set of nested pixel ranges at order `order`
+    """
+    def __init__(self, ranges, order=COVERAGE_ORDER):
+        self.ranges = normalize_ranges(ranges)
+        self.order = order
+
+    @classmethod
+    def from_pixels(cls, pix, order=COVERAGE_ORDER):
+        """
+        Coverage from nested pixel indices
+        """
+        return cls(pixels_to_ranges(pix), order=order)
+
+    def _check(self, other):
+        if other.order != self.order:
+            raise ValueError('Coverage orders differ: {0} {1}'.format(self.order, other.order))
+
+    def __len__(self):
+        """
+        Number of pixels
+        """
+        return int(np.sum(self.ranges[:,1] - self.ranges[:,0]))
+
+    def area(self):
+        """
+        Covered area, square arcminutes
+        """
+        return len(self)*pixel_area(self.order)
+
+    def union(self, other):
+        self._check(other)
+        return Coverage(np.vstack([self.ranges, other.ranges]),
+                        order=self.order)
+
+    def intersection(self, other):
+        self._check(other)
+        return Coverage(combine_ranges(self.ranges, other.ranges,
+                                       np.logical_and), order=self.order)
+
+    def difference(self, other):
+        self._check(other)
+        return Coverage(combine_ranges(self.ranges, other.ranges,
+                               lambda x, y: x & ~y), order=self.order)
+
+    def overlaps(self, other):
+        """
+        Test if two coverages have any pixel in common
+        """
+        self._check(other)
+        return ranges_overlap(other.ranges, self.ranges).any()
+
+    def pixels(self):
+        """
+        Nested pixel indices
+        """
+        if len(self.ranges) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        return np.hstack([np.arange(r[0], r[1]) for r in self.ranges])
+
+    def to_multi_order(self):
+        """
+        Multi-order cells of the coverage
+
+        Returns
+        -------
+        cells : dict
+            Pixel indices of the largest cells that tile the coverage,
+            keyed by their order.
+
+        """
+        cells = {}
+        for start, stop in self.ranges:
+            while start < stop:
+                # Largest aligned cell that fits in the range
+                k = 0
+                while (k < self.order):
+                    size = 4**(k+1)
+                    if (start % size != 0) | (start + size > stop):
+                        break
+
+                    k += 1
+
+                order = self.order - k
+                if order not in cells:
+                    cells[order] = []
+
+                cells[order].append(start >> (2*k))
+                start += 4**k
+
+        return dict([(k, np.array(cells[k], dtype=np.int64))
+                     for k in sorted(cells)])
+
+def ranges_overlap(ranges, other):
+    """
+    Test which of a list of ranges overlap a set of normalized ranges
+
+    Parameters
+    ----------
+    ranges : array (N,2)
+        Ranges to test, not necessarily normalized.
+
+    other : array (M,2)
+        Normalized ranges.
+
+    Returns
+    -------
+    overlap : array of bool (N)
+        True for the `ranges` that overlap `other`.
+
+    """
+    if (len(other) == 0) | (len(ranges) == 0):
+        return np.zeros(len(ranges), dtype=bool)
+
+    # Last range of `other` that starts before the range stop
+    idx = np.searchsorted(other[:,0], ranges[:,1], side='left') - 1
+    overlap = idx >= 0
+    overlap[overlap] = other[idx[overlap],1] > ranges[overlap,0]
+    return overlap
+
+def polygon_pixels(vertices, order=COVERAGE_ORDER, inclusive=True):
+    """
+    Nested HEALPix pixels of a polygon
+
+    Parameters
+    ----------
+    vertices : array (N,2)
+        RA/Dec vertices, decimal degrees.  Non-convex polygons are replaced
+        by their convex hull.
+
+    order : int
+        HEALPix order.
+
+    inclusive : bool
+        Include all pixels that overlap the polygon rather than only those
+        with centers inside, see `healpy.query_polygon`.
+
+    Returns
+    -------
+    pix : array
+        Pixel indices.
+
+    """
+    import healpy
+
+    vertices = np.asarray(vertices, dtype=float)
+    if (vertices[0] == vertices[-1]).all():
+        vertices = vertices[:-1]
+
+    vec = healpy.ang2vec(vertices[:,0], vertices[:,1], lonlat=True)
+    nside = 2**order
+
+    try:
+        return healpy.query_polygon(nside, vec, inclusive=inclusive,
+                                    nest=True)
+    except (ValueError, RuntimeError):
+        import shapely
+        hull = shapely.convex_hull(shapely.multipoints(vertices))
+        hxy = np.asarray(hull.exterior.coords)[:-1]
+        hvec = healpy.ang2vec(hxy[:,0], hxy[:,1], lonlat=True)
+        return healpy.query_polygon(nside, hvec, inclusive=inclusive,
+                                    nest=True)
+
+class CoverageArray(object):
+    """
+    Coverage of each row of a `~hsaquery.footprints.FootprintArray`, as
+    flat ranges and row offsets
+
+    Attributes
+    ----------
+    ranges : array (Nr,2)
+        Normalized ranges of all rows.
+
+    row_offsets : array (Nrow+1)
+        Row `j` has ranges ``ranges[row_offsets[j]:row_offsets[j+1]]``.
+
+    order : int
+        HEALPix order.
+
+    """
+    def __init__(self, ranges, row_offsets, order=COVERAGE_ORDER):
+        self.ranges = np.asarray(ranges, dtype=np.int64).reshape((-1,2))
+        self.row_offsets = np.asarray(row_offsets, dtype=np.int64)
+        self.order = order
+
+    @classmethod
+    def from_footprints(cls, fps, order=COVERAGE_ORDER, inclusive=True, buffer=0.):
+        """
+        Rasterize the footprints of a `~hsaquery.footprints.FootprintArray`
+
+        If `buffer` is greater than zero, each polygon is buffered by 
+        `buffer` degrees first.  The buffered polygons stay convex, and 
+        the coverage of a row is that of its buffered union, like the 
+        polygons of `~hsaquery.overlaps.find_overlaps`.
+        """
+        import shapely
+
+        def vertices(p):
+            if buffer > 0:
+                poly = shapely.buffer(shapely.polygons(p), buffer)
+                return np.asarray(poly.exterior.coords)
+            else:
+                return p
+
+        ranges = []
+        counts = []
+        for polys in fps:
+            pix = [polygon_pixels(vertices(p), order=order,
+                                  inclusive=inclusive)
+                   for p in polys if len(p) > 2]
+            if len(pix) > 0:
+                r = pixels_to_ranges(np.hstack(pix))
+            else:
+                r = np.zeros((0,2), dtype=np.int64)
+
+            ranges.append(r)
+            counts.append(len(r))
+
+        if len(ranges) > 0:
+            ranges = np.vstack(ranges)
+        else:
+            ranges = np.zeros((0,2), dtype=np.int64)
+
+        row_offsets = np.append(0, np.cumsum(counts, dtype=np.int64))
+        return cls(ranges, row_offsets, order=order)
+
+    def __len__(self):
+        return len(self.row_offsets) - 1
+
+    def __getitem__(self, i):
+        """
+        `Coverage` of row `i`
+        """
+        ro = self.row_offsets
+        return Coverage(self.ranges[ro[i]:ro[i+1]], order=self.order)
+
+    def union(self, rows=None):
+        """
+        `Coverage` of the union of all rows or of the `rows` indices
+        """
+        if rows is None:
+            return Coverage(self.ranges, order=self.order)
+
+        rows = np.atleast_1d(rows)
+        ro = self.row_offsets
+        nr = ro[rows+1] - ro[rows]
+        idx = np.repeat(ro[rows], nr)
+        idx += np.arange(nr.sum()) - np.repeat(np.cumsum(nr)-nr, nr)
+        return Coverage(self.ranges[idx], order=self.order)
+
+    def area(self):
+        """
+        Covered area of each row, square arcminutes
+        """
+        npix = self.ranges[:,1] - self.ranges[:,0]
+        row_index = np.repeat(np.arange(len(self)), np.diff(self.row_offsets))
+        return (np.bincount(row_index, weights=npix, minlength=len(self)) *
+                pixel_area(self.order))
+
+    def overlaps(self, coverage):
+        """
+        Rows that overlap a `Coverage`
+
+        Returns
+        -------
+        mask : array of bool
+            True for the rows with any pixel in `coverage`.
+
+        """
+        if coverage.order != self.order:
+            raise ValueError('Coverage orders differ: {0} {1}'.format(self.order, coverage.order))
+
+        hit = ranges_overlap(self.ranges, coverage.ranges)
+        row_index = np.repeat(np.arange(len(self)), np.diff(self.row_offsets))
+        return np.bincount(row_index, weights=hit, minlength=len(self)) > 0
+
+def coverage_overlaps(fps, geom=None, coverage=None, order=COVERAGE_ORDER, refine=False):
+    """
+    Rows of a `~hsaquery.footprints.FootprintArray` that overlap a group
+
+    Parameters
+    ----------
+    fps : `~hsaquery.footprints.FootprintArray`
+        Footprints to test.
+
+    geom : `~shapely.geometry.Polygon` or None
+        Group polygon.  Its coverage is computed if `coverage` is None, 
+        with the convex hull of parts that aren't convex.
+
+    coverage : `Coverage` or None
+        Group coverage, e.g., the `CoverageArray.union` of the group 
+        members, which is exact for non-convex groups.
+
+    order : int
+        HEALPix order.
+
+    refine : bool
+        Check the rows selected by their coverage with the exact polygon
+        test `~hsaquery.footprints.FootprintArray.overlaps`.
+
+    Returns
+    -------
+    mask : array of bool
+        Overlapping rows.
+
+    """
+    if coverage is None:
+        pix = []
+        for poly in getattr(geom, 'geoms', [geom]):
+            pix.append(polygon_pixels(np.asarray(poly.exterior.coords),
+                                      order=order))
+
+        coverage = Coverage.from_pixels(np.hstack(pix), order=order)
+
+    mask = fps.coverage(order=coverage.order).overlaps(coverage)
+
+    if refine & (geom is not None):
+        mask[mask] = fps[mask].overlaps(geom)
+
+    return mask
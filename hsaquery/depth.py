@@ -0,0 +1,360 @@
+"""
+Exposure-depth maps from footprint tables
+"""
+import numpy as np
+
+from . import query, footprints
+
+# Maximum number of (polygon, pixel) candidates per rasterization chunk
+DEPTH_CHUNK_SIZE = 2**22
+
+def make_depth_wcs(fps, pixscale=1., ra=None, dec=None, pad=2):
+    """
+    Tangent-plane WCS grid that covers a set of footprints
+
+    Parameters
+    ----------
+    fps : `~hsaquery.footprints.FootprintArray`
+        Footprints.
+
+    pixscale : float
+        Pixel scale, arcsec.
+
+    ra, dec : float or None
+        Projection center.  If None, the center of the footprint vertices.
+
+    pad : int
+        Padding around the footprints, pixels.
+
+    Returns
+    -------
+    wcs : `~astropy.wcs.WCS`
+        WCS of the grid.
+
+    shape : (int, int)
+        Shape (ny, nx) of the grid.
+
+    """
+    import astropy.wcs as pywcs
+
+    verts = fps.vertices
+    if ra is None:
+        # Circular mean of the RA values
+        rad = verts[:,0]/180*np.pi
+        ra = np.arctan2(np.sin(rad).mean(), np.cos(rad).mean())/np.pi*180 % 360
+
+    if dec is None:
+        dec = np.mean(verts[:,1])
+
+    wcs = pywcs.WCS(naxis=2)
+    wcs.wcs.ctype = ['RA---TAN', 'DEC--TAN']
+    wcs.wcs.crval = [ra, dec]
+    wcs.wcs.cdelt = [-pixscale/3600., pixscale/3600.]
+    wcs.wcs.crpix = [1., 1.]
+
+    x, y = wcs.all_world2pix(verts[:,0], verts[:,1], 0)
+    x0 = np.floor(x.min()) - pad
+    y0 = np.floor(y.min()) - pad
+    nx = int(np.ceil(x.max()) - x0) + pad + 1
+    ny = int(np.ceil(y.max()) - y0) + pad + 1
+
+    wcs.wcs.crpix = [1-x0, 1-y0]
+    return wcs, (ny, nx)
+
+def rasterize_polygons(xy, poly_offsets, weights, shape, chunk_size=DEPTH_CHUNK_SIZE, poly_rows=None):
+    """
+    Sum polygon weights on a pixel grid
+
+    A pixel gets the weight of every polygon that contains its center,
+    from a crossing-number test.  The candidate pixels are those in the
+    bounding box of each polygon and are evaluated in bulk for chunks of
+    polygons, with a loop only over the (padded) number of polygon edges.
+
+    Parameters
+    ----------
+    xy : array (Nv,2)
+        Polygon vertices in pixel coordinates, with pixel centers at
+        integer values.
+
+    poly_offsets : array (Np+1)
+        Polygon `i` has vertices ``xy[poly_offsets[i]:poly_offsets[i+1]]``.
+
+    weights : array (Np)
+        Weight of each polygon, e.g., exposure time.
+
+    shape : (int, int)
+        Shape (ny, nx) of the grid.
+
+    chunk_size : int
+        Maximum number of candidate pixels per chunk.
+
+    poly_rows : array (Np) or None
+        Sorted row index of each polygon, e.g., of the polygons of a
+        multi-polygon footprint.  If specified, a pixel gets the weight of
+        a row once, even if it is inside several polygons of the row.
+
+    Returns
+    -------
+    image : array
+        Summed weights.
+
+    """
+    ny, nx = shape
+    image = np.zeros(ny*nx)
+
+    nvert = np.diff(poly_offsets)
+    valid = nvert >= 3
+    if valid.sum() == 0:
+        return image.reshape(shape)
+
+    # Pixel bounding box of each polygon
+    vstart = poly_offsets[:-1]
+    nonempty = nvert > 0
+    bx0 = np.full(len(nvert), nx)
+    bx1 = np.full(len(nvert), -1)
+    by0 = np.full(len(nvert), ny)
+    by1 = np.full(len(nvert), -1)
+    for arr, func, axis, rnd in [(bx0, np.minimum, 0, np.ceil),
+                                 (bx1, np.maximum, 0, np.floor),
+                                 (by0, np.minimum, 1, np.ceil),
+                                 (by1, np.maximum, 1, np.floor)]:
+        ext = np.zeros(len(nvert))
+        ext[nonempty] = func.reduceat(xy[:,axis], vstart[nonempty])
+        arr[valid] = rnd(ext[valid]).astype(int)
+
+    bx0 = np.maximum(bx0, 0)
+    bx1 = np.minimum(bx1, nx-1)
+    by0 = np.maximum(by0, 0)
+    by1 = np.minimum(by1, ny-1)
+
+    bw = np.maximum(bx1-bx0+1, 0)
+    bh = np.maximum(by1-by0+1, 0)
+    npix = bw*bh
+
+    polys = np.where(npix > 0)[0]
+    if len(polys) == 0:
+        return image.reshape(shape)
+
+    # Chunks of polygons with at most chunk_size candidates
+    csum = np.cumsum(npix[polys])
+    chunk = (csum - npix[polys]) // chunk_size
+
+    if poly_rows is not None:
+        # Keep the polygons of a row in the same chunk
+        poly_rows = np.asarray(poly_rows)
+        un, first, inv = np.unique(poly_rows[polys], return_index=True,
+                                   return_inverse=True)
+        chunk = chunk[first][inv.flatten()]
+
+    for c in np.unique(chunk):
+        cp = polys[chunk == c]
+        cn = npix[cp]
+
+        # Candidate pixels
+        pid = np.repeat(np.arange(len(cp)), cn)
+        k = np.arange(cn.sum()) - np.repeat(np.cumsum(cn)-cn, cn)
+        px = bx0[cp][pid] + k % bw[cp][pid]
+        py = by0[cp][pid] + k // bw[cp][pid]
+
+        # Crossing number over the padded edges
+        n = nvert[cp][pid]
+        v0 = vstart[cp][pid]
+        inside = np.zeros(len(px), dtype=bool)
+
+        for e in range(nvert[cp].max()):
+            i1 = np.where(e < n, e, n-1)
+            i2 = np.where(e < n-1, e+1, np.where(e == n-1, 0, n-1))
+            x1, y1 = xy[v0+i1,0], xy[v0+i1,1]
+            x2, y2 = xy[v0+i2,0], xy[v0+i2,1]
+
+            cross = (y1 > py) != (y2 > py)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                xc = (x2-x1)*(py-y1)/(y2-y1) + x1
+
+            inside ^= cross & (px < xc)
+
+        flat = py[inside]*nx + px[inside]
+        w = weights[cp][pid][inside]
+
+        if poly_rows is not None:
+            # Count each (row, pixel) once
+            key = poly_rows[cp][pid][inside].astype(np.int64)*(ny*nx) + flat
+            key, first = np.unique(key, return_index=True)
+            flat, w = flat[first], w[first]
+
+        image += np.bincount(flat, weights=w, minlength=ny*nx)
+
+    return image.reshape(shape)
+
+def _row_keys(tab, by_instrument=False):
+    """
+    Filter (or instrument_filter) keys of the rows of a table
+    """
+    keys = query.to_str_array(tab['filter'])
+    if by_instrument:
+        keys = np.char.add(np.char.add(query.to_str_array(tab['instdet']),
+                                       '_'), keys)
+
+    return keys
+
+def depth_maps(tab, pixscale=1., filters=None, by_instrument=False, wcs=None, shape=None, chunk_size=DEPTH_CHUNK_SIZE):
+    """
+    Exposure-time maps of a query table by filter
+
+    Parameters
+    ----------
+    tab : `~astropy.table.Table`
+        Query table with `footprint`, `filter` and `exptime` columns.
+
+    pixscale : float
+        Pixel scale, arcsec, if `wcs` is not specified.
+
+    filters : list or None
+        Filters of the maps.  If None, all filters in the table.
+
+    by_instrument : bool
+        Make maps by instrument and filter, with keys like
+        `WFC3-IR_F140W`.
+
+    wcs, shape : `~astropy.wcs.WCS`, (int, int)
+        Output grid.  If None, use `make_depth_wcs`.
+
+    chunk_size : int
+        See `rasterize_polygons`.
+
+    Returns
+    -------
+    maps : dict
+        Exposure time maps, seconds, keyed by filter.
+
+    wcs : `~astropy.wcs.WCS`
+        WCS of the maps.
+
+    """
+    fps = footprints.get_footprints(tab)
+
+    if wcs is None:
+        wcs, shape = make_depth_wcs(fps, pixscale=pixscale)
+
+    exptime = np.asarray(tab['exptime'], dtype=float)
+    row_keys = _row_keys(tab, by_instrument=by_instrument)
+
+    if filters is None:
+        filters = list(np.unique(row_keys))
+
+    maps = {}
+    for filt in filters:
+        sub = fps[row_keys == filt]
+
+        # Project all vertices at once
+        x, y = wcs.all_world2pix(sub.vertices[:,0], sub.vertices[:,1], 0)
+        xy = np.array([x, y]).T
+
+        # Weight of each polygon from its row, counted once per pixel for
+        # the overlapping polygons of a row
+        row_index = np.repeat(np.arange(len(sub)), sub.n_polygons)
+        weights = exptime[row_keys == filt][row_index]
+
+        maps[filt] = rasterize_polygons(xy, sub.poly_offsets, weights,
+                                        shape, chunk_size=chunk_size, 
+                                        poly_rows=row_index)
+
+    return maps, wcs
+
+def healpix_depth(tab, order=16, filters=None, by_instrument=False):
+    """
+    Exposure time on HEALPix pixels by filter
+
+    Parameters
+    ----------
+    tab : `~astropy.table.Table`
+        Query table with `footprint`, `filter` and `exptime` columns.
+
+    order : int
+        HEALPix order.  Pixels whose centers are inside a footprint get
+        its exposure time.
+
+    filters, by_instrument : list or None, bool
+        See `depth_maps`.
+
+    Returns
+    -------
+    maps : dict
+        Tuples of (nested pixel indices, exposure time) keyed by filter.
+
+    """
+    from . import coverage
+
+    fps = footprints.get_footprints(tab)
+    cov = coverage.CoverageArray.from_footprints(fps, order=order,
+                                                 inclusive=False)
+
+    # Expand the ranges to pixels
+    nr = cov.ranges[:,1] - cov.ranges[:,0]
+    pix = np.repeat(cov.ranges[:,0], nr)
+    pix += np.arange(nr.sum()) - np.repeat(np.cumsum(nr)-nr, nr)
+
+    range_row = np.repeat(np.arange(len(cov)), np.diff(cov.row_offsets))
+    pix_row = np.repeat(range_row, nr)
+
+    exptime = np.asarray(tab['exptime'], dtype=float)
+    row_keys = _row_keys(tab, by_instrument=by_instrument)
+
+    if filters is None:
+        filters = list(np.unique(row_keys))
+
+    maps = {}
+    for filt in filters:
+        sel = row_keys[pix_row] == filt
+        un, inv = np.unique(pix[sel], return_inverse=True)
+        maps[filt] = (un, np.bincount(inv.flatten(),
+                                      weights=exptime[pix_row[sel]]))
+
+    return maps
+
+def depth_area(depth, pixel_area, bins=None):
+    """
+    Area covered to at least a given depth
+
+    Parameters
+    ----------
+    depth : array
+        Exposure time map, e.g., from `depth_maps` or `healpix_depth`.
+
+    pixel_area : float
+        Pixel area, e.g., in sq. arcmin.
+
+    bins : array or None
+        Depth values.  If None, the distinct nonzero values of `depth`.
+
+    Returns
+    -------
+    bins : array
+        Depth values, increasing.
+
+    area : array
+        Area with depth greater or equal to each `bins` value.
+
+    """
+    values = np.sort(np.asarray(depth).flatten())
+    values = values[values > 0]
+
+    if bins is None:
+        bins = np.unique(values)
+
+    bins = np.asarray(bins, dtype=float)
+    npix = len(values) - np.searchsorted(values, bins, side='left')
+    return bins, npix*pixel_area
+
+def depth_at_area(depth, pixel_area, area):
+    """
+    Effective depth of a map: the largest exposure time reached over at
+    least `area`, in the units of `pixel_area`.  Zero if the covered area
+    is smaller than `area`.
+    """
+    values = np.sort(np.asarray(depth).flatten())[::-1]
+    npix = int(np.ceil(area/pixel_area))
+    if (npix < 1) | (npix > len(values)):
+        return 0.
+
+    return values[npix-1]
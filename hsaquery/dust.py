@@ -0,0 +1,250 @@
+"""
+Cached and batched Galactic dust reddening lookups
+"""
+import os
+import json
+
+import numpy as np
+
+from .coverage import healpix_index
+
+# IRSA dust service, set with the HSAQUERY_DUST_URL environment variable
+IRSA_DUST_URL = os.getenv('HSAQUERY_DUST_URL',
+                          'https://irsa.ipac.caltech.edu/cgi-bin/DUST/nph-dust')
+
+# Persistent cache of the IRSA results, set with HSAQUERY_DUST_CACHE.  Only
+# used if passed as `cache_file` to `get_dust_ebv`.
+DUST_CACHE_FILE = os.getenv('HSAQUERY_DUST_CACHE',
+                            os.path.join(os.path.expanduser('~'), '.hsaquery',
+                                         'dust_cache.json'))
+
+# HEALPix order of the cache keys.  Order 10 pixels are 3.4 arcmin,
+# smaller than the 6.1 arcmin resolution of the SFD map.
+DUST_HEALPIX_ORDER = 10
+
+# Schlafly & Finkbeiner (2011) recalibration of the SFD reddening
+SANDF_SCALE = 0.86
+
+DUST_TIMEOUT = 60
+
+# FITS-safe E(B-V) value of failed lookups in table headers, since NaN 
+# header values can't be written to FITS
+EBV_MISSING = -1.
+
+def read_dust_cache(cache_file=DUST_CACHE_FILE):
+    """
+    Read the dust cache, a dict of {'order/pix': {'SFD':ebv, 'SandF':ebv}}
+    """
+    if os.path.exists(cache_file):
+        with open(cache_file) as fp:
+            return json.load(fp)
+
+    return {}
+
+def write_dust_cache(values, cache_file=DUST_CACHE_FILE):
+    """
+    Add `values` to the dust cache, merging with the current file contents
+    and replacing the file atomically
+    """
+    dust_cache = read_dust_cache(cache_file)
+    dust_cache.update(values)
+
+    cache_dir = os.path.dirname(cache_file)
+    if cache_dir and not os.path.exists(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+
+    tmp_file = '{0}.{1}.tmp'.format(cache_file, os.getpid())
+    with open(tmp_file, 'w') as fp:
+        json.dump(dust_cache, fp)
+
+    os.replace(tmp_file, cache_file)
+
+def fetch_irsa_dust(ra, dec, url=IRSA_DUST_URL, timeout=DUST_TIMEOUT):
+    """
+    Query the IRSA dust service at a single position
+    http://irsa.ipac.caltech.edu/applications/DUST/docs/dustProgramInterface.html
+
+    Parameters
+    ----------
+    ra, dec : float
+        RA/Dec in decimal degrees.
+
+    url : str
+        Service URL.
+
+    timeout : float
+        Request timeout, seconds.
+
+    Returns
+    -------
+    ebv : dict
+        Reference pixel E(B-V) of the 'SFD' and 'SandF' maps.
+
+    """
+    import urllib.request
+    import xml.etree.ElementTree as ET
+
+    query = '{0}?locstr={1:.4f}+{2:.4f}+equ+j2000'.format(url, ra, dec)
+
+    req = urllib.request.Request(query)
+    response = urllib.request.urlopen(req, timeout=timeout)
+    root = ET.fromstring(response.read())
+
+    stats = root.find('./result/statistics')
+    ebv = {}
+    for k in ['SFD', 'SandF']:
+        value = stats.find('refPixelValue{0}'.format(k)).text
+        ebv[k] = float(value.split()[0])
+
+    return ebv
+
+def read_sfd_map(ra, dec, map_dir):
+    """
+    Read SFD E(B-V) from local copies of the SFD maps
+
+    Parameters
+    ----------
+    ra, dec : array-like
+        RA/Dec in decimal degrees.
+
+    map_dir : str
+        Directory with the `SFD_dust_4096_ngp.fits` and
+        `SFD_dust_4096_sgp.fits` Galactic-pole projections of
+        Schlegel et al. (1998).
+
+    Returns
+    -------
+    ebv : array
+        SFD E(B-V) at the nearest map pixel.
+
+    """
+    import astropy.units as u
+    import astropy.wcs as pywcs
+    import astropy.io.fits as pyfits
+    from astropy.coordinates import SkyCoord
+
+    ra = np.atleast_1d(np.asarray(ra, dtype=float))
+    dec = np.atleast_1d(np.asarray(dec, dtype=float))
+
+    coo = SkyCoord(ra=ra*u.deg, dec=dec*u.deg).galactic
+    l, b = coo.l.deg, coo.b.deg
+
+    ebv = np.zeros(len(ra))
+    for pole, sel in zip(['ngp', 'sgp'], [b >= 0, b < 0]):
+        if sel.sum() == 0:
+            continue
+
+        file = os.path.join(map_dir, 'SFD_dust_4096_{0}.fits'.format(pole))
+        with pyfits.open(file) as im:
+            wcs = pywcs.WCS(im[0].header)
+            data = im[0].data
+            x, y = wcs.all_world2pix(l[sel], b[sel], 0)
+            xi = np.clip(np.round(x).astype(int), 0, data.shape[1]-1)
+            yi = np.clip(np.round(y).astype(int), 0, data.shape[0]-1)
+            ebv[sel] = data[yi, xi]
+
+    return ebv
+
+def get_dust_ebv(ra, dec, type='SandF', order=DUST_HEALPIX_ORDER, cache_file=None, url=IRSA_DUST_URL, n_workers=8, timeout=DUST_TIMEOUT, map_dir=None, verbose=False):
+    """
+    Galactic E(B-V) at many positions
+
+    Positions are keyed by their HEALPix pixel and each pixel is fetched 
+    from the IRSA service once, at the first position that falls in it, 
+    with concurrent requests.  With a `cache_file`, only the pixels not 
+    found in the cache are fetched and they are added to the cache.
+
+    Parameters
+    ----------
+    ra, dec : array-like
+        RA/Dec in decimal degrees.
+
+    type : 'SFD' or 'SandF'
+        Dust model, with
+            SandF = Schlafly & Finkbeiner 2011 (ApJ 737, 103)
+              SFD = Schlegel et al. 1998 (ApJ 500, 525)
+
+    order : int
+        HEALPix order of the cache keys.
+
+    cache_file : str or None
+        JSON cache file, e.g., `DUST_CACHE_FILE` for a persistent cache in
+        the home directory.  If None (default), don't use a cache.
+
+    url : str
+        IRSA dust service URL.
+
+    n_workers : int
+        Number of threads for the IRSA requests.
+
+    timeout : float
+        Request timeout, seconds.
+
+    map_dir : str or None
+        If specified, read the values from local SFD maps (see
+        `read_sfd_map`) rather than from IRSA.
+
+    verbose : bool
+        Print status messages.
+
+    Returns
+    -------
+    ebv : array
+        Color excess E(B-V), in magnitudes.  NaN where the request failed.
+
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    ra = np.atleast_1d(np.asarray(ra, dtype=float))
+    dec = np.atleast_1d(np.asarray(dec, dtype=float))
+
+    if map_dir is not None:
+        ebv = read_sfd_map(ra, dec, map_dir)
+        if type == 'SandF':
+            ebv *= SANDF_SCALE
+
+        return ebv
+
+    pix = healpix_index(ra, dec, order=order)
+    keys = np.array(['{0}/{1}'.format(order, p) for p in pix])
+
+    if cache_file is not None:
+        dust_cache = read_dust_cache(cache_file)
+    else:
+        dust_cache = {}
+
+    un, first = np.unique(keys, return_index=True)
+    missing = [(k, i) for k, i in zip(un, first) if k not in dust_cache]
+
+    if verbose:
+        print('Dust: {0} positions, {1} pixels, {2} to fetch'.format(len(ra), len(un), len(missing)))
+
+    def fetch(i):
+        try:
+            return fetch_irsa_dust(ra[i], dec[i], url=url, timeout=timeout)
+        except Exception as err:
+            return err
+
+    if len(missing) > 0:
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+            results = list(pool.map(fetch, [i for k, i in missing]))
+
+        fetched, errors = {}, []
+        for (k, i), res in zip(missing, results):
+            if isinstance(res, Exception):
+                errors.append((i, res))
+            else:
+                fetched[k] = res
+        
+        if len(errors) > 0:
+            i, err = errors[0]
+            print('Warning: {0} of {1} dust queries failed, e.g., ({2:.4f}, {3:.4f}): {4}'.format(len(errors), len(missing), ra[i], dec[i], err))
+
+        dust_cache.update(fetched)
+        if (cache_file is not None) & (len(fetched) > 0):
+            write_dust_cache(fetched, cache_file=cache_file)
+
+    ebv = np.array([dust_cache[k][type] if k in dust_cache else np.nan
+                    for k in keys])
+
+    return ebv
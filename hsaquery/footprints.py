@@ -0,0 +1,382 @@
+"""
+Columnar representation of parsed footprint polygons
+"""
+import numpy as np
+
+# Characters that separate the numbers in the STC-S footprint strings
+FOOTPRINT_SEPARATORS = '{}(),'
+
+def _footprint_numbers(polystr):
+    """
+    Split a cleaned, upper-case footprint string into lists of number
+    strings, one per polygon
+    """
+    parts = []
+    for part in polystr.split('POLYGON'):
+        numbers = [t for t in part.split() if not t[0].isalpha()]
+        if len(numbers) > 0:
+            parts.append(numbers)
+
+    return parts
+
+def _clean_strings(strings):
+    """
+    Decode, capitalize and strip separators from an array of footprint
+    strings
+    """
+    from .query import to_str_array
+
+    text = np.char.upper(to_str_array(strings))
+    for c in FOOTPRINT_SEPARATORS:
+        text = np.char.replace(text, c, ' ')
+
+    return text
+
+def parse_footprint(polystr):
+    """
+    Parse a single footprint string
+
+    Handles both the '{ra1, dec1, ra2, dec2, ...}' form and the STC-S
+    'Polygon ICRS ra1 dec1 ra2 dec2 ...' form, including multiple polygons
+    and 'UNION' expressions.
+
+    Parameters
+    ----------
+    polystr : str or bytes
+        Footprint string.
+
+    Returns
+    -------
+    poly : list
+        List of (N,2) arrays of the polygon vertices.
+
+    """
+    if hasattr(polystr, 'decode'):
+        polystr = polystr.decode('utf-8')
+
+    polystr = polystr.upper()
+    for c in FOOTPRINT_SEPARATORS:
+        polystr = polystr.replace(c, ' ')
+
+    return [np.array(p, dtype=float).reshape((-1,2))
+            for p in _footprint_numbers(polystr)]
+
+class FootprintArray(object):
+    """
+    Footprints of a table parsed into flat vertex and offset arrays
+
+    Attributes
+    ----------
+    vertices : array (Nv,2)
+        RA/Dec of the vertices of all polygons, decimal degrees.
+
+    poly_offsets : array (Npoly+1)
+        Polygon `i` has vertices ``vertices[poly_offsets[i]:poly_offsets[i+1]]``.
+
+    row_offsets : array (Nrow+1)
+        Row `j` has polygons ``row_offsets[j]`` to ``row_offsets[j+1]-1``.
+
+    bbox : array (Nrow,4)
+        Bounding box [ra_min, ra_max, dec_min, dec_max] of each row.  NaN
+        for rows without a footprint.
+
+    """
+    def __init__(self, vertices, poly_offsets, row_offsets):
+        self.vertices = np.asarray(vertices, dtype=np.float64).reshape((-1,2))
+        self.poly_offsets = np.asarray(poly_offsets, dtype=np.int64)
+        self.row_offsets = np.asarray(row_offsets, dtype=np.int64)
+        self.bbox = self.compute_bbox()
+        self._geometry = None
+        self._coverage = {}
+
+    @classmethod
+    def from_strings(cls, strings):
+        """
+        Parse an array of footprint strings (see `parse_footprint`)
+        """
+        text = _clean_strings(strings)
+
+        numbers = []
+        poly_counts = []
+        row_counts = []
+
+        for polystr in text:
+            parts = _footprint_numbers(polystr)
+            row_counts.append(len(parts))
+            for p in parts:
+                if len(p) % 2 != 0:
+                    raise ValueError('Odd number of coordinates in footprint: {0}'.format(polystr))
+
+                poly_counts.append(len(p)//2)
+                numbers.extend(p)
+
+        vertices = np.array(numbers, dtype=np.float64).reshape((-1,2))
+        poly_offsets = np.append(0, np.cumsum(poly_counts, dtype=np.int64))
+        row_offsets = np.append(0, np.cumsum(row_counts, dtype=np.int64))
+
+        return cls(vertices, poly_offsets, row_offsets)
+
+    def compute_bbox(self):
+        """
+        Bounding box of each row
+        """
+        N = len(self)
+        bbox = np.full((N,4), np.nan)
+
+        npoly = np.diff(self.poly_offsets)
+        nrow = np.diff(self.row_offsets)
+        if (npoly.sum() == 0):
+            return bbox
+
+        # Per polygon, for polygons with vertices
+        pvalid = npoly > 0
+        pstart = self.poly_offsets[:-1][pvalid]
+        pbox = np.full((len(npoly), 4), np.nan)
+        for c, (func, axis) in enumerate([(np.minimum, 0), (np.maximum, 0),
+                                          (np.minimum, 1), (np.maximum, 1)]):
+            pbox[pvalid, c] = func.reduceat(self.vertices[:,axis], pstart)
+
+        # Per row, for rows with polygons
+        rvalid = nrow > 0
+        rstart = self.row_offsets[:-1][rvalid]
+        for c, func in enumerate([np.fmin, np.fmax, np.fmin, np.fmax]):
+            bbox[rvalid, c] = func.reduceat(pbox[:,c], rstart)
+
+        return bbox
+
+    def __len__(self):
+        return len(self.row_offsets) - 1
+
+    @property
+    def n_polygons(self):
+        """
+        Number of polygons of each row
+        """
+        return np.diff(self.row_offsets)
+
+    def orientat(self):
+        """
+        Vectorized ORIENTAT position angle of each row
+
+        Same as `~hsaquery.query.get_orientat`, i.e., the PA of the
+        detector +y axis assuming that the first two vertices of the first
+        polygon of each row are the LL and UL corners of the detector,
+        with a -0.24 degree offset and wrapped to [-180, 180).
+
+        Returns
+        -------
+        orientat : array
+            Position angles, degrees.  NaN for rows without a footprint.
+
+        """
+        orientat = np.full(len(self), np.nan)
+
+        valid = (self.n_polygons > 0)
+        first = self.poly_offsets[self.row_offsets[:-1][valid]]
+        p0 = self.vertices[first]
+        p1 = self.vertices[first+1]
+
+        dra = (p1[:,0]-p0[:,0])*np.cos(p0[:,1]/180*np.pi)
+        dde = p1[:,1] - p0[:,1]
+
+        pa = 90+np.arctan2(dra, dde)/np.pi*180
+        pa -= 0.24 # small offset to better match header keywords
+
+        orientat[valid] = (pa + 180) % 360 - 180
+        return orientat
+
+    def to_shapely(self):
+        """
+        Shapely geometry array with one geometry per row
+        
+        The polygons are built in bulk from the vertex and offset buffers
+        with `shapely.linearrings` and `shapely.polygons`.  Rows with 
+        several polygons are replaced by their union and rows without a 
+        footprint are None.  The array is computed once and cached.
+        
+        Returns
+        -------
+        geoms : array of `~shapely.geometry.Polygon`
+            Footprint geometries.
+        
+        """
+        import shapely
+        
+        if self._geometry is not None:
+            return self._geometry
+            
+        npoly = len(self.poly_offsets) - 1
+        geoms = np.full(len(self), None, dtype=object)
+        if npoly == 0:
+            self._geometry = geoms
+            return geoms
+            
+        ring_index = np.repeat(np.arange(npoly), np.diff(self.poly_offsets))
+        rings = shapely.linearrings(self.vertices, indices=ring_index)
+        polys = shapely.polygons(rings)
+        
+        single = self.n_polygons == 1
+        geoms[single] = polys[self.row_offsets[:-1][single]]
+        
+        for i in np.where(self.n_polygons > 1)[0]:
+            ro = self.row_offsets
+            geoms[i] = shapely.union_all(polys[ro[i]:ro[i+1]])
+        
+        self._geometry = geoms
+        return geoms
+    
+    def buffer(self, distance):
+        """
+        Vectorized buffer of the `to_shapely` geometries
+        """
+        import shapely
+        return shapely.buffer(self.to_shapely(), distance)
+    
+    def area(self):
+        """
+        Vectorized area of the `to_shapely` geometries, in the units of the
+        vertices (i.e., sq. degrees without a cos(dec) correction)
+        """
+        import shapely
+        return shapely.area(self.to_shapely())
+        
+    def overlaps(self, geom):
+        """
+        Rows whose footprints overlap a geometry
+        
+        The rows are first selected by their bounding boxes and the exact 
+        test, ``intersects & ~touches`` (i.e., the interiors intersect), is
+        evaluated in bulk on the remaining rows with `geom` prepared once.
+        
+        Parameters
+        ----------
+        geom : `~shapely.geometry.base.BaseGeometry`
+            Geometry, e.g., a group polygon.
+            
+        Returns
+        -------
+        mask : array of bool
+            True for the rows that overlap `geom`.
+        
+        """
+        import shapely
+        
+        mask = np.zeros(len(self), dtype=bool)
+        
+        xmin, ymin, xmax, ymax = geom.bounds
+        cand = ((self.bbox[:,0] <= xmax) & (self.bbox[:,1] >= xmin) & 
+                (self.bbox[:,2] <= ymax) & (self.bbox[:,3] >= ymin))
+        
+        if cand.sum() == 0:
+            return mask
+            
+        shapely.prepare(geom)
+        geoms = self.to_shapely()[cand]
+        mask[cand] = (shapely.intersects(geom, geoms) & 
+                      ~shapely.touches(geom, geoms))
+        
+        return mask
+        
+    def coverage(self, order=None):
+        """
+        HEALPix coverage of each row, a 
+        `~hsaquery.coverage.CoverageArray` computed once per `order`
+        """
+        from . import coverage
+        
+        if order is None:
+            order = coverage.COVERAGE_ORDER
+            
+        if order not in self._coverage:
+            self._coverage[order] = coverage.CoverageArray.from_footprints(self, order=order)
+            
+        return self._coverage[order]
+        
+    def polygons(self, i):
+        """
+        List of (N,2) vertex arrays of row `i`, as from `parse_footprint`
+        """
+        N = len(self)
+        if (i < -N) | (i >= N):
+            raise IndexError('index {0} is out of bounds for {1} rows'.format(i, N))
+
+        i = int(i) % N
+        po = self.poly_offsets
+        return [self.vertices[po[k]:po[k+1]]
+                for k in range(self.row_offsets[i], self.row_offsets[i+1])]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.polygons(i)
+
+    def __getitem__(self, idx):
+        """
+        Integer index: list of polygons of a row.  Slice, integer array or
+        boolean mask: new `FootprintArray` with the selected rows.
+        """
+        if np.isscalar(idx):
+            return self.polygons(idx)
+
+        rows = np.arange(len(self))[idx]
+
+        # Polygons of the selected rows
+        nrow = self.n_polygons[rows]
+        polys = np.repeat(self.row_offsets[rows], nrow)
+        polys += np.arange(nrow.sum()) - np.repeat(np.cumsum(nrow)-nrow, nrow)
+
+        # Vertices of the selected polygons
+        npoly = np.diff(self.poly_offsets)[polys]
+        verts = np.repeat(self.poly_offsets[polys], npoly)
+        verts += np.arange(npoly.sum()) - np.repeat(np.cumsum(npoly)-npoly,
+                                                   npoly)
+
+        return FootprintArray(self.vertices[verts],
+                              np.append(0, np.cumsum(npoly)),
+                              np.append(0, np.cumsum(nrow)))
+
+def get_footprints(tab, column='footprint', refresh=False):
+    """
+    Get the parsed `FootprintArray` of a table column, parsing it only once
+
+    The parsed footprints are cached on the column object, so later calls
+    with the same table reuse them.  The cache is checked only by the
+    column identity and length, so use `refresh` after changing footprint
+    values in place.  Replacing the column or slicing the table gives new
+    column objects that are parsed again (or use
+    `FootprintArray.__getitem__` to select rows of an existing
+    `FootprintArray`).
+
+    Parameters
+    ----------
+    tab : `~astropy.table.Table` or `FootprintArray`
+        Table with footprint strings.  A `FootprintArray` is returned
+        unchanged.
+
+    column : str
+        Footprint column name.
+
+    refresh : bool
+        Parse the column again and replace the cached footprints.
+
+    Returns
+    -------
+    fp : `FootprintArray`
+        Parsed footprints.
+
+    """
+    if isinstance(tab, FootprintArray):
+        return tab
+
+    col = tab[column]
+    fp = getattr(col, '_footprint_array', None)
+    if (fp is not None) & (not refresh):
+        if len(fp) == len(col):
+            return fp
+
+    fp = FootprintArray.from_strings(col)
+    try:
+        col._footprint_array = fp
+    except AttributeError:
+        pass
+
+    return fp
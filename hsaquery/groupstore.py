@@ -0,0 +1,211 @@
+"""
+Compact on-disk storage of overlap groups
+
+A group store is a directory of `.npy` arrays:
+
+    meta.json           geometry type, number of groups and offset levels
+    coords.npy          (Nc,2) float64 polygon vertices
+    offsets_{k}.npy     ragged offsets, see `~shapely.to_ragged_array`
+    members.npy         flat int64 member indices of all groups
+    member_offsets.npy  group `i` has ``members[member_offsets[i]:member_offsets[i+1]]``
+    names.npy           (optional) group names
+    boxes.npy           (optional) (N,3) [ra, dec, radius] query boxes
+
+All arrays can be memory-mapped, so a single group can be read without
+loading the whole store and without unpickling anything.
+"""
+import os
+import json
+import shutil
+
+import numpy as np
+
+GROUP_STORE_VERSION = 1
+
+def save_groups(path, polygons, members, names=None, boxes=None):
+    """
+    Save groups to a store directory
+
+    Parameters
+    ----------
+    path : str
+        Output directory, replaced if it exists.
+
+    polygons : list or array of `~shapely.geometry.Polygon`
+        Group polygons.  Polygons and MultiPolygons can be mixed.
+
+    members : list of array-like
+        Member indices of each group.
+
+    names : list or None
+        Group names.
+
+    boxes : array-like (N,3) or None
+        Query boxes of the groups.
+
+    """
+    import shapely
+
+    polygons = np.asarray(polygons, dtype=object)
+    N = len(polygons)
+
+    if N > 0:
+        geom_type, coords, offsets = shapely.to_ragged_array(polygons)
+    else:
+        # `to_ragged_array` doesn't take an empty array
+        geom_type = shapely.GeometryType.POLYGON
+        coords = np.zeros((0,2), dtype=np.float64)
+        offsets = (np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64))
+
+    counts = np.array([len(m) for m in members], dtype=np.int64)
+    member_offsets = np.append(0, np.cumsum(counts))
+    if N > 0:
+        flat_members = np.hstack([np.asarray(m, dtype=np.int64)
+                                  for m in members])
+    else:
+        flat_members = np.zeros(0, dtype=np.int64)
+
+    tmp_path = '{0}.tmp'.format(path.rstrip('/'))
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+
+    os.makedirs(tmp_path)
+
+    np.save(os.path.join(tmp_path, 'coords.npy'),
+            np.asarray(coords[:,:2], dtype=np.float64))
+
+    for k, off in enumerate(offsets):
+        np.save(os.path.join(tmp_path, 'offsets_{0}.npy'.format(k)),
+                np.asarray(off, dtype=np.int64))
+
+    np.save(os.path.join(tmp_path, 'members.npy'), flat_members)
+    np.save(os.path.join(tmp_path, 'member_offsets.npy'), member_offsets)
+
+    if names is not None:
+        np.save(os.path.join(tmp_path, 'names.npy'),
+                np.asarray(names, dtype=str))
+
+    if boxes is not None:
+        np.save(os.path.join(tmp_path, 'boxes.npy'),
+                np.asarray(boxes, dtype=np.float64).reshape((-1,3)))
+
+    meta = {'version':GROUP_STORE_VERSION, 'geometry_type':int(geom_type),
+            'n_groups':N, 'n_offsets':len(offsets)}
+
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as fp:
+        json.dump(meta, fp)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+
+    os.rename(tmp_path, path)
+
+class GroupStore(object):
+    """
+    Read a group store made by `save_groups`
+
+    Parameters
+    ----------
+    path : str
+        Store directory.
+
+    mmap : bool
+        Memory-map the arrays rather than reading them.
+
+    """
+    def __init__(self, path, mmap=True):
+        self.path = path
+        mmap_mode = 'r' if mmap else None
+
+        with open(os.path.join(path, 'meta.json')) as fp:
+            self.meta = json.load(fp)
+
+        def load(name):
+            file = os.path.join(path, name)
+            if os.path.exists(file):
+                return np.load(file, mmap_mode=mmap_mode)
+            else:
+                return None
+
+        self.coords = load('coords.npy')
+        self.offsets = [load('offsets_{0}.npy'.format(k))
+                        for k in range(self.meta['n_offsets'])]
+
+        self.flat_members = load('members.npy')
+        self.member_offsets = load('member_offsets.npy')
+
+        self.names = load('names.npy')
+        self.boxes = load('boxes.npy')
+
+        self._name_index = None
+
+    def __len__(self):
+        return self.meta['n_groups']
+
+    def members(self, i):
+        """
+        Member indices of group `i`
+        """
+        mo = self.member_offsets
+        return np.array(self.flat_members[mo[i]:mo[i+1]])
+
+    def polygon(self, i):
+        """
+        Polygon of group `i`, reading only its coordinates
+        """
+        import shapely
+
+        # Walk down the offset levels from the geometries to the vertices
+        lo, hi = i, i+1
+        offsets = []
+        for off in self.offsets[::-1]:
+            sub = np.array(off[lo:hi+1])
+            offsets.insert(0, sub - sub[0])
+            lo, hi = sub[0], sub[-1]
+
+        coords = np.array(self.coords[lo:hi])
+        geom_type = shapely.GeometryType(self.meta['geometry_type'])
+        return shapely.from_ragged_array(geom_type, coords,
+                                         tuple(offsets))[0]
+
+    def polygons(self):
+        """
+        Array of all group polygons
+        """
+        import shapely
+
+        geom_type = shapely.GeometryType(self.meta['geometry_type'])
+        return shapely.from_ragged_array(geom_type, np.array(self.coords),
+                                   tuple([np.array(o) for o in self.offsets]))
+
+    def index(self, name):
+        """
+        Index of a group from its name
+        """
+        if self._name_index is None:
+            self._name_index = dict([(str(n), j)
+                                     for j, n in enumerate(self.names)])
+
+        return self._name_index[name]
+
+    def __getitem__(self, i):
+        """
+        Dict with the `name`, `polygon`, `box` and `members` of a group,
+        selected by index or name
+        """
+        if isinstance(i, str):
+            i = self.index(i)
+
+        group = {'polygon':self.polygon(i), 'members':self.members(i)}
+
+        if self.names is not None:
+            group['name'] = str(self.names[i])
+
+        if self.boxes is not None:
+            group['box'] = list(self.boxes[i])
+
+        return group
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
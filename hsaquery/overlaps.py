@@ -2,322 +2,1485 @@
 Scripts to find overlapping HST data
 """
 
-from . import query, utils
+from . import query, utils, footprints, dust, groupstore, coverage
+
+# Run manifest of `find_overlaps`
+MANIFEST_FILE = 'overlaps_manifest.json'
+
+# Group store of `find_overlaps`, see `~hsaquery.groupstore`
+GROUP_STORE = 'overlaps_groups'
   
 def test():
     
-    import copy
+    import copy
+    
+    import numpy as np
+    import matplotlib.pyplot as plt
+
+    from shapely.geometry import Polygon
+    
+    from hsaquery import query
+    from hsaquery.query import parse_polygons
+
+    
+    # Example: high-z cluster pointings
+    tab = query.run_query(box=None, proposid=[14594], instruments=['WFC3-IR', 'ACS-WFC'], extensions=['FLT'], filters=['G102','G141'], extra=[])
+    
+    # Ebeling
+    tab = query.run_query(box=None, proposid=[15132,14098,13671,12884,12166,11103,10875,], instruments=['WFC3-IR'], extensions=['FLT'], filters=[], extra=[])
+    # Relics
+    tab = query.run_query(box=None, proposid=[14096], instruments=['WFC3-IR'], extensions=['FLT'], filters=[], extra=[])
+    tab = query.run_query(box=None, proposid=[11591], instruments=['WFC3-iR'], extensions=['FLT'], filters=[], extra=[])
+    tab = query.run_query(box=None, proposid=[13666,14148,14496], instruments=['WFC3-IR'], extensions=['FLT'], filters=[], extra=[])
+    tab = tab[tab['target'] != 'ANY']
+    
+    # MACS 0454
+    box = [73.5462181, -3.0147200, 3]
+    tab = query.run_query(box=box, proposid=[], instruments=['WFC3-IR', 'ACS-WFC'], extensions=['FLT'], filters=['F110W'], extra=[])
+    
+def connected_components(N, left, right):
+    """
+    Connected components of a graph from its edges
+    
+    Vectorized union-find, with the roots hooked to the smallest label of 
+    their neighbors and pointer jumping until no edge connects different 
+    components.
+    
+    Parameters
+    ----------
+    N : int
+        Number of nodes.
+    
+    left, right : array-like
+        Node indices of the edges.
+    
+    Returns
+    -------
+    labels : array (N)
+        Component label of each node, which is the smallest node index in 
+        the component.
+    
+    """
+    import numpy as np
+    
+    left = np.asarray(left, dtype=np.int64)
+    right = np.asarray(right, dtype=np.int64)
+    labels = np.arange(N)
+    
+    while True:
+        ml = np.minimum(labels[left], labels[right])
+        if (labels[left] == labels[right]).all():
+            break
+            
+        # Hook nodes and their roots
+        for side in [left, right]:
+            np.minimum.at(labels, labels[side], ml)
+            np.minimum.at(labels, side, ml)
+        
+        # Pointer jumping, labels[i] <= i is preserved
+        while True:
+            next_labels = labels[labels]
+            if (next_labels == labels).all():
+                break
+            
+            labels = next_labels
+    
+    return labels
+
+def split_groups(labels, N):
+    """
+    Sorted member indices of each of `N` groups labeled 0...N-1
+    """
+    import numpy as np
+    
+    order = np.argsort(labels, kind='stable')
+    counts = np.bincount(labels, minlength=N)
+    return np.split(order, np.cumsum(counts)[:-1])
+    
+def group_polygons(polygons, min_area=0.5/3600., verbose=False):
+    """
+    Group overlapping polygons
+    
+    Candidate pairs are found with a bulk `~shapely.STRtree` query and the 
+    exact intersection area is only computed for those pairs 
+    (`overlap_pairs`).  Polygons that overlap by more than `min_area` are 
+    linked and the groups are the connected components 
+    (`connected_components`), with the union of each group computed once 
+    at the end.  Groups whose unions overlap at all are then merged until 
+    no group unions overlap (`merge_groups`).
+    
+    Parameters
+    ----------
+    polygons : list or array of `~shapely.geometry.Polygon`
+        Polygons to group.
+    
+    min_area : float
+        Minimum overlap area of two polygons, in the polygon units 
+        (e.g., 0.5 sq. arcmin for polygons in degrees).
+        
+    verbose : bool
+        Print the number of groups.
+        
+    Returns
+    -------
+    match_poly : list
+        Union polygon of each group.
+    
+    match_ids : list
+        Sorted list of the polygon indices in each group.  The groups are 
+        sorted by their first index.
+    
+    """
+    import numpy as np
+    
+    polygons = np.asarray(polygons, dtype=object)
+    N = len(polygons)
+    
+    left, right = overlap_pairs(polygons, min_area=min_area)
+    labels = connected_components(N, left, right)
+    
+    return merge_groups(polygons, labels, verbose=verbose)
+
+def overlap_pairs(polygons, min_area=0.5/3600., queries=None):
+    """
+    Pairs of polygons that overlap by more than `min_area`
+    
+    Parameters
+    ----------
+    polygons : array of `~shapely.geometry.Polygon`
+        Polygons.
+    
+    min_area : float
+        Minimum overlap area.
+    
+    queries : array or None
+        Only find the pairs that include at least one of these polygon 
+        indices.  If None, all pairs.
+        
+    Returns
+    -------
+    left, right : array
+        Polygon indices of the pairs, with ``left < right``.
+    
+    """
+    import numpy as np
+    import shapely
+    from shapely.strtree import STRtree
+    
+    tree = STRtree(polygons)
+    if queries is None:
+        left, right = tree.query(polygons, predicate='intersects')
+    else:
+        queries = np.asarray(queries)
+        qi, right = tree.query(polygons[queries], predicate='intersects')
+        left = queries[qi]
+        
+        # Order and remove duplicates of pairs of two query polygons
+        left, right = np.minimum(left, right), np.maximum(left, right)
+        code = np.unique(left*len(polygons) + right)
+        left, right = code // len(polygons), code % len(polygons)
+    
+    pair = left < right
+    left, right = left[pair], right[pair]
+    
+    area = shapely.area(shapely.intersection(polygons[left], 
+                                             polygons[right]))
+    overlap = area > min_area
+    
+    return left[overlap], right[overlap]
+
+def union_groups(polygons, members, pool=None, chunk_size=256):
+    """
+    Union of the polygons of each group
+    
+    Parameters
+    ----------
+    polygons : array of `~shapely.geometry.Polygon`
+        Polygons.
+    
+    members : list
+        Polygon indices of each group.
+    
+    pool : `~concurrent.futures.Executor` or None
+        If specified, compute the unions of chunks of `chunk_size` groups
+        in the pool.
+        
+    Returns
+    -------
+    unions : array
+        Union polygons.
+    
+    """
+    import numpy as np
+    import shapely
+    
+    if pool is None:
+        return np.array([shapely.union_all(polygons[ids]) 
+                         for ids in members], dtype=object)
+    
+    if len(members) == 0:
+        return np.zeros(0, dtype=object)
+        
+    futures = []
+    for i in range(0, len(members), chunk_size):
+        chunk = [polygons[ids] for ids in members[i:i+chunk_size]]
+        futures.append(pool.submit(_union_each, chunk))
+    
+    return np.hstack([f.result() for f in futures])
+
+def _union_each(chunk):
+    """
+    Union of each array of polygons in a list
+    """
+    import numpy as np
+    import shapely
+    return np.array([shapely.union_all(p) for p in chunk], dtype=object)
+    
+def merge_groups(polygons, labels, verbose=False, pool=None):
+    """
+    Merge the groups of `labels` whose unions overlap, until no group 
+    unions overlap
+    
+    Parameters
+    ----------
+    polygons : array of `~shapely.geometry.Polygon`
+        Polygons.
+    
+    labels : array
+        Initial group label of each polygon, e.g., from 
+        `connected_components`.
+    
+    verbose : bool
+        Print the number of groups.
+    
+    pool : `~concurrent.futures.Executor` or None
+        Pool for the group unions, see `union_groups`.
+        
+    Returns
+    -------
+    match_poly, match_ids : list, list
+        See `group_polygons`.
+    
+    """
+    import numpy as np
+    import shapely
+    from shapely.strtree import STRtree
+    
+    # Join groups whose unions overlap
+    iter = 0
+    while True:
+        un, inv = np.unique(labels, return_inverse=True)
+        inv = inv.flatten()
+        members = split_groups(inv, len(un))
+        match_poly = union_groups(polygons, members, pool=pool)
+        
+        iter += 1
+        if verbose:
+            print('Iter #{0}, N_Patch = {1}'.format(iter, len(un)))
+            
+        tree = STRtree(match_poly)
+        gleft, gright = tree.query(match_poly, predicate='intersects')
+        pair = gleft < gright
+        gleft, gright = gleft[pair], gright[pair]
+        
+        area = shapely.area(shapely.intersection(match_poly[gleft], 
+                                                 match_poly[gright]))
+        
+        if (area > 0).sum() == 0:
+            break
+        
+        glabels = connected_components(len(un), gleft[area > 0], 
+                                       gright[area > 0])
+        labels = un[glabels][inv]
+    
+    match_ids = [list(ids) for ids in members]
+    
+    return list(match_poly), match_ids
+    
+def update_groups(match_poly, match_ids, new_polygons, first_index=None, verbose=False):
+    """
+    Add new polygons to an existing grouping
+    
+    `group_polygons` merges groups whose unions overlap at all, so its 
+    groups are the connected components of the positive-area overlaps 
+    between the polygons.  The new polygons are therefore linked to the 
+    existing groups whose union polygons they overlap and to each other, 
+    and the connected components of the existing groups and the new 
+    polygons give the same groups as grouping everything from scratch.  
+    Only the new polygons are tested, so the cost scales with the new data.
+    
+    Parameters
+    ----------
+    match_poly, match_ids : list, list
+        Existing groups, e.g., from `group_polygons` or a
+        `~hsaquery.groupstore.GroupStore`.
+    
+    new_polygons : list or array of `~shapely.geometry.Polygon`
+        New polygons, buffered like those of the existing groups.
+    
+    first_index : int or None
+        Member index of the first new polygon, e.g., the number of rows of 
+        the parent table before the new rows were appended.  If None, one 
+        more than the largest existing member index.
+    
+    verbose : bool
+        Print a summary of the changes.
+        
+    Returns
+    -------
+    match_poly, match_ids : list, list
+        Updated groups, sorted by their first member index as in 
+        `group_polygons`.
+    
+    changes : dict
+        Indices of the updated groups:
+            `unchanged`: groups with the same members
+            `changed`: existing groups with new members
+            `merged`: groups made from more than one existing group
+            `new`: groups of only new polygons
+        and `parents`, the list of the indices of the existing groups that 
+        went into each updated group.
+    
+    """
+    import numpy as np
+    import shapely
+    from shapely.strtree import STRtree
+    
+    match_poly = np.asarray(match_poly, dtype=object)
+    new_polygons = np.asarray(new_polygons, dtype=object)
+    G, M = len(match_poly), len(new_polygons)
+    
+    if first_index is None:
+        first_index = max([max(ids) for ids in match_ids if len(ids) > 0] 
+                          + [-1]) + 1
+    
+    # New polygons that overlap existing groups
+    tree = STRtree(match_poly)
+    qi, gi = tree.query(new_polygons, predicate='intersects')
+    area = shapely.area(shapely.intersection(new_polygons[qi], 
+                                             match_poly[gi]))
+    
+    # New polygons that overlap each other
+    left, right = overlap_pairs(new_polygons, min_area=0.)
+    
+    # Components of existing groups (0...G-1) and new polygons (G...)
+    labels = connected_components(G+M, np.hstack([gi[area > 0], G+left]),
+                                  np.hstack([G+qi[area > 0], G+right]))
+    
+    un, inv = np.unique(labels, return_inverse=True)
+    components = split_groups(inv.flatten(), len(un))
+    
+    groups = []
+    for nodes in components:
+        old = nodes[nodes < G]
+        new = nodes[nodes >= G] - G
+        
+        ids = [j for g in old for j in match_ids[g]] 
+        ids = sorted(ids + list(first_index + new))
+        
+        if len(new) == 0:
+            poly = match_poly[old[0]]
+        else:
+            poly = shapely.union_all(np.hstack([match_poly[old], 
+                                                new_polygons[new]]))
+        
+        groups.append((ids, poly, list(old), len(new)))
+    
+    groups.sort(key=lambda x: x[0][0])
+    
+    changes = {'unchanged':[], 'changed':[], 'merged':[], 'new':[], 
+               'parents':[]}
+    
+    for i, (ids, poly, old, n_new) in enumerate(groups):
+        changes['parents'].append(old)
+        if len(old) == 0:
+            changes['new'].append(i)
+        elif len(old) > 1:
+            changes['merged'].append(i)
+        elif n_new > 0:
+            changes['changed'].append(i)
+        else:
+            changes['unchanged'].append(i)
+    
+    if verbose:
+        print('Update groups: {0} new polygons, {1} > {2} groups ({3} changed, {4} merged, {5} new)'.format(M, G, len(groups), len(changes['changed']), len(changes['merged']), len(changes['new'])))
+        
+    match_poly = [g[1] for g in groups]
+    match_ids = [g[0] for g in groups]
+    
+    return match_poly, match_ids, changes
+    
+def update_group_store(tab, first_index, group_store=GROUP_STORE, buffer_arcmin=1., verbose=True):
+    """
+    Add the rows appended to a parent table to the groups of a group store
+    
+    Parameters
+    ----------
+    tab : `~astropy.table.Table`
+        Parent table with `footprint`, `ra` and `dec` columns, where the 
+        rows from `first_index` are new.
+    
+    first_index : int
+        Parent table index of the first new row, e.g., the number of rows 
+        of the parent table used for the existing groups.
+        
+    group_store : str
+        Group store directory made by `find_overlaps`, updated in place.  
+        The names and query boxes of the unchanged groups are kept and 
+        those of the other groups are computed as in `find_overlaps`.  
+        The products of the `parents` of the changed groups can be removed
+        with `retire_group`.
+    
+    buffer_arcmin : float
+        Buffer of the footprints, as in `find_overlaps`.
+    
+    verbose : bool
+        Print a summary of the changes.
+    
+    Returns
+    -------
+    changes : dict
+        Updated groups, see `update_groups`.
+    
+    """
+    store = groupstore.GroupStore(group_store)
+    match_ids = [store.members(i) for i in range(len(store))]
+    
+    fps = footprints.get_footprints(tab[first_index:])
+    polygons = fps.buffer(buffer_arcmin/60)
+    
+    match_poly, match_ids, changes = update_groups(store.polygons(), 
+                                  match_ids, polygons, 
+                                  first_index=first_index, verbose=verbose)
+    
+    names, boxes = [None]*len(match_ids), [None]*len(match_ids)
+    if (store.names is not None) & (store.boxes is not None):
+        for i in changes['unchanged']:
+            j = changes['parents'][i][0]
+            names[i], boxes[i] = str(store.names[j]), list(store.boxes[j])
+    
+    todo = [i for i in range(len(match_ids)) if names[i] is None]
+    if len(todo) > 0:
+        todo_names, todo_boxes = group_boxes(tab, 
+                                             [match_poly[i] for i in todo],
+                                             [match_ids[i] for i in todo])
+        for i, name, box in zip(todo, todo_names, todo_boxes):
+            names[i], boxes[i] = name, box
+        
+    groupstore.save_groups(group_store, match_poly, match_ids, names=names,
+                           boxes=boxes)
+    return changes
+
+def group_names(tab, match_ids):
+    """
+    Names of groups from the mean RA/Dec of their members
+    
+    Returns
+    -------
+    names : array
+        Group names like `j123456m123456`.
+    
+    ra, dec : array
+        Group centers.
+        
+    """
+    import numpy as np
+    
+    ra = np.array([np.mean(tab['ra'][ids]) for ids in match_ids])
+    dec = np.array([np.mean(tab['dec'][ids]) for ids in match_ids])
+    names = utils.radec_to_targname_array(ra=ra, dec=dec, scl=1000)
+    return names, ra, dec
+
+def group_boxes(tab, match_poly, match_ids):
+    """
+    Names and [ra, dec, radius] query boxes of groups, with the box radius
+    1.5 times the largest extent of the group polygon from the center
+    """
+    import numpy as np
+    
+    names, group_ra, group_dec = group_names(tab, match_ids)
+    
+    boxes = []
+    for p, ra, dec in zip(match_poly, group_ra, group_dec):
+        # Get poly size
+        xy = p.convex_hull.boundary.xy
+        xradius = np.abs(xy[0]-ra).max()*np.cos(dec/180*np.pi)*60
+        yradius = np.abs(xy[1]-dec).max()*60
+        
+        boxes.append([ra, dec, np.maximum(xradius*1.5, yradius*1.5)])
+    
+    return names, boxes
+    
+def retire_group(jname, manifest=None):
+    """
+    Remove the products of a group that was replaced, e.g., by an updated
+    group with new members, and its entry in a run manifest dict
+    """
+    import os
+    
+    entry = None
+    if manifest is not None:
+        entry = manifest['groups'].pop(jname, None)
+    
+    if entry is not None:
+        files = entry['outputs']
+    else:
+        files = group_output_files(jname, make_figure=True)
+    
+    for file in files:
+        if os.path.exists(file):
+            os.remove(file)
+    
+def find_overlaps(tab, buffer_arcmin=1., filters=[], instruments=['WFC3-IR', 'WFC3-UVIS', 'ACS-WFC'], proposid=[], SKIP=False, extra=query.DEFAULT_EXTRA, close=True, use_parent=False, n_workers=1, make_figures=True, manifest=None, group_store=GROUP_STORE, coverage_order=None, partition_order=None, partition_workdir=None):
+    """
+    Compute discrete groups from the parent table and find overlapping
+    datasets.
+    
+    Parameters
+    ----------
+    tab : `~astropy.table.Table`
+        Parent table from which to compute the groups.
+        
+    buffer_arcmin : float
+        Buffer, in arcminutes, to add around the parent group polygons
+        
+    filters : list
+        List of filters to query.  If empty then return all.
+        
+    instruments : list
+        List of instruments to query.  If empty then return all.
+    
+    proposid : list
+        List of proposal IDs to query.  If empty then return all.
+    
+    SKIP : bool
+        Don't recompute if a table with the same rootname already exists.
+        
+    extra : list
+        Extra query parameters.
+        
+    close : bool
+        If true, close the figure objects.
+    
+    use_parent : bool
+        Use parent table rather than performing a new query
+    
+    n_workers : int
+        If greater than 1, run the queries and dust lookups of the groups 
+        in a pool of `n_workers` threads and the overlap tests, figures and
+        output files in a pool of `n_workers` processes.  The figures are 
+        then always closed.
+    
+    make_figures : bool
+        Make the group figures along with the tables.  If False, make them
+        later with `render_figures`.
+    
+    manifest : str or None
+        JSON run manifest file, e.g., `MANIFEST_FILE`.  The grouping and,
+        for each group, its members, a hash of its inputs and its output 
+        files are recorded there as the groups are completed.  On a rerun,
+        the grouping is reused if the parent footprints haven't changed 
+        and the groups with unchanged inputs and existing outputs are read
+        from disk rather than recomputed.  If rows were only appended to 
+        the table since the manifest grouping, the new rows are added to 
+        the groups with `update_groups`, only the groups that changed are
+        recomputed and the products and manifest entries of the groups 
+        they replace are removed (`retire_group`).  Since the archive queries of the groups aren't 
+        rerun, new archive data of unchanged groups are only found with a
+        new manifest.  If None (default), don't use a manifest and 
+        recompute everything.
+    
+    group_store : str or None
+        Directory where the group polygons, members, names and query boxes
+        are saved with `~hsaquery.groupstore.save_groups`.  If None, don't
+        save them.
+    
+    coverage_order : int or None
+        If specified, select the query rows that overlap each group by 
+        their HEALPix coverage at this order, see `process_group`.
+    
+    partition_order : int or None
+        If specified, compute the grouping in HEALPix tiles of this order
+        with `n_workers` processes (`~hsaquery.partition.partition_groups`).
+        The groups are the same as with the single-process grouping.
+    
+    partition_workdir : str or None
+        Shared work directory for the partitioned grouping, where tiles can
+        also be processed by other nodes with 
+        `~hsaquery.partition.run_partition_tiles`.
+        
+    Returns
+    -------
+    tables : list
+        
+        List of grouped tables (`~astropy.table.Table`), in the order of 
+        the groups.  Groups that fail are reported and skipped.
+
+    """
+    import os
+    
+    import numpy as np
+    import shapely
+    from astropy.table import Table
+    
+    # Get shapely polygons for each exposures
+    poly_buffer = buffer_arcmin/60 # ~1 arcmin, but doesn't account for cos(dec)
+    #poly_buffer = 0.5/60 # ~1 arcmin, but doesn't account for cos(dec)
+    
+    fps = footprints.get_footprints(tab)
+    polygons = fps.buffer(poly_buffer)
+    
+    run_manifest = read_manifest(manifest)
+    
+    # Combine polygons that overlap, or reuse the grouping of the manifest
+    footprint_strings = list(query.to_str_array(tab['footprint']))
+    grouping_hash = hash_inputs(footprint_strings, buffer_arcmin)
+    
+    grouping = run_manifest['grouping']
+    
+    store = None
+    if (group_store is not None) & ('match_ids' in grouping):
+        if os.path.exists(group_store):
+            store = groupstore.GroupStore(group_store)
+            if len(store) != len(grouping['match_ids']):
+                store = None
+    
+    # Rows appended to the table of the manifest grouping
+    n_prev = grouping.get('n_rows', 0)
+    is_appended = (store is not None) & (0 < n_prev < len(tab))
+    if is_appended:
+        prev_hash = hash_inputs(footprint_strings[:n_prev], buffer_arcmin)
+        is_appended &= prev_hash == grouping['hash']
+    
+    if grouping.get('hash', None) == grouping_hash:
+        print('Use grouping from {0}'.format(manifest))
+        match_ids = grouping['match_ids']
+        
+        if store is not None:
+            match_poly = list(store.polygons())
+        else:
+            match_poly = [shapely.union_all(polygons[ids]) 
+                          for ids in match_ids]
+    elif is_appended:
+        print('Update grouping from {0} with {1} new rows'.format(manifest, len(tab)-n_prev))
+        prev_names = group_names(tab, grouping['match_ids'])[0]
+        match_poly, match_ids, changes = update_groups(store.polygons(), 
+                                        grouping['match_ids'], 
+                                        polygons[n_prev:], 
+                                        first_index=n_prev, verbose=True)
+    elif partition_order is not None:
+        from . import partition
+        match_poly, match_ids = partition.partition_groups(polygons, 
+                                    order=partition_order, 
+                                    n_workers=n_workers, 
+                                    workdir=partition_workdir, verbose=True)
+    else:
+        match_poly, match_ids = group_polygons(polygons, verbose=True)
+    
+    if grouping.get('hash', None) != grouping_hash:
+        run_manifest['grouping'] = {'hash':grouping_hash, 'n_rows':len(tab),
+                      'match_ids':[[int(j) for j in ids] for ids in match_ids]}
+    
+    # Group names and query boxes from RA/Dec
+    names, boxes = group_boxes(tab, match_poly, match_ids)
+    
+    # Remove the products of the groups that were updated with new rows, 
+    # which are replaced by those of the new group names
+    if is_appended:
+        updated = changes['changed'] + changes['merged']
+        retired = set([prev_names[j] for i in updated 
+                       for j in changes['parents'][i]])
+        
+        for jname in sorted(retired - set(names)):
+            print('Retire group {0}'.format(jname))
+            retire_group(jname, run_manifest)
+    
+    query_kws = dict(use_parent=use_parent, proposid=proposid, 
+                     instruments=instruments, filters=filters, extra=extra)
+    
+    groups = []
+    results = {}
+    for i in range(len(match_poly)):
+        p = match_poly[i]
+        idx = np.array(match_ids[i])
+        box = boxes[i]
+        jname = names[i]
+        print('\n\n', i, jname, box[0], box[1])
+
+        if (os.path.exists('{0}_footprint.fits'.format(jname))) & SKIP:
+            continue
+        
+        if 'observation_id' in tab.colnames:
+            members = [str(o) for o in tab['observation_id'][idx]]
+        else:
+            members = [int(j) for j in idx]
+            
+        input_hash = hash_inputs([footprint_strings[j] for j in idx], 
+                                 members, buffer_arcmin, query_kws)
+        
+        group = {'index':i, 'jname':jname, 'p':p, 'box':box, 'idx':idx,
+                 'members':members, 'hash':input_hash}
+        
+        entry = run_manifest['groups'].get(jname, None)
+        if group_is_complete(entry, input_hash):
+            print('Read {0} from {1}'.format(jname, manifest))
+            results[i] = Table.read('{0}_footprint.fits'.format(jname))
+            continue
+            
+        groups.append(group)
+    
+    if group_store is not None:
+        groupstore.save_groups(group_store, match_poly, match_ids, 
+                               names=names, boxes=boxes)
+        
+    if manifest is not None:
+        write_manifest(run_manifest, manifest)
+    
+    # Galactic extinction of all groups at once
+    if len(groups) > 0:
+        ebv = dust.get_dust_ebv([g['box'][0] for g in groups], 
+                                [g['box'][1] for g in groups], type='SandF')
+        for group, ebv_i in zip(groups, ebv):
+            group['ebv'] = ebv_i
+    
+    def group_done(group, xtab):
+        results[group['index']] = xtab
+        
+        # Groups with failed dust lookups are redone on the next run
+        if (manifest is None) | (not np.isfinite(group['ebv'])):
+            return
+        
+        run_manifest['groups'][group['jname']] = {'members':group['members'],
+                'hash':group['hash'], 
+                'outputs':group_output_files(group['jname'], make_figures)}
+                
+        write_manifest(run_manifest, manifest)
+    
+    def run_group_query(group):
+        try:
+            return query_group(group['box'], tab=tab, ebv=group['ebv'],
+                               **query_kws)
+        except Exception as err:
+            print('Group {0} query failed: {1}'.format(group['jname'], err))
+            return None
+    
+    def process_kws(group, xtab, ebv):
+        return dict(xtab=xtab, p=group['p'], box=group['box'], 
+                    jname=group['jname'], ebv=ebv, parent=tab[group['idx']],
+                    parent_fps=fps[group['idx']], 
+                    coverage_order=coverage_order, 
+                    buffer_arcmin=buffer_arcmin)
+    
+    if n_workers > 1:
+        from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+        
+        with ThreadPoolExecutor(max_workers=n_workers) as tpool, ProcessPoolExecutor(max_workers=n_workers) as ppool:
+            
+            query_futures = [tpool.submit(run_group_query, group) 
+                             for group in groups]
+            
+            futures = []
+            for group, qf in zip(groups, query_futures):
+                res = qf.result()
+                if res is None:
+                    futures.append(None)
+                else:
+                    kws = process_kws(group, *res)
+                    futures.append(ppool.submit(process_group, close=True,
+                                                use_pyplot=False, 
+                                                make_figure=make_figures,
+                                                **kws))
+            
+            for group, future in zip(groups, futures):
+                if future is None:
+                    continue
+                
+                try:
+                    group_done(group, future.result())
+                except Exception as err:
+                    print('Group {0} failed: {1}'.format(group['jname'], err))
+    
+    else:
+        for group in groups:
+            res = run_group_query(group)
+            if res is None:
+                continue
+            
+            try:
+                xtab = process_group(close=close, use_pyplot=True, 
+                                     make_figure=make_figures,
+                                     **process_kws(group, *res))
+                group_done(group, xtab)
+            except Exception as err:
+                print('Group {0} failed: {1}'.format(group['jname'], err))
+    
+    return [results[i] for i in sorted(results)]
+
+def hash_inputs(*args):
+    """
+    SHA1 hash of the JSON representation of `args`
+    """
+    import json
+    import hashlib
+    
+    text = json.dumps(args, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+    
+def read_manifest(file=MANIFEST_FILE):
+    """
+    Read a `find_overlaps` run manifest, or return an empty one if `file` 
+    is None or doesn't exist
+    """
+    import os
+    import json
+    
+    if file is not None:
+        if os.path.exists(file):
+            with open(file) as fp:
+                manifest = json.load(fp)
+                
+            return manifest
+    
+    return {'grouping':{}, 'groups':{}}
+    
+def write_manifest(manifest, file=MANIFEST_FILE):
+    """
+    Write a run manifest, replacing `file` atomically
+    """
+    import os
+    import json
+    
+    tmp_file = '{0}.tmp'.format(file)
+    with open(tmp_file, 'w') as fp:
+        json.dump(manifest, fp, indent=1)
+        
+    os.replace(tmp_file, file)
+
+def group_output_files(jname, make_figure=True):
+    """
+    Output files of a group made by `process_group`
+    """
+    files = ['{0}_info.dat'.format(jname), '{0}_footprint.fits'.format(jname),
+             '{0}_footprint.json'.format(jname)]
+             
+    if make_figure:
+        files.append('{0}_footprint.pdf'.format(jname))
+    
+    return files
+
+def group_is_complete(entry, input_hash):
+    """
+    Check if a manifest entry of a group has the same input hash and all 
+    of its output files exist
+    """
+    import os
+    
+    if entry is None:
+        return False
+    
+    if entry['hash'] != input_hash:
+        return False
+        
+    return all([os.path.exists(file) for file in entry['outputs']])
+
+def query_group(box, tab=None, use_parent=False, proposid=[], instruments=['WFC3-IR', 'WFC3-UVIS', 'ACS-WFC'], filters=[], extra=query.DEFAULT_EXTRA, ebv=None):
+    """
+    Query the archive around a group and get the Galactic extinction
+    
+    Parameters
+    ----------
+    box : list
+        [ra, dec, radius] box query, see `~hsaquery.query.run_query`.
+        
+    tab : `~astropy.table.Table`
+        Parent table, used instead of the query if `use_parent` is True.
+    
+    ebv : float or None
+        Galactic E(B-V), e.g., from a batch `~hsaquery.dust.get_dust_ebv` 
+        lookup, which is NaN if the lookup failed.  If None, get it with 
+        `~hsaquery.utils.get_irsa_dust`.
+        
+    Other parameters are passed to `~hsaquery.query.run_query`.
+    
+    Returns
+    -------
+    xtab : `~astropy.table.Table`
+        Query result.
+    
+    ebv : float
+        Galactic E(B-V) at the box center, or NaN if the lookup failed.
+        
+    """
+    if use_parent:
+        xtab = tab.copy()
+    else:
+        xtab = query.run_query(box=box, proposid=proposid, instruments=instruments, extensions=['FLT','C1M'], filters=filters, extra=extra)
+    
+    if xtab is False:
+        raise ValueError('No query results')
+        
+    if ebv is None:
+        ebv = utils.get_irsa_dust(box[0], box[1], type='SandF')
+        
+    return xtab, ebv
+    
+def process_group(xtab, p, box, jname, ebv, parent=None, parent_fps=None, close=True, use_pyplot=True, make_figure=True, coverage_order=None, buffer_arcmin=1.):
+    """
+    Select the query rows that overlap a group polygon and write the 
+    group products: `{jname}_info.dat`, `{jname}_footprint.fits`, 
+    `{jname}_footprint.json` and `{jname}_footprint.pdf`.
+    
+    Parameters
+    ----------
+    xtab : `~astropy.table.Table`
+        Query result from `query_group`.
+    
+    p : `~shapely.geometry.Polygon`
+        Group polygon.
+    
+    box : list
+        [ra, dec, radius] of the group query.
+    
+    jname : str
+        Group name.
+    
+    ebv : float
+        Galactic E(B-V).  NaN values of failed lookups are written as 
+        `~hsaquery.dust.EBV_MISSING` in the table header.
+    
+    parent, parent_fps : `~astropy.table.Table`, 
+                         `~hsaquery.footprints.FootprintArray`
+        Parent table rows of the group and their footprints, for the 
+        figure.
+    
+    close, use_pyplot : bool
+        See `make_group_figure`.
+    
+    make_figure : bool
+        Make the figure.
+    
+    coverage_order : int or None
+        If specified, first select the rows whose HEALPix coverage at this
+        order overlaps the coverage of `p` and only test those with the 
+        exact polygons (`~hsaquery.coverage.coverage_overlaps`).  The 
+        coverage of `p` is the union of the coverages of the `parent_fps`
+        footprints buffered by `buffer_arcmin`, if they are specified.
+    
+    buffer_arcmin : float
+        Buffer of the group polygon, see `find_overlaps`.
+        
+    Returns
+    -------
+    xtab : `~astropy.table.Table`
+        Rows of the query that overlap `p`.
+    
+    """
+    import numpy as np
+    
+    ra, dec = box[0], box[1]
+    
+    xtab.meta['NAME'] = jname
+    xtab.meta['RA'] = ra
+    xtab.meta['DEC'] = dec
+    if np.isfinite(ebv):
+        xtab.meta['MW_EBV'] = ebv
+    else:
+        xtab.meta['MW_EBV'] = dust.EBV_MISSING
+          
+    # Only include ancillary data that directly overlaps with the primary
+    # polygon
+    xfps = footprints.get_footprints(xtab)
+    if coverage_order is not None:
+        if parent_fps is not None:
+            parent_cov = coverage.CoverageArray.from_footprints(parent_fps,
+                                   order=coverage_order, 
+                                   buffer=buffer_arcmin/60)
+            group_cov = parent_cov.union()
+        else:
+            group_cov = None
+        
+        pointing_overlaps = coverage.coverage_overlaps(xfps, geom=p, 
+                                          coverage=group_cov,
+                                          order=coverage_order, refine=True)
+    else:
+        pointing_overlaps = xfps.overlaps(p)
+    
+    xtab = xtab[pointing_overlaps]
+    xfps = xfps[pointing_overlaps]
+    
+    write_group_info(xtab, jname)
+    
+    xtab.write('{0}_footprint.fits'.format(jname), format='fits', overwrite=True)
+    save_group_polygon(jname, p, box)
+    
+    # Figure last, so that it isn't older than the products it shows 
+    # (see `figure_is_stale`)
+    if make_figure:
+        make_group_figure(xtab, p, box, jname, ebv, parent=parent, 
+                          xfps=xfps, parent_fps=parent_fps, close=close, 
+                          use_pyplot=use_pyplot)
+    
+    return xtab
+
+def save_group_polygon(jname, p, box, path='./'):
+    """
+    Save the group polygon, as hex WKB, and query box to 
+    `{jname}_footprint.json`
+    """
+    import os
+    import json
+    import shapely
+    
+    data = {'box':[float(b) for b in box], 'wkb':shapely.to_wkb(p, hex=True)}
+    
+    file = os.path.join(path, '{0}_footprint.json'.format(jname))
+    with open(file, 'w') as fp:
+        json.dump(data, fp)
+        
+def read_group_polygon(jname, path='./'):
+    """
+    Read the group polygon and query box saved by `save_group_polygon`
+    """
+    import os
+    import json
+    import shapely
+    
+    file = os.path.join(path, '{0}_footprint.json'.format(jname))
+    with open(file) as fp:
+        data = json.load(fp)
+        
+    return shapely.from_wkb(data['wkb']), data['box']
+
+def meta_ebv(meta):
+    """
+    E(B-V) of a group table header, NaN if it is missing or 
+    `~hsaquery.dust.EBV_MISSING`
+    """
+    import numpy as np
+    
+    ebv = meta.get('MW_EBV', dust.EBV_MISSING)
+    if (ebv is None) or (ebv == dust.EBV_MISSING):
+        return np.nan
+        
+    return float(ebv)
+    
+def filter_targets(xtab):
+    """
+    Unique instrument + filter strings of the rows of a group table
+    """
+    import numpy as np
+    return np.array(['{0} {1}'.format(xtab['instdet'][i], xtab['filter'][i]) for i in range(len(xtab))])
+    
+def write_group_info(xtab, jname):
+    """
+    Write the proposal IDs, targets and filter exposure times of a group 
+    table to `{jname}_info.dat`
+    """
+    import numpy as np
+    
+    filter_target = filter_targets(xtab)
+    
+    fp = open('{0}_info.dat'.format(jname),'w')
+    
+    for i, t in enumerate(np.unique(xtab['proposal_id'])):
+        fp.write('proposal_id {0} {1}\n'.format(jname, t))
+        
+    for i, t in enumerate(np.unique(xtab['target'])):
+        fp.write('target {0} {1}\n'.format(jname, t))
+        
+    print(np.unique(xtab['target']), '\n')
+    
+    for i, filt in enumerate(np.unique(filter_target)):
+        mf = filter_target == filt
+        print('filter {0}  {1:>20s}  {2:>3d}  {3:>8.1f}'.format(jname, filt, mf.sum(), xtab['exptime'][mf].sum()))
+        fp.write('filter {0}  {1:>20s}  {2:>3d}  {3:>8.1f}\n'.format(jname, filt, mf.sum(), xtab['exptime'][mf].sum()))
+        
+    fp.close()
+
+def polygon_patch(geom, **kwargs):
+    """
+    Matplotlib `~matplotlib.patches.PathPatch` of a shapely (Multi)Polygon,
+    with holes
+    """
+    import numpy as np
+    from matplotlib.path import Path
+    from matplotlib.patches import PathPatch
+    
+    if hasattr(geom, 'geoms'):
+        polys = list(geom.geoms)
+    else:
+        polys = [geom]
+    
+    vertices, codes = [], []
+    for poly in polys:
+        for ring in [poly.exterior] + list(poly.interiors):
+            xy = np.asarray(ring.coords)[:,:2]
+            ring_codes = np.full(len(xy), Path.LINETO)
+            ring_codes[0] = Path.MOVETO
+            ring_codes[-1] = Path.CLOSEPOLY
+            vertices.append(xy)
+            codes.append(ring_codes)
+    
+    path = Path(np.vstack(vertices), np.hstack(codes))
+    return PathPatch(path, **kwargs)
+    
+def make_group_figure(xtab, p, box, jname, ebv, parent=None, xfps=None, parent_fps=None, close=True, use_pyplot=True, output='{0}_footprint.pdf'):
+    """
+    Make the footprint figure of a group
+    
+    Parameters
+    ----------
+    xtab : `~astropy.table.Table`
+        Group table, e.g., from `process_group`.
+    
+    p : `~shapely.geometry.Polygon`
+        Group polygon.
+    
+    box : list
+        [ra, dec, radius] of the group query.
+    
+    jname : str
+        Group name.
+    
+    ebv : float
+        Galactic E(B-V).
+    
+    parent : `~astropy.table.Table` or None
+        Parent table rows of the group to show in addition to `xtab`.
+    
+    xfps, parent_fps : `~hsaquery.footprints.FootprintArray` or None
+        Parsed footprints of `xtab` and `parent`.
+    
+    close : bool
+        Close the figure.  Only used with `use_pyplot`.
+    
+    use_pyplot : bool
+        Make the figure with `matplotlib.pyplot`.  Otherwise make a 
+        `~matplotlib.figure.Figure` with the non-interactive Agg canvas, 
+        which is safe in worker threads and processes.
+    
+    output : str
+        Output filename, formatted with `jname`.
+        
+    Returns
+    -------
+    fig : `~matplotlib.figure.Figure`
+        Figure object.
+    
+    """
+    import numpy as np
+    
+    BLUE = '#6699cc'
+    
+    ra, dec = box[0], box[1]
+    xy = p.convex_hull.boundary.xy
     
-    import numpy as np
-    import matplotlib.pyplot as plt
-
-    from shapely.geometry import Polygon
-    from descartes import PolygonPatch
+    filter_target = filter_targets(xtab)
     
-    from hsaquery import query
-    from hsaquery.query import parse_polygons
-
+    ########### 
+    # Make the figure
+    if use_pyplot:
+        import matplotlib.pyplot as plt
+        fig = plt.figure()
+    else:
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        
+    ax = fig.add_subplot(111)
     
-    # Example: high-z cluster pointings
-    tab = query.run_query(box=None, proposid=[14594], instruments=['WFC3-IR', 'ACS-WFC'], extensions=['FLT'], filters=['G102','G141'], extra=[])
+    # Show the parent table
+    if parent is not None:
+        colors = query.show_footprints(parent, ax=ax, fps=parent_fps)
     
-    # Ebeling
-    tab = query.run_query(box=None, proposid=[15132,14098,13671,12884,12166,11103,10875,], instruments=['WFC3-IR'], extensions=['FLT'], filters=[], extra=[])
-    # Relics
-    tab = query.run_query(box=None, proposid=[14096], instruments=['WFC3-IR'], extensions=['FLT'], filters=[], extra=[])
-    tab = query.run_query(box=None, proposid=[11591], instruments=['WFC3-iR'], extensions=['FLT'], filters=[], extra=[])
-    tab = query.run_query(box=None, proposid=[13666,14148,14496], instruments=['WFC3-IR'], extensions=['FLT'], filters=[], extra=[])
-    tab = tab[tab['target'] != 'ANY']
+    ax.scatter(box[0], box[1], marker='+', color='k')
     
-    # MACS 0454
-    box = [73.5462181, -3.0147200, 3]
-    tab = query.run_query(box=box, proposid=[], instruments=['WFC3-IR', 'ACS-WFC'], extensions=['FLT'], filters=['F110W'], extra=[])
+    colors = query.show_footprints(xtab, ax=ax, fps=xfps)
+    
+    patch1 = polygon_patch(p, fc=BLUE, ec=BLUE, alpha=0.1, zorder=2)
+    
+    ax.plot(xy[0], xy[1])
+    ax.add_patch(patch1)
+    
+    ax.grid()
+    
+    # Resize for square dimensions
+    xr, yr = ax.get_xlim(), ax.get_ylim()
+    dx = (xr[1]-xr[0])*np.cos(yr[0]/180*np.pi)*60
+    dy = (yr[1]-yr[0])*60
+    ax.set_title(jname)
+    ax.set_xlim(ax.get_xlim()[::-1])
+    fig.set_size_inches(5,5*dy/dx)
+    
+    # Add summary
+    dyi = 0.02*dx/dy
+    
+    ax.text(0.05, 0.97, '{0:>13.5f} {1:>13.5f}  E(B-V)={2:.3f}'.format(ra, dec, ebv), ha='left', va='top', transform=ax.transAxes, fontsize=6)
+    
+    for i, t in enumerate(np.unique(xtab['proposal_id'])):
+        ts = np.unique(xtab['target'][xtab['proposal_id'] == t])
+        
+        if len(ts) > 4:
+            tstr = '{0} {1}'.format(t, ' '.join(['{0}'.format(ti) for ti in ts[:4]])) + ' ...'
+        else:
+            tstr = '{0} {1}'.format(t, ' '.join(['{0}'.format(ti) for ti in ts]))
+            
+        ax.text(0.05, 0.97-dyi*(i+1), tstr, ha='left', va='top', transform=ax.transAxes, fontsize=6)
+        
+    for i, filt in enumerate(np.unique(filter_target)):
+        mf = filter_target == filt
+        c = colors[filt.split()[1]]
+        ax.text(0.95, 0.97-dyi*i, '{1:>20s}  {2:>3d}  {3:>8.1f}\n'.format(jname, filt, mf.sum(), xtab['exptime'][mf].sum()), ha='right', va='top', transform=ax.transAxes, fontsize=6, color=c)
+            
+    fig.tight_layout(pad=0.5)
+    
+    # Save figure
+    fig.savefig(output.format(jname))
+    
+    if use_pyplot & close:
+        plt.close(fig)
     
-def find_overlaps(tab, buffer_arcmin=1., filters=[], instruments=['WFC3-IR', 'WFC3-UVIS', 'ACS-WFC'], proposid=[], SKIP=False, extra=query.DEFAULT_EXTRA, close=True, use_parent=False):
+    return fig
+    
+def figure_is_stale(jname, path='./'):
     """
-    Compute discrete groups from the parent table and find overlapping
-    datasets.
+    Check if the figure of a group is missing or older than the group 
+    products `{jname}_footprint.fits` and `{jname}_footprint.json`
+    """
+    import os
+    
+    pdf_file = os.path.join(path, '{0}_footprint.pdf'.format(jname))
+    if not os.path.exists(pdf_file):
+        return True
+    
+    pdf_time = os.path.getmtime(pdf_file)
+    for ext in ['fits', 'json']:
+        file = os.path.join(path, '{0}_footprint.{1}'.format(jname, ext))
+        if os.path.exists(file):
+            if os.path.getmtime(file) > pdf_time:
+                return True
+    
+    return False
+    
+def render_group_figure(jname, path='./', parent=None):
+    """
+    Make the figure of a group from its saved products
     
     Parameters
     ----------
-    tab : `~astropy.table.Table`
-        Parent table from which to compute the groups.
-        
-    buffer_arcmin : float
-        Buffer, in arcminutes, to add around the parent group polygons
-        
-    filters : list
-        List of filters to query.  If empty then return all.
-        
-    instruments : list
-        List of instruments to query.  If empty then return all.
+    jname : str
+        Group name.
     
-    proposid : list
-        List of proposal IDs to query.  If empty then return all.
+    path : str
+        Directory of the `{jname}_footprint.fits` and 
+        `{jname}_footprint.json` files.  The figure is written there.
     
-    SKIP : bool
-        Don't recompute if a table with the same rootname already exists.
-        
-    extra : list
-        Extra query parameters.
-        
-    close : bool
-        If true, close the figure objects.
+    parent : `~astropy.table.Table` or None
+        Parent table of `find_overlaps`.  If specified, also show the 
+        parent rows that overlap with the group polygon.
     
-    use_parent : bool
-        Use parent table rather than performing a new query
-        
     Returns
     -------
-    tables : list
-        
-        List of grouped tables (`~astropy.table.Table`).
-
+    jname : str
+        Group name.
+    
     """
-    import copy
     import os
+    from astropy.table import Table
     
-    import numpy as np
-    import matplotlib.pyplot as plt
-
-    from shapely.geometry import Polygon
-    from descartes import PolygonPatch
-        
-    # Get shapely polygons for each exposures
-    polygons = []
+    xtab = Table.read(os.path.join(path, '{0}_footprint.fits'.format(jname)))
+    query.fix_byte_columns(xtab)
     
-    poly_buffer = buffer_arcmin/60 # ~1 arcmin, but doesn't account for cos(dec)
-    #poly_buffer = 0.5/60 # ~1 arcmin, but doesn't account for cos(dec)
+    p, box = read_group_polygon(jname, path=path)
+    ebv = meta_ebv(xtab.meta)
     
-    for i in range(len(tab)):
-        poly = query.parse_polygons(tab['footprint'][i])#[0]
-        pshape = [Polygon(p) for p in poly]
-        for i in range(1,len(poly)):
-            pshape[0] = pshape[0].union(pshape[i])
-        
-        polygons.append(pshape[0].buffer(poly_buffer))
-    
-    match_poly = [polygons[0]]
-    match_ids = [[0]]
-    
-    # Loop through polygons and combine those that overlap
-    for i in range(1,len(tab)):
-        print('Parse', i)
-        has_match = False
-        for j in range(len(match_poly)):
-            isect = match_poly[j].intersection(polygons[i])
-            #print(tab['target'][i], i, isect.area > 0)
-            if isect.area*3600. > 0.5:
-                #print(isect.area*3600)
-                match_poly[j] = match_poly[j].union(polygons[i])
-                match_ids[j].append(i)
-                has_match = True
-                continue
-                
-        if not has_match:
-            match_poly.append(polygons[i])
-            match_ids.append([i])
-    
-    ##################
-    # Iterate joining polygons
-    for iter in range(3):
-        mpolygons = copy.deepcopy(match_poly)
-        mids = copy.deepcopy(match_ids)
-    
-        match_poly = [mpolygons[0]]
-        match_ids = [mids[0]]
-    
-        for i in range(1,len(mpolygons)):
-            #print(i)
-            has_match = False
-            for j in range(len(match_poly)):
-                isect = match_poly[j].intersection(mpolygons[i])
-                #print(tab['target'][i], i, isect.area > 0)
-                if isect.area > 0:
-                    print(isect.area*3600)
-                    match_poly[j] = match_poly[j].union(mpolygons[i])
-                    match_ids[j].extend(mids[i])
-                    has_match = True
-                    continue
-
-            if not has_match:
-                match_poly.append(mpolygons[i])
-                match_ids.append(mids[i])
-        
-        print('Iter #{0}, N_Patch = {1}'.format(iter+1, len(match_poly)))
-        if len(mpolygons) == len(match_poly):
-            break
+    parent_fps = None
+    if parent is not None:
+        fps = footprints.get_footprints(parent)
+        in_group = fps.overlaps(p)
+        parent = parent[in_group]
+        parent_fps = fps[in_group]
     
-    np.save('overlaps.py', [match_poly, match_ids])
-            
-    # Save figures and tables for the unique positions
-    BLUE = '#6699cc'
+    output = os.path.join(path, '{0}_footprint.pdf')
+    make_group_figure(xtab, p, box, jname, ebv, parent=parent, 
+                      parent_fps=parent_fps, use_pyplot=False, output=output)
     
-    tables = []
+    return jname
     
-    for i in range(len(match_poly)):
-        #i+=1
-        p = match_poly[i]
-                
-        #######
-        # Query around central coordinate
-        idx = np.array(match_ids[i])
-        ra, dec = np.mean(tab['ra'][idx]), np.mean(tab['dec'][idx])
-        
-        # Get poly size
-        xy = p.convex_hull.boundary.xy
-        xradius = np.abs(xy[0]-ra).max()*np.cos(dec/180*np.pi)*60
-        yradius = np.abs(xy[1]-dec).max()*60
-
-        box = [ra, dec, np.maximum(xradius*1.5, yradius*1.5)]
+def render_figures(jnames=None, path='./', parent=None, n_workers=1, overwrite=False, verbose=True):
+    """
+    Make the group figures from the products of `find_overlaps`
+    
+    The figures are made on the non-interactive Agg canvas, so this can 
+    run after (or separately from) `find_overlaps` with 
+    `make_figures=False`.  Only the figures that are missing or older than 
+    the group products are made.
+    
+    Parameters
+    ----------
+    jnames : list or None
+        Group names.  If None, take all `*_footprint.fits` files in `path`.
+    
+    path : str
+        Directory of the group products.
+    
+    parent : `~astropy.table.Table` or None
+        Parent table to show in the figures, see `render_group_figure`.
+    
+    n_workers : int
+        Number of processes.
+    
+    overwrite : bool
+        Remake all figures.
+    
+    verbose : bool
+        Print status messages.
+    
+    Returns
+    -------
+    rendered : list
+        Names of the groups with new figures.
+    
+    """
+    import os
+    import glob
+    
+    if jnames is None:
+        files = glob.glob(os.path.join(path, '*_footprint.fits'))
+        jnames = sorted([os.path.basename(file).split('_footprint')[0] 
+                         for file in files])
+    
+    if not overwrite:
+        jnames = [j for j in jnames if figure_is_stale(j, path=path)]
+    
+    if verbose:
+        print('Render {0} figures'.format(len(jnames)))
         
-        # Build target name from RA/Dec
-        jname = utils.radec_to_targname(box[0], box[1], scl=1000)
-        print('\n\n', i, jname, box[0], box[1])
-
-        if (os.path.exists('{0}_footprint.pdf'.format(jname))) & SKIP:
-            continue
-                            
-        if use_parent:
-            xtab = tab
-        else:
-            xtab = query.run_query(box=box, proposid=proposid, instruments=instruments, extensions=['FLT','C1M'], filters=filters, extra=extra)
+    rendered = []
+    
+    if n_workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
         
-        ebv = utils.get_irsa_dust(ra, dec, type='SandF')
-        xtab.meta['NAME'] = jname
-        xtab.meta['RA'] = ra
-        xtab.meta['DEC'] = dec
-        xtab.meta['MW_EBV'] = ebv
-              
-        # Only include ancillary data that directly overlaps with the primary
-        # polygon
-        pointing_overlaps = np.zeros(len(xtab), dtype=bool)
-        for j in range(len(xtab)):
-            poly = query.parse_polygons(xtab['footprint'][j])#[0]
-            pshape = [Polygon(pi) for pi in poly]
-            for k in range(1,len(poly)):
-                pshape[0] = pshape[0].union(pshape[k])
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            futures = [pool.submit(render_group_figure, jname, path=path, 
+                                   parent=parent) for jname in jnames]
             
-            isect = p.intersection(pshape[0])
-            pointing_overlaps[j] = isect.area > 0
-            
-        xtab = xtab[pointing_overlaps]
-        
-        # Unique targets
-        filter_target = np.array(['{0} {1}'.format(xtab['instdet'][i], xtab['filter'][i]) for i in range(pointing_overlaps.sum())])
-                        
-        ########### 
-        # Make the figure
-        fig = plt.figure()
-        ax = fig.add_subplot(111)
-        
-        # Show the parent table
-        colors = query.show_footprints(tab[idx], ax=ax)
-        ax.scatter(box[0], box[1], marker='+', color='k')
+            for jname, future in zip(jnames, futures):
+                try:
+                    rendered.append(future.result())
+                except Exception as err:
+                    print('Figure {0} failed: {1}'.format(jname, err))
+    else:
+        for jname in jnames:
+            try:
+                rendered.append(render_group_figure(jname, path=path, 
+                                                    parent=parent))
+            except Exception as err:
+                print('Figure {0} failed: {1}'.format(jname, err))
+    
+    return rendered
+    
+def summary_table(tabs=None, output='overlap_summary', filters=None, by_instrument=False, files=None, n_workers=1, row_cache=True):
+    """
+    Summary table of the overlap tables
+    
+    Parameters
+    ----------
+    tabs : list or None
+        Overlap tables output from `find_overlaps`.  If None, read the 
+        tables from `files`.
+    
+    output : str
+        Rootname of the output FITS and HTML tables.
+    
+    filters, by_instrument : list or None, bool
+        See `parse_overlap_table`.  Tables without a given filter have 
+        zero statistics for that filter.
+    
+    files : list or None
+        Overlap table files.  If None, take all `*footprint.fits` files in 
+        the working directory.
+    
+    n_workers : int
+        Number of processes for reading and summarizing the tables.
+    
+    row_cache : bool
+        Cache the summary row of each file in `{output}_rows.pkl`, keyed by
+        the file modification time and size, and only summarize the files
+        that changed.  Only used when the tables are read from `files`.
         
-        colors = query.show_footprints(xtab, ax=ax)
+    Returns
+    -------
+    mtab : `~astropy.table.Table`
+        Summary table, as a `grizli.utils.GTable` if `grizli` is 
+        available.
+    
+    """
+    import os
+    import glob
+    import pickle
+    from astropy.table import Table
+    import astropy.table
+    
+    try:
+        from grizli import utils
+        HAS_GRIZLI = True
+    except:
+        HAS_GRIZLI = False
+    
+    parse_kws = dict(filters=filters, by_instrument=by_instrument)
+    
+    if tabs is not None:
+        rows = map_summary_rows(parse_overlap_row, tabs, n_workers=n_workers,
+                                **parse_kws)
+    else:
+        if files is None:
+            files = sorted(glob.glob('*footprint.fits'))
         
-        patch1 = PolygonPatch(p, fc=BLUE, ec=BLUE, alpha=0.1, zorder=2)
+        cache_file = '{0}_rows.pkl'.format(output)
+        if row_cache & os.path.exists(cache_file):
+            with open(cache_file, 'rb') as fp:
+                cache = pickle.load(fp)
+        else:
+            cache = {}
         
-        ax.plot(xy[0], xy[1])
-        ax.add_patch(patch1)
+        params = repr(sorted(parse_kws.items()))
         
-        ax.grid()
+        file_keys = {}
+        for file in files:
+            st = os.stat(file)
+            file_keys[file] = (st.st_mtime, st.st_size, params)
+            
+        changed = [file for file in files 
+                   if cache.get(file, {}).get('key', None) != file_keys[file]]
         
-        # Resize for square dimensions
-        xr, yr = ax.get_xlim(), ax.get_ylim()
-        dx = (xr[1]-xr[0])*np.cos(yr[0]/180*np.pi)*60
-        dy = (yr[1]-yr[0])*60
-        ax.set_title(jname)
-        ax.set_xlim(ax.get_xlim()[::-1])
-        fig.set_size_inches(5,5*dy/dx)
+        print('Summary: {0} tables, {1} changed'.format(len(files), len(changed)))
         
-        # Add summary
-        fp = open('{0}_info.dat'.format(jname),'w')
-        dyi = 0.02*dx/dy
+        new_rows = map_summary_rows(summarize_file, changed, 
+                                    n_workers=n_workers, **parse_kws)
         
-        ax.text(0.05, 0.97, '{0:>13.5f} {1:>13.5f}  E(B-V)={2:.3f}'.format(ra, dec, ebv), ha='left', va='top', transform=ax.transAxes, fontsize=6)
+        for file, row in zip(changed, new_rows):
+            if row is not None:
+                cache[file] = {'key':file_keys[file], 'row':row}
         
-        for i, t in enumerate(np.unique(xtab['proposal_id'])):
-            fp.write('proposal_id {0} {1}\n'.format(jname, t))
-            ts = np.unique(xtab['target'][xtab['proposal_id'] == t])
-            
-            if len(ts) > 4:
-                tstr = '{0} {1}'.format(t, ' '.join(['{0}'.format(ti) for ti in ts[:4]])) + ' ...'
-            else:
-                tstr = '{0} {1}'.format(t, ' '.join(['{0}'.format(ti) for ti in ts]))
-                
-            ax.text(0.05, 0.97-dyi*(i+1), tstr, ha='left', va='top', transform=ax.transAxes, fontsize=6)
-            
-        for i, t in enumerate(np.unique(xtab['target'])):
-            fp.write('target {0} {1}\n'.format(jname, t))
-            
-        print(np.unique(xtab['target']), '\n')
+        rows = [cache[file]['row'] if file in cache else None 
+                for file in files]
         
-        for i, filt in enumerate(np.unique(filter_target)):
-            mf = filter_target == filt
-            print('filter {0}  {1:>20s}  {2:>3d}  {3:>8.1f}'.format(jname, filt, mf.sum(), xtab['exptime'][mf].sum()))
-            fp.write('filter {0}  {1:>20s}  {2:>3d}  {3:>8.1f}\n'.format(jname, filt, mf.sum(), xtab['exptime'][mf].sum()))
+        if row_cache:
+            cache = dict([(file, cache[file]) for file in files 
+                          if file in cache])
             
-            c = colors[filt.split()[1]]
-            ax.text(0.95, 0.97-dyi*i, '{1:>20s}  {2:>3d}  {3:>8.1f}\n'.format(jname, filt, mf.sum(), xtab['exptime'][mf].sum()), ha='right', va='top', transform=ax.transAxes, fontsize=6, color=c)
-            
-        fp.close()
+            tmp_file = '{0}.tmp'.format(cache_file)
+            with open(tmp_file, 'wb') as fp:
+                pickle.dump(cache, fp)
                 
-        fig.tight_layout(pad=0.5)
-        
-        # Save figure and table
-        fig.savefig('{0}_footprint.pdf'.format(jname))
-        
-        if close:
-            plt.close()
-
-        xtab.write('{0}_footprint.fits'.format(jname), format='fits', overwrite=True)
-        np.save('{0}_footprint.npy'.format(jname), [p, box])
-        
-        tables.append(xtab)
-    
-    return tables
+            os.replace(tmp_file, cache_file)
     
-def summary_table(tabs=None, output='overlap_summary'):
-    import glob
-    from collections import OrderedDict
-    from astropy.table import Table
-    import astropy.table
+    rows = [row for row in rows if row is not None]
     
-    try:
-        from grizli import utils
-        HAS_GRIZLI = True
-    except:
-        HAS_GRIZLI = False
-        
-    if tabs is None:
-        tabs = [Table.read(file) for file in glob.glob('*footprint.fits')]
+    mtab = summary_rows_table(rows)
     
-    # for tab in tabs:
-    #     tab.remove_column('moving_target')
-    # #
-    # for tab in tabs:
-    #     prop = np.cast[int](tab['proposal_id'])
-    #     tab.remove_column('proposal_id')
-    #     tab['proposal_id'] = prop
-        
-    names, props = parse_overlap_table(tabs[0])
-    props = []
-    pdict = OrderedDict()
-    for name in names:
-        pdict[name] = []
-        
-    for i in range(len(tabs)):
-        print('Parse table ', i)
-        n_i, p_i = parse_overlap_table(tabs[i])
-        for name in names:
-            if name in n_i:
-                pdict[name].append(p_i[n_i.index(name)])
-            else:
-                pdict[name].append('---')
-                          
-    mtab = Table(pdict) #rows=props, names=names)
     mtab['RA'].format = '.5f'
     mtab['DEC'].format = '.5f'
     mtab.rename_column('MW_EBV', 'E(B-V)')
@@ -328,14 +1491,10 @@ def summary_table(tabs=None, output='overlap_summary'):
     mtab['GalLat'].format = '.1f'
     mtab['GalLon'].format = '.1f'
     
-    mtab['AreaG102'].format = '.1f'
-    mtab['AreaG141'].format = '.1f'
-    
-    mtab['TexpG102'].format = '.1f'
-    mtab['TexpG141'].format = '.1f'
-    
-    mtab['TperG102'].format = '.1f'
-    mtab['TperG141'].format = '.1f'
+    for c in mtab.colnames:
+        for p in ['Area', 'Texp', 'Tper']:
+            if c.startswith(p) & (mtab[c].dtype.kind == 'f'):
+                mtab[c].format = '.1f'
     
     # Links
     mast_link = ['<a href=https://archive.stsci.edu/hst/search.php?RA={0}&DEC={1}&radius=3.&max_records=5000&sci_aec=S&action=Search>MAST</a>'.format(t['RA'], t['DEC']) for t in mtab]
@@ -352,10 +1511,88 @@ def summary_table(tabs=None, output='overlap_summary'):
                      replace_braces=True, localhost=False, 
                      max_lines=len(mtab)+10, table_id=None, 
                      table_class='display compact', css=None)
+        return gtab
+        
+    return mtab
+
+def parse_overlap_row(tab, **kwargs):
+    """
+    `parse_overlap_table` as a dict
+    """
+    from collections import OrderedDict
+    names, properties = parse_overlap_table(tab, **kwargs)
+    return OrderedDict(zip(names, properties))
+
+def summarize_file(file, **kwargs):
+    """
+    Read an overlap table and compute its `parse_overlap_row` summary
+    """
+    from astropy.table import Table
+    return parse_overlap_row(Table.read(file), **kwargs)
+
+def map_summary_rows(func, items, n_workers=1, **kwargs):
+    """
+    Apply `func(item, **kwargs)` to a list of tables or files, in a pool of
+    `n_workers` processes if `n_workers > 1`.  Failed items give None.
+    """
+    from functools import partial
+    
+    func_kws = partial(func, **kwargs)
     
-    return gtab
+    def report(i, err):
+        print('Summary of item {0} failed: {1}'.format(i, err))
+        return None
+        
+    rows = []
+    if (n_workers > 1) & (len(items) > 1):
+        from concurrent.futures import ProcessPoolExecutor
+        
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            futures = [pool.submit(func_kws, item) for item in items]
+            for i, future in enumerate(futures):
+                try:
+                    rows.append(future.result())
+                except Exception as err:
+                    rows.append(report(i, err))
+    else:
+        for i, item in enumerate(items):
+            print('Parse table ', i)
+            try:
+                rows.append(func_kws(item))
+            except Exception as err:
+                rows.append(report(i, err))
+    
+    return rows
                 
-def parse_overlap_table(tab):
+def summary_rows_table(rows):
+    """
+    Table from a list of `parse_overlap_table` rows (dicts), with the union
+    of their columns
+    
+    Numeric columns missing from a row, e.g., statistics of filters not in 
+    that table, are set to zero and other columns to '---'.
+    """
+    import numpy as np
+    from collections import OrderedDict
+    from astropy.table import Table
+    
+    names = []
+    for row in rows:
+        for name in row:
+            if name not in names:
+                names.append(name)
+    
+    pdict = OrderedDict()
+    for name in names:
+        values = [row[name] for row in rows if name in row]
+        is_number = all([isinstance(v, (int, float, np.number)) 
+                         for v in values])
+        fill = 0 if is_number else '---'
+        pdict[name] = [row[name] if name in row else fill for row in rows]
+    
+    return Table(pdict)
+    
+def parse_overlap_table(tab, filters=None, by_instrument=False):
     """
     Compute properties of the overlap table
     
@@ -363,6 +1600,14 @@ def parse_overlap_table(tab):
     ----------
     tab : `~astropy.table.Table`
         Overlap table output from `find_overlaps`.
+    
+    filters : list or None
+        Filters for the `N`, `Area`, `Texp`, `Tper` and `PA` columns, e.g.,
+        ['G102', 'G141'].  If None, take all filters in the table.
+        
+    by_instrument : bool
+        Compute the filter columns by instrument and filter, see 
+        `filter_statistics`.
         
     Returns
     -------
@@ -375,7 +1620,6 @@ def parse_overlap_table(tab):
         
     """
     import numpy as np
-    from shapely.geometry import Polygon
     
     # Meta attributes
     names, properties = [], []
@@ -383,6 +1627,12 @@ def parse_overlap_table(tab):
         names.append(k)
         properties.append(tab.meta[k])
     
+    if 'MW_EBV' in names:
+        properties[names.index('MW_EBV')] = meta_ebv(tab.meta)
+    else:
+        names.append('MW_EBV')
+        properties.append(meta_ebv(tab.meta))
+    
     # Ecliptic and Galactic coords
     names.extend(['EclLat','EclLon','GalLat','GalLon'])
     properties.append(np.mean(tab['ecl_lat']))
@@ -406,49 +1656,101 @@ def parse_overlap_table(tab):
         names.append(c)
         properties.append(' '.join(['{0}'.format(p.split()[0].title()) for p in np.unique(tab[c])]))
     
-    # By grism
-    for g in ['G102', 'G141']:
-        m = tab['filter'] == g
-        names.extend(['{0}{1}'.format(p, g) for p in ['N', 'Area', 'Texp', 'Tper', 'PA']])
-        if m.sum() == 0:
-            properties.extend([0,0,0,0,0])
-            continue
-        
-        # N
-        properties.append(m.sum())
-        
-        # Area
-        PAs = []
-        for i, polystr in enumerate(tab['footprint'][m]):
-            try:
-                poly = query.parse_polygons(polystr)
-            except:
-                poly = query.old_parse_polygons(polystr)
-                
-            PAs.append(int(np.round(query.get_orientat(polystr))))
-            pshape = [Polygon(p) for p in poly]
-            for j in range(1,len(poly)):
-                pshape[0] = pshape[0].union(pshape[j])
-            
-            if i == 0:
-                gpoly = pshape[0]
-            else:
-                gpoly = gpoly.union(pshape[0])
-        
-        cosd = np.cos(tab.meta['DEC']/180*np.pi)
-        area = gpoly.area*3600.*cosd
-        properties.append(area)
+    # Coverage, exposure time and position angles by filter
+    keys, stats = filter_statistics(tab, filters=filters, 
+                                    by_instrument=by_instrument)
+    
+    for j, key in enumerate(keys):
+        for p in FILTER_STATISTICS:
+            names.append('{0}{1}'.format(p, key))
+            properties.append(stats[p][j])
         
-        # Texp
-        texp = np.sum(tab['exptime'][m])
-        properties.append(texp)
+    return names, properties
+
+# Columns of `filter_statistics`
+FILTER_STATISTICS = ['N', 'Area', 'Texp', 'Tper', 'PA']
+
+def filter_statistics(tab, filters=None, by_instrument=False):
+    """
+    Coverage statistics of an overlap table grouped by filter
+    
+    All groups are computed in one pass: the exposure counts, total 
+    exposure times and numbers of distinct position angles with 
+    `~numpy.bincount` over the group indices and the covered area with one
+    `~shapely.union_all` of the footprints of each group.
+    
+    Parameters
+    ----------
+    tab : `~astropy.table.Table`
+        Overlap table output from `find_overlaps`.
+    
+    filters : list or None
+        Filters to report, in this order.  Filters not in the table have 
+        zero statistics.  If None, take all filters in the table.
+    
+    by_instrument : bool
+        Group by instrument and filter, with keys like `WFC3-IR_F140W`.
         
-        # Tper
-        properties.append(texp/3000./(area/4.4))
+    Returns
+    -------
+    keys : list
+        Group keys.
+    
+    stats : dict
+        Arrays of the statistics of each group: 
+            `N`: number of exposures
+            `Area`: covered area, sq. arcmin
+            `Texp`: total exposure time, s
+            `Tper`: `Texp/3000/(Area/4.4)`, i.e., orbits per WFC3/IR 
+                    pointing
+            `PA`: number of distinct (rounded) ORIENTAT position angles
+    
+    """
+    import numpy as np
+    import shapely
+    
+    row_keys = query.to_str_array(tab['filter'])
+    if by_instrument:
+        row_keys = np.char.add(np.char.add(query.to_str_array(tab['instdet']),
+                                           '_'), row_keys)
         
-        # Number of PAs
-        properties.append(len(np.unique(PAs)))
-
-    return names, properties
+    if filters is None:
+        keys = list(np.unique(row_keys))
+    else:
+        keys = list(filters)
+    
+    N = len(keys)
+    key_index = dict([(k, j) for j, k in enumerate(keys)])
+    inv = np.array([key_index.get(k, -1) for k in row_keys], dtype=int)
+    sel = inv >= 0
+    
+    fps = footprints.get_footprints(tab)
+    orientat = np.round(fps.orientat())
+    geoms = fps.to_shapely()
+    
+    stats = {}
+    stats['N'] = np.bincount(inv[sel], minlength=N)
+    stats['Texp'] = np.bincount(inv[sel], minlength=N,
+                           weights=np.asarray(tab['exptime'], dtype=float)[sel])
+    
+    # Distinct (group, PA) pairs
+    valid = sel & np.isfinite(orientat)
+    pairs = np.unique(np.array([inv[valid], orientat[valid]]).T, axis=0)
+    stats['PA'] = np.bincount(pairs[:,0].astype(int), minlength=N)
+    
+    # Covered area
+    cosd = np.cos(tab.meta['DEC']/180*np.pi)
+    members = split_groups(inv[sel], N)
+    rows = np.where(sel)[0]
+    
+    stats['Area'] = np.zeros(N)
+    for j in range(N):
+        if len(members[j]) > 0:
+            gpoly = shapely.union_all(geoms[rows[members[j]]])
+            stats['Area'][j] = gpoly.area*3600.*cosd
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stats['Tper'] = np.where(stats['Area'] > 0, 
+                             stats['Texp']/3000./(stats['Area']/4.4), 0.)
     
-    
\ No newline at end of file
+    return keys, stats
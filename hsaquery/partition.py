@@ -0,0 +1,361 @@
+"""
+Sky-partitioned grouping of overlapping footprints
+
+The polygons are assigned to HEALPix tiles by their centroids.  Each tile
+finds the overlapping pairs that involve its own ("home") polygons, with
+a halo of the polygons from other tiles whose bounding boxes intersect
+the bounding box of the home polygons.  Since the polygons are the
+buffered footprints, this is a halo margin of the buffer around the
+footprints and every overlapping pair is found by the tile of at least
+one of its polygons.  The pairs of all tiles are then joined in a single
+connected-components pass, so the groups that cross tile borders are
+merged and the result is the same as `~hsaquery.overlaps.group_polygons`.
+
+The tiles can run in a local process pool (`partition_groups`) or on
+several nodes that share a work directory:
+
+    >>> prepare_partition(polygons, workdir)      # once
+    >>> run_partition_tiles(workdir)              # on each node
+    >>> match_poly, match_ids = merge_partition(workdir)
+
+"""
+import os
+
+import numpy as np
+
+from . import overlaps, groupstore, coverage
+
+# HEALPix order of the tiles, 7.3 deg
+PARTITION_ORDER = 3
+
+def assign_tiles(polygons, order=PARTITION_ORDER):
+    """
+    Home tiles and halos of a set of polygons
+
+    Parameters
+    ----------
+    polygons : array of `~shapely.geometry.Polygon`
+        Polygons, in decimal degrees.
+
+    order : int
+        HEALPix order of the tiles.
+
+    Returns
+    -------
+    tiles : array
+        Nested HEALPix index of the tiles with at least one home polygon.
+
+    home : list of arrays
+        Indices of the home polygons of each tile.
+
+    work : list of arrays
+        Indices of the home and halo polygons of each tile.
+
+    """
+    import shapely
+    from shapely.strtree import STRtree
+
+    polygons = np.asarray(polygons, dtype=object)
+
+    # Empty or missing polygons can't overlap anything and aren't assigned
+    valid = np.where(~shapely.is_empty(polygons) & 
+                     ~shapely.is_missing(polygons))[0]
+    
+    centroid = shapely.centroid(polygons[valid])
+    home_tile = coverage.healpix_index(shapely.get_x(centroid), 
+                                       shapely.get_y(centroid), order=order)
+
+    tiles, inv = np.unique(home_tile, return_inverse=True)
+    home = [valid[h] for h in overlaps.split_groups(inv.flatten(), 
+                                                    len(tiles))]
+
+    # Bounding box of the home polygons of each tile
+    bounds = shapely.bounds(polygons)
+    tile_box = np.array([np.hstack([bounds[h,:2].min(axis=0),
+                                    bounds[h,2:].max(axis=0)])
+                         for h in home])
+
+    # Halo: polygons whose bounding box intersects the tile box
+    tree = STRtree(shapely.box(*bounds[valid].T))
+    ti, pi = tree.query(shapely.box(*tile_box.T), predicate='intersects')
+    work = overlaps.split_groups(ti, len(tiles))
+    work = [np.sort(valid[pi[w]]) for w in work]
+
+    return tiles, home, work
+
+def tile_pairs(polygons, work, home, min_area=0.5/3600.):
+    """
+    Overlapping pairs of a tile
+
+    Parameters
+    ----------
+    polygons : array of `~shapely.geometry.Polygon`
+        Polygons of the tile work set, i.e., ``all_polygons[work]``.
+
+    work, home : array
+        Global indices of the work set and of the home polygons of the tile.
+
+    min_area : float
+        See `~hsaquery.overlaps.overlap_pairs`.
+
+    Returns
+    -------
+    pairs : array (N,2)
+        Global indices of the overlapping pairs with at least one home
+        polygon.
+
+    """
+    queries = np.where(np.isin(work, home))[0]
+    left, right = overlaps.overlap_pairs(np.asarray(polygons, dtype=object),
+                                         min_area=min_area, queries=queries)
+
+    return np.array([work[left], work[right]], dtype=np.int64).T
+
+def join_pairs(N, pair_list, polygons, verbose=False, pool=None):
+    """
+    Groups from the overlapping pairs of all tiles
+    """
+    if len(pair_list) > 0:
+        pairs = np.unique(np.vstack(pair_list), axis=0)
+    else:
+        pairs = np.zeros((0,2), dtype=np.int64)
+
+    if verbose:
+        print('Partition: {0} polygons, {1} overlapping pairs'.format(N, len(pairs)))
+
+    labels = overlaps.connected_components(N, pairs[:,0], pairs[:,1])
+    return overlaps.merge_groups(polygons, labels, verbose=verbose,
+                                 pool=pool)
+
+def partition_groups(polygons, order=PARTITION_ORDER, min_area=0.5/3600., n_workers=4, workdir=None, verbose=False):
+    """
+    Group overlapping polygons by sky tiles in a process pool
+
+    Parameters
+    ----------
+    polygons : list or array of `~shapely.geometry.Polygon`
+        Polygons to group.
+
+    order : int
+        HEALPix order of the tiles.
+
+    min_area : float
+        See `~hsaquery.overlaps.group_polygons`.
+
+    n_workers : int
+        Number of processes.
+
+    workdir : str or None
+        If specified, run through a shared work directory with
+        `prepare_partition`, `run_partition_tiles` and `merge_partition`,
+        so that other nodes can process tiles at the same time with
+        `run_partition_tiles`.
+
+    verbose : bool
+        Print status messages.
+
+    Returns
+    -------
+    match_poly, match_ids : list, list
+        Same as `~hsaquery.overlaps.group_polygons`.
+
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    polygons = np.asarray(polygons, dtype=object)
+
+    if workdir is not None:
+        prepare_partition(polygons, workdir, order=order, min_area=min_area)
+        run_partition_tiles(workdir, n_workers=n_workers, verbose=verbose)
+        return merge_partition(workdir, n_workers=n_workers, verbose=verbose)
+
+    tiles, home, work = assign_tiles(polygons, order=order)
+    if verbose:
+        print('Partition: {0} tiles'.format(len(tiles)))
+
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        futures = [pool.submit(tile_pairs, polygons[w], w, h,
+                               min_area=min_area)
+                   for h, w in zip(home, work)]
+
+        pair_list = [f.result() for f in futures]
+
+        return join_pairs(len(polygons), pair_list, polygons,
+                          verbose=verbose, pool=pool)
+
+def prepare_partition(polygons, workdir, order=PARTITION_ORDER, min_area=0.5/3600.):
+    """
+    Write the polygons and the tile assignments to a shared work directory
+
+    The directory contains the polygons as a
+    `~hsaquery.groupstore` store with one group per polygon, the
+    home and work sets of each tile and the parameters in `partition.json`.
+    """
+    import json
+
+    polygons = np.asarray(polygons, dtype=object)
+    tiles, home, work = assign_tiles(polygons, order=order)
+
+    if not os.path.exists(workdir):
+        os.makedirs(workdir)
+
+    groupstore.save_groups(os.path.join(workdir, 'polygons'), polygons,
+                           [[i] for i in range(len(polygons))])
+
+    for name, sets in zip(['home', 'work'], [home, work]):
+        counts = np.array([len(s) for s in sets], dtype=np.int64)
+        np.save(os.path.join(workdir, '{0}.npy'.format(name)),
+                np.hstack(sets).astype(np.int64))
+        np.save(os.path.join(workdir, '{0}_offsets.npy'.format(name)),
+                np.append(0, np.cumsum(counts)))
+
+    meta = {'order':order, 'min_area':min_area, 'n_polygons':len(polygons),
+            'tiles':[int(t) for t in tiles]}
+
+    with open(os.path.join(workdir, 'partition.json'), 'w') as fp:
+        json.dump(meta, fp)
+
+def _read_partition(workdir):
+    """
+    Read the parameters and tile sets of a work directory
+    """
+    import json
+
+    with open(os.path.join(workdir, 'partition.json')) as fp:
+        meta = json.load(fp)
+
+    sets = {}
+    for name in ['home', 'work']:
+        flat = np.load(os.path.join(workdir, '{0}.npy'.format(name)),
+                       mmap_mode='r')
+        offsets = np.load(os.path.join(workdir,
+                                       '{0}_offsets.npy'.format(name)))
+        sets[name] = (flat, offsets)
+
+    return meta, sets
+
+def _tile_file(workdir, tile, ext='npy'):
+    return os.path.join(workdir, 'tile_{0}_pairs.{1}'.format(tile, ext))
+
+def run_workdir_tile(workdir, j):
+    """
+    Compute and save the pairs of tile `j` of a work directory
+    """
+    meta, sets = _read_partition(workdir)
+    store = groupstore.GroupStore(os.path.join(workdir, 'polygons'))
+
+    flat, offsets = sets['home']
+    home = np.array(flat[offsets[j]:offsets[j+1]])
+    flat, offsets = sets['work']
+    work = np.array(flat[offsets[j]:offsets[j+1]])
+
+    polygons = np.array([store.polygon(i) for i in work], dtype=object)
+    pairs = tile_pairs(polygons, work, home, min_area=meta['min_area'])
+
+    tile = meta['tiles'][j]
+    tmp_file = _tile_file(workdir, tile, ext='tmp.npy')
+    np.save(tmp_file, pairs)
+    os.replace(tmp_file, _tile_file(workdir, tile))
+
+    return tile
+
+def run_partition_tiles(workdir, n_workers=1, verbose=True):
+    """
+    Process the tiles of a work directory that are not yet done or claimed
+
+    Several nodes can run this at the same time on a shared filesystem.
+    Tiles are claimed with lock files created exclusively, so each tile is
+    processed once.  The lock files of tiles that failed or whose node
+    crashed must be removed before they are processed again.
+
+    Parameters
+    ----------
+    workdir : str
+        Work directory made by `prepare_partition`.
+
+    n_workers : int
+        Number of local processes.
+
+    verbose : bool
+        Print status messages.
+
+    Returns
+    -------
+    done : list
+        Tiles processed by this call.
+
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    meta, sets = _read_partition(workdir)
+
+    claimed = []
+    for j, tile in enumerate(meta['tiles']):
+        if os.path.exists(_tile_file(workdir, tile)):
+            continue
+
+        try:
+            fd = os.open(_tile_file(workdir, tile, ext='lock'),
+                         os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            os.close(fd)
+        except FileExistsError:
+            continue
+
+        claimed.append(j)
+
+    if verbose:
+        print('Partition {0}: process {1} of {2} tiles'.format(workdir, len(claimed), len(meta['tiles'])))
+
+    done = []
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            futures = [pool.submit(run_workdir_tile, workdir, j)
+                       for j in claimed]
+            for j, future in zip(claimed, futures):
+                try:
+                    done.append(future.result())
+                except Exception as err:
+                    print('Tile {0} failed: {1}'.format(meta['tiles'][j], err))
+    else:
+        for j in claimed:
+            try:
+                done.append(run_workdir_tile(workdir, j))
+            except Exception as err:
+                print('Tile {0} failed: {1}'.format(meta['tiles'][j], err))
+
+    for tile in done:
+        os.remove(_tile_file(workdir, tile, ext='lock'))
+
+    return done
+
+def merge_partition(workdir, n_workers=1, verbose=True):
+    """
+    Join the pairs of all tiles of a work directory into groups
+
+    Returns
+    -------
+    match_poly, match_ids : list, list
+        Same as `~hsaquery.overlaps.group_polygons`.
+
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    meta, sets = _read_partition(workdir)
+
+    missing = [t for t in meta['tiles']
+               if not os.path.exists(_tile_file(workdir, t))]
+    if len(missing) > 0:
+        raise IOError('{0} tiles of {1} not done: {2}'.format(len(missing), workdir, missing))
+
+    pair_list = [np.load(_tile_file(workdir, t)) for t in meta['tiles']]
+
+    store = groupstore.GroupStore(os.path.join(workdir, 'polygons'))
+    polygons = store.polygons()
+
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            return join_pairs(meta['n_polygons'], pair_list, polygons,
+                              verbose=verbose, pool=pool)
+    else:
+        return join_pairs(meta['n_polygons'], pair_list, polygons,
+                          verbose=verbose)
@@ -96,9 +96,21 @@ DEFAULT_EXTRA += ["TARGET.TARGET_NAME NOT LIKE '{0}'".format(calib)
                                'DARK-EARTH-CALIB', 'DARK-NM', 'DEUTERIUM',
                                'INTFLAT', 'KSPOTS', 'VISFLAT']]
 
+# Archive instrument names of the INSTRUMENT_DETECTORS keys, used for
+# server-side selections
+INSTRUMENT_NAMES = {'WFC3-UVIS':'WFC3', 'WFC3-IR':'WFC3', 'ACS-WFC':'ACS', 'ACS-HRC':'ACS', 'WFPC2':'WFPC2', 'STIS-NUV':'STIS', 'STIS-ACQ':'STIS'}
+
+# File type selection on the artifact filenames, e.g., ib6o23rsq_flt.fits.
+# The '_' is a LIKE wildcard too, so the server-side match is a superset
+# that is reduced to the exact file types by `process_table`.
+EXTENSION_PREDICATE = "ARTIFACT.ARTIFACT_ID LIKE '%_{lower}.%' OR ARTIFACT.ARTIFACT_ID LIKE '%_{upper}.%'"
+
+# Socket timeout of archive requests, seconds
+QUERY_TIMEOUT = 300
+
 INSTRUMENT_DETECTORS = {'WFC3-UVIS':'UVIS', 'WFC3-IR':'IR', 'ACS-WFC':'WFC', 'ACS-HRC':'HRC', 'WFPC2':'1', 'STIS-NUV':'NUV-MAMA', 'STIS-ACQ':'CCD'}
 
-def run_query(box=None, proposid=[13871], instruments=['WFC3-IR'], filters=[], extensions=['RAW','C1M'], extra=DEFAULT_EXTRA,  fields=','.join(DEFAULT_FIELDS.split()), maxitems=100000, rename_columns=DEFAULT_RENAME, lower=True, sort_column=['OBSERVATION_ID'], remove_tempfile=True, get_query_string=False, quiet=True):
+def run_query(box=None, proposid=[13871], instruments=['WFC3-IR'], filters=[], extensions=['RAW','C1M'], extra=DEFAULT_EXTRA,  fields=','.join(DEFAULT_FIELDS.split()), maxitems=100000, rename_columns=DEFAULT_RENAME, lower=True, sort_column=['OBSERVATION_ID'], remove_tempfile=True, get_query_string=False, quiet=True, pushdown=True, timeout=QUERY_TIMEOUT, page_size=None, n_workers=4, max_retries=3, use_cache=False, refresh_cache=False, cache_ttl=None, cache_dir=None):
     """
     
     Optional position box query:
@@ -109,18 +121,114 @@ def run_query(box=None, proposid=[13871], instruments=['WFC3-IR'], filters=[], e
     to run with extra=[] for those cases and strip out true calibs another
     way.
     
+    With `pushdown=True`, the `extensions` and `instruments` selections are
+    also applied on the server (see `pushdown_predicates`) so that fewer 
+    rows are transferred.  The selections are always applied exactly on 
+    the client side.  The number of rows transferred and kept are stored
+    in `tab.meta['qntrans']` and `tab.meta['qnkeep']`.
+    
+    The VOTable result is streamed directly from the server into the parser,
+    with no temporary file.  `remove_tempfile` is no longer used and is kept
+    for backwards compatibility.  `timeout` is the socket timeout, in 
+    seconds, of the HTTP request.
+    
+    Large queries can be paginated by setting `page_size`, in which case 
+    the pages of the result are fetched concurrently in `n_workers` threads
+    (see `fetch_pages`).  Pages that fail are retried up to `max_retries` 
+    times.  In either case, a warning is printed and 
+    `tab.meta['qtrunc']` is set if the result reached `maxitems` rows and 
+    may therefore be incomplete.
+    
+    Results can be cached on disk (see `~hsaquery.cache`), keyed by the 
+    query URL and the parameters of the post-processing:
+    
+        use_cache : read and write the cache.  Off by default, i.e., always
+                    run the query and don't store the result.
+                    
+        refresh_cache : ignore existing cached results but store the new 
+                        result.
+                        
+        cache_ttl : time-to-live of cached results, seconds.  Default is
+                    `~hsaquery.cache.CACHE_TTL`.
+        
+        cache_dir : cache directory.  Default is 
+                    `~hsaquery.cache.CACHE_DIR`.
+    
     """
-    import os
-    import tempfile   
-    import urllib.request
     import time
     
-    from astropy.table import Table
     from . import utils
+    from . import cache
+    
+    if cache_ttl is None:
+        cache_ttl = cache.CACHE_TTL
     
+    if cache_dir is None:
+        cache_dir = cache.CACHE_DIR
+        
     if quiet:
         utils.set_warnings(numpy_level='ignore', astropy_level='ignore')
         
+    query = build_query(box=box, proposid=proposid, filters=filters, 
+                        extensions=extensions, instruments=instruments,
+                        extra=extra, fields=fields, maxitems=maxitems, 
+                        pushdown=pushdown)
+    if get_query_string:
+        return query
+    
+    if use_cache:
+        key = query_cache_key(query, extensions=extensions, 
+                              instruments=instruments, 
+                              rename_columns=rename_columns, lower=lower,
+                              sort_column=sort_column)
+        
+        if not refresh_cache:
+            tab = cache.read_cache(key, ttl=cache_ttl, cache_dir=cache_dir)
+            if tab is not None:
+                if not quiet:
+                    print('Read cached query result: {0}'.format(cache.cache_file(key, cache_dir=cache_dir)))
+                
+                return tab
+                
+    
+    try:
+        if page_size is None:
+            tab = fetch_votable(query, timeout=timeout, quiet=quiet)
+            tab.meta['qtrunc'] = len(tab) >= maxitems, 'Result truncated'
+        else:
+            tab = fetch_pages(query, page_size=page_size, maxitems=maxitems,
+                              n_workers=n_workers, max_retries=max_retries,
+                              timeout=timeout, quiet=quiet)
+    except Exception as err:
+        print('Failed to read query result ({0}).\n\nThis is likely a problem with the query that returned no results: \n\ncurl \"{1}\"'.format(err, query))
+        return False
+    
+    if tab.meta['qtrunc'][0]:
+        print('Warning: query result truncated at maxitems={0} rows'.format(maxitems))
+        
+    tab.meta['query'] = query, 'Query string'
+    tab.meta['qtime'] = time.ctime(), 'Query timestamp'
+    
+    tab = process_table(tab, extensions=extensions, instruments=instruments,
+                        rename_columns=rename_columns, lower=lower, 
+                        sort_column=sort_column, quiet=quiet)
+    
+    if (tab is not False) & (not quiet):
+        print('Rows transferred: {0}, kept: {1}'.format(tab.meta['qntrans'][0], tab.meta['qnkeep'][0]))
+        
+    if (tab is not False) & use_cache:
+        cache.write_cache(tab, key, cache_dir=cache_dir, ttl=cache_ttl)
+        
+    return tab
+
+def build_query(box=None, proposid=[13871], filters=[], extensions=[], instruments=[], extra=DEFAULT_EXTRA, fields=','.join(DEFAULT_FIELDS.split()), maxitems=100000, pushdown=True):
+    """
+    Build the query URL for `run_query`.  See `run_query` for a description
+    of the parameters.
+    
+    If `pushdown` is True, the `extensions` and `instruments` selections 
+    are translated to server-side predicates with `pushdown_predicates`.
+    """
     qlist = []
     
     # Box search around position
@@ -140,112 +248,160 @@ def run_query(box=None, proposid=[13871], instruments=['WFC3-IR'], filters=[], e
         fquery = ' OR '.join(['ENERGY.FILTER LIKE \'{0}\''.format(p) for p in filters])
         qlist.append('({0})'.format(fquery))
     
-    # if len(extensions) > 0:
-    #     equery = ' OR '.join(['ARTIFACT.FILE_EXTENSION LIKE \'{0}\''.format(p) for p in extensions])
-    #     qlist.append('({0})'.format(equery))
+    if pushdown:
+        # URL-encode the LIKE wildcards of the generated predicates.  The
+        # `extra` predicates are passed as they are.
+        qlist += [q.replace('%', '%25') for q in 
+                  pushdown_predicates(extensions=extensions,
+                                      instruments=instruments)]
         
-    query = "http://archives.esac.esa.int/ehst-sl-server/servlet/metadata-action?RESOURCE_CLASS=OBSERVATION&QUERY=({0})&SELECTED_FIELDS={1}&PAGE=1&PAGE_SIZE={2}&RETURN_TYPE=VOTable".format(' AND '.join(qlist+extra), fields, maxitems).replace(' ','%20')
-    if get_query_string:
-        return query
+    qstr = ' AND '.join(qlist+extra)
     
-    
-    # req = urllib.request.Request(query)
-    # response = urllib.request.urlopen(req)
-    # the_page = response.read()#.decode('utf-8')
-    # 
-    # if len(the_page) == 0:
-    #     print('Empty query: ')
-    #     print('\n', '\n '.join(qlist))
-    #     print('\n', fields)
-    #     return False
-        
-    fp = tempfile.NamedTemporaryFile('w', delete=False)
-    fp.close()
+    query = "http://archives.esac.esa.int/ehst-sl-server/servlet/metadata-action?RESOURCE_CLASS=OBSERVATION&QUERY=({0})&SELECTED_FIELDS={1}&PAGE=1&PAGE_SIZE={2}&RETURN_TYPE=VOTable".format(qstr, fields, maxitems).replace(' ','%20')
+    return query
 
-    vo_tempfile = fp.name +'.votable'
-    os.system('wget --quiet \"'+query+'\" -O {0}'.format(vo_tempfile))
+def pushdown_predicates(extensions=[], instruments=[]):
+    """
+    Server-side predicates for the `extensions` and `instruments` 
+    selections of `run_query`
     
-    lines = open(vo_tempfile).readlines()
-    lines[0] = lines[0].replace('eHST results', 'results')
+    ARTIFACT.FILE_EXTENSION is the archive product class (e.g., 'science') 
+    rather than the file type, so the `extensions` are matched against the
+    ARTIFACT.ARTIFACT_ID filenames (`EXTENSION_PREDICATE`).  The archive 
+    only has the detector in the INSTRUMENT_CONFIGURATION string, so the 
+    `instruments` are matched against the instrument name 
+    (`INSTRUMENT_NAMES`) and the detector is still selected on the client 
+    side by `process_table`.
     
-    fp = open(vo_tempfile,'w')
-    fp.writelines(lines)
-    fp.close()
+    Parameters
+    ----------
+    extensions : list
+        File types, e.g., ['FLT', 'C1M'].
     
-    # fp = open(vo_tempfile, 'w')
-    # fp.write(the_page.replace('"',''))
-    # fp.close()
+    instruments : list
+        Instruments, keys of `INSTRUMENT_DETECTORS`.
     
-    try:
-        tab = Table.read(vo_tempfile, format='votable')
-    except:
-        print('Failed to read temporary file {0}.\n\nThis is likely a problem with the query that returned no results: \n\nwget \"{1}\" -O {2}'.format(vo_tempfile, query, vo_tempfile))
-        return False
-        
-    tab.meta['query'] = query, 'Query string'
-    tab.meta['qtime'] = time.ctime(), 'Query timestamp'
+    Returns
+    -------
+    qlist : list
+        List of predicates to be AND-ed with the rest of the query.
     
-    # Compute file extension
-    if 'ARTIFACT_ID' in tab.colnames:
-        file_extension = [str(file).split('_')[-1].split('.')[0].upper() for file in tab['ARTIFACT_ID']]
+    """
+    qlist = []
+    
+    if len(extensions) > 0:
+        equery = ' OR '.join([EXTENSION_PREDICATE.format(lower=ext.lower(), upper=ext.upper()) for ext in extensions])
+        qlist.append('({0})'.format(equery))
+    
+    if len(instruments) > 0:
+        names = []
+        for ins in instruments:
+            if ins not in INSTRUMENT_NAMES:
+                # Can't be pushed down, so select everything
+                return qlist
+            
+            if INSTRUMENT_NAMES[ins] not in names:
+                names.append(INSTRUMENT_NAMES[ins])
+            
+        iquery = ' OR '.join(['INSTRUMENT.INSTRUMENT_NAME LIKE \'{0}\''.format(name) for name in names])
+        qlist.append('({0})'.format(iquery))
+    
+    return qlist
+    
+def process_table(tab, extensions=['RAW','C1M'], instruments=['WFC3-IR'], rename_columns=DEFAULT_RENAME, lower=True, sort_column=['OBSERVATION_ID'], quiet=True):
+    """
+    Post-process the raw VOTable result of a query: compute FILE_TYPE, 
+    parse INSTRUMENT_CONFIGURATION, apply the `extensions` and 
+    `instruments` selections, add JTARGNAME and rename the columns.  
+    See `run_query` for a description of the parameters.  If `quiet` is 
+    False, print a message when no rows are left.
+    
+    Returns
+    -------
+    tab : `~astropy.table.Table` or False
+        Processed table, or False if no rows are left after the 
+        selections.
     
-        tab['FILE_TYPE'] = file_extension
+    """
+    from . import utils
+    
+    # The selections are computed from the few columns they need and 
+    # applied before the other byte string columns are decoded
+    n_trans = len(tab)
+    keep = np.ones(len(tab), dtype=bool)
+    new_columns = {}
+    
+    # Compute file extension, e.g., 'ib6o23rsq_flt.fits' > 'FLT'
+    if 'ARTIFACT_ID' in tab.colnames:
+        artifact = to_str_array(tab['ARTIFACT_ID'])
+        file_type = np.char.rpartition(artifact, '_')[:,2]
+        file_type = np.char.upper(np.char.partition(file_type, '.')[:,0])
+        new_columns['FILE_TYPE'] = file_type
         
         if len(extensions) > 0:
-            ext_test = np.array([tab['FILE_TYPE'] == ext for ext in extensions]).sum(axis=0) > 0
-            tab = tab[ext_test]
+            keep &= np.isin(file_type, extensions)
     
-    if len(tab) == 0:
+    if keep.sum() == 0:
+        if not quiet:
+            print('No rows left after the extensions selection ({0} transferred)'.format(len(tab)))
+            
         return False
-             
-    # Parse instrument configuration
+    
+    if keep.sum() < len(tab):
+        tab = tab[keep]
+        for c in new_columns:
+            new_columns[c] = new_columns[c][keep]
+        
+        keep = keep[keep]
+        
+    # Parse instrument configuration, 
+    # e.g., 'APERTURE=IR|DETECTOR=IR|OBSMODE=MULTIACCUM|EXPTIME=252.9'
     if 'INSTRUMENT_CONFIGURATION' in tab.colnames:
-        aperture = [str(conf).split('|')[0].split('=')[1] for conf in tab['INSTRUMENT_CONFIGURATION']]
-        
-        config = {'APERTURE':[], 'DETECTOR':[], 'OBSMODE':[], 'EXPTIME':[]}
-        for conf in tab['INSTRUMENT_CONFIGURATION']:
-            spl = conf.decode('utf-8').strip().split('|')
-            splk = {}
-            for item in spl:
-                k = item.split('=')
-                splk[k[0]] = k[1]
-                
-            for ck in config:
-                if ck in splk:
-                    config[ck].append(splk[ck])
-                else:
-                    config[ck].append('')
+        conf = to_str_array(tab['INSTRUMENT_CONFIGURATION'])
+        conf = np.char.add('|', np.char.strip(conf))
         
-        config['EXPTIME'] = np.cast[float](config['EXPTIME'])
+        for ck in ['APERTURE', 'DETECTOR', 'OBSMODE', 'EXPTIME']:
+            value = np.char.partition(conf, '|{0}='.format(ck))[:,2]
+            new_columns[ck] = np.char.partition(value, '|')[:,0]
         
-        for ck in config:
-            tab[ck] = config[ck]
+        exptime = new_columns['EXPTIME']
+        new_columns['EXPTIME'] = np.where(exptime == '', 'nan', 
+                                          exptime).astype(float)
         
         if len(instruments) > 0:
-            ins_test = np.array([tab['DETECTOR'] == INSTRUMENT_DETECTORS[ins] for ins in instruments]).sum(axis=0) > 0
-            tab = tab[ins_test]    
+            dets = [INSTRUMENT_DETECTORS[ins] for ins in instruments]
+            keep &= np.isin(new_columns['DETECTOR'], dets)
         
         swap_detector = {}
         for k in INSTRUMENT_DETECTORS:
             swap_detector[INSTRUMENT_DETECTORS[k]] = k
         
-        instdet = [swap_detector[det] if det in swap_detector else '' for det in tab['DETECTOR']]
-        tab['INSTDET'] = instdet
+        un, inv = np.unique(new_columns['DETECTOR'], return_inverse=True)
+        instdet = np.array([swap_detector[det] if det in swap_detector else '' for det in un])
+        new_columns['INSTDET'] = instdet[inv.flatten()]
+    
+    tab.meta['qntrans'] = n_trans, 'Rows transferred'
+    tab.meta['qnkeep'] = keep.sum(), 'Rows kept'
+    
+    if keep.sum() < len(tab):
+        tab = tab[keep]
+        for c in new_columns:
+            new_columns[c] = new_columns[c][keep]
+    
+    # Decode the byte strings of the remaining rows
+    fix_byte_columns(tab)
+    
+    for c in new_columns:
+        tab[c] = new_columns[c]
         
-    if remove_tempfile:
-        os.unlink(vo_tempfile)
-    else:
-        print('Temporary VOTable file: ', vo_tempfile)
-
     # Sort
     tab.sort(sort_column)
     
     # Add coordinate name
     if 'RA' in tab.colnames:
-        jtargname = [utils.radec_to_targname(ra=tab['RA'][i], dec=tab['DEC'][i], scl=6) for i in range(len(tab))]
-        tab['JTARGNAME'] = jtargname
-    
-    fix_byte_columns(tab)
+        tab['JTARGNAME'] = utils.radec_to_targname_array(ra=tab['RA'], 
+                                                         dec=tab['DEC'], 
+                                                         scl=6)
         
     for c in rename_columns:
         if c in tab.colnames:
@@ -265,13 +421,890 @@ def run_query(box=None, proposid=[13871], instruments=['WFC3-IR'], filters=[], e
     
     return tab
 
+def query_cache_key(query, extensions=['RAW','C1M'], instruments=['WFC3-IR'], rename_columns=DEFAULT_RENAME, lower=True, sort_column=['OBSERVATION_ID']):
+    """
+    Cache key for a query URL and the `process_table` parameters
+    """
+    from . import cache
+    return cache.cache_key(query, extensions=extensions, 
+                           instruments=instruments, 
+                           rename_columns=rename_columns, lower=lower,
+                           sort_column=sort_column)
+
+class VOTableStream(object):
+    """
+    Read-only file-like wrapper around an HTTP response that fixes the 
+    VOTable header on the fly and counts the bytes and time spent reading
+    from the network.
+    
+    The archive writes a table name ('eHST results') in the first line 
+    that the astropy VOTable parser doesn't accept, so `replace` is applied 
+    to the first line of the stream.  The first line is kept in memory so 
+    that the parser can rewind to the start of the stream after checking 
+    the file signature.
+    
+    """
+    def __init__(self, response, replace=[(b'eHST results', b'results')]):
+        self.response = response
+        self.nbytes = 0
+        self.read_time = 0.
+        self._pos = 0
+        
+        head = self._read_response(-1, line=True)
+        for r in replace:
+            head = head.replace(*r)
+        
+        self._head = head
+    
+    def _read_response(self, size=-1, line=False):
+        import time
+        t0 = time.time()
+        if line:
+            data = self.response.readline()
+        else:
+            data = self.response.read(size)
+        
+        self.read_time += time.time() - t0
+        self.nbytes += len(data)
+        return data
+            
+    def read(self, size=-1):
+        nhead = len(self._head)
+        data = b''
+        if self._pos < nhead:
+            if (size is None) | (size < 0):
+                data = self._head[self._pos:]
+            else:
+                data = self._head[self._pos:self._pos+size]
+                size -= len(data)
+        
+            self._pos += len(data)
+            if size == 0:
+                return data
+                
+        more = self._read_response(-1 if size is None else size)
+        self._pos += len(more)
+        return data + more
+    
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._pos
+        
+        if (whence == 2) | (offset > len(self._head)) | (self._pos > len(self._head)):
+            raise IOError('VOTableStream can only seek within the first line')
+        
+        self._pos = offset
+        return self._pos
+        
+    def tell(self):
+        return self._pos
+    
+    def seekable(self):
+        # Only within the first line, see `seek`
+        return True
+        
+    def readable(self):
+        return True
+        
+    def close(self):
+        self.response.close()
+
+def fetch_votable(query, timeout=QUERY_TIMEOUT, quiet=True):
+    """
+    Stream a VOTable query result into an `~astropy.table.Table`
+    
+    Parameters
+    ----------
+    query : str
+        Query URL, e.g., from `run_query` with `get_query_string=True`.
+    
+    timeout : float
+        Socket timeout, seconds.
+        
+    quiet : bool
+        Don't print the transfer statistics.
+        
+    Returns
+    -------
+    tab : `~astropy.table.Table`
+        Result table.  The number of bytes transferred, the transfer rate
+        and the time spent parsing the VOTable are stored in the `meta` 
+        attributes 'qbytes', 'qrate' and 'qparse'.
+    
+    Raises
+    ------
+    Errors from `urllib.request.urlopen` and the VOTable parser are passed 
+    through.
+    
+    """
+    import time
+    import urllib.request
+    from astropy.table import Table
+    
+    t0 = time.time()
+    
+    req = urllib.request.Request(query)
+    response = urllib.request.urlopen(req, timeout=timeout)
+    stream = VOTableStream(response)
+    try:
+        tab = Table.read(stream, format='votable')
+    finally:
+        stream.close()
+    
+    total_time = time.time() - t0
+    parse_time = total_time - stream.read_time
+    rate = stream.nbytes/np.maximum(stream.read_time, 1.e-6)
+    
+    tab.meta['qbytes'] = stream.nbytes, 'Bytes transferred'
+    tab.meta['qrate'] = rate, 'Transfer rate, bytes/s'
+    tab.meta['qparse'] = parse_time, 'Parse time, s'
+    
+    if not quiet:
+        print('Fetched {0:.1f} MB at {1:.2f} MB/s, parse time {2:.2f} s ({3} rows)'.format(stream.nbytes/1.e6, rate/1.e6, parse_time, len(tab)))
+    
+    return tab
+    
+def set_query_page(query, page=1, page_size=100000):
+    """
+    Set the PAGE and PAGE_SIZE parameters of a query URL
+    """
+    import re
+    return re.sub('PAGE=[0-9]+&PAGE_SIZE=[0-9]+', 
+                  'PAGE={0}&PAGE_SIZE={1}'.format(page, page_size), query)
+
+def fetch_page(query, page=1, page_size=10000, max_retries=3, timeout=QUERY_TIMEOUT):
+    """
+    Fetch a single page of a query result, retrying on network errors
+    
+    Parameters
+    ----------
+    query : str
+        Query URL.
+    
+    page, page_size : int
+        Page number (starting at 1) and number of rows per page.
+        
+    max_retries : int
+        Number of times to retry the request after network errors.
+        
+    timeout : float
+        Socket timeout, seconds.
+        
+    Returns
+    -------
+    tab : `~astropy.table.Table`
+        Table for the page.  Pages past the end of the result have fewer 
+        than `page_size` (or zero) rows.  Errors other than network errors
+        are raised.
+    
+    """
+    import time
+    import http.client
+    
+    page_query = set_query_page(query, page=page, page_size=page_size)
+    
+    for i in range(max_retries+1):
+        try:
+            return fetch_votable(page_query, timeout=timeout, quiet=True)
+        except (OSError, http.client.HTTPException) as err:
+            if i == max_retries:
+                raise
+            
+            print('Retry page {0} ({1})'.format(page, err))
+            time.sleep(2**i)
+            
+def fetch_pages(query, page_size=10000, maxitems=100000, n_workers=4, max_retries=3, timeout=QUERY_TIMEOUT, quiet=True):
+    """
+    Fetch a query result in concurrent pages
+    
+    Pages are requested in batches of `n_workers` until a page comes back
+    empty or with fewer rows than a full page, or until `maxitems` rows 
+    have been requested.  If the first page has fewer than `page_size` 
+    rows, the second page tells if it was the last page or if the archive
+    serves fewer rows per page than requested, in which case the shorter
+    page size is used from then on.  If a page after the first fails, the
+    pages before it are returned and the result is flagged as truncated.
+    
+    Parameters
+    ----------
+    query : str
+        Query URL.
+    
+    page_size : int
+        Number of rows per page.
+    
+    maxitems : int
+        Maximum number of rows to retrieve.
+    
+    n_workers : int
+        Number of concurrent requests.
+    
+    max_retries : int
+        Number of retries of a failed page.  Only the failed pages are 
+        requested again.
+    
+    timeout : float
+        Socket timeout, seconds.
+    
+    quiet : bool
+        Don't print the transfer statistics.
+        
+    Returns
+    -------
+    tab : `~astropy.table.Table`
+        Table with the pages concatenated in order.  `meta['qtrunc']` is
+        True if the last page was full and the `maxitems` limit was reached
+        or if a page failed.
+        
+    """
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    from astropy.table import vstack
+    
+    t0 = time.time()
+    
+    max_pages = int(np.ceil(maxitems/page_size))
+    
+    pages = []
+    page = 1
+    last_page = False
+    failed = False
+    
+    # Rows per page served by the archive, and whether a short first page
+    # still has to be checked against the next one
+    served = page_size
+    probe = False
+    
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        while (not last_page) & (not failed) & ((page <= max_pages) | probe):
+            last = max(max_pages, page)
+            batch = range(page, min(page+n_workers, last+1))
+            futures = [pool.submit(fetch_page, query, page=p, 
+                                   page_size=page_size, 
+                                   max_retries=max_retries, timeout=timeout)
+                       for p in batch]
+            
+            for p, future in zip(batch, futures):
+                try:
+                    tab_i = future.result()
+                except Exception as err:
+                    if p == 1:
+                        raise
+                    
+                    print('Warning: page {0} failed ({1}), result truncated after {2} pages'.format(p, err, len(pages)))
+                    failed = True
+                    break
+                    
+                if len(tab_i) == 0:
+                    if p == 1:
+                        pages.append(tab_i)
+                        
+                    last_page = True
+                    break
+                
+                if probe:
+                    # More rows after a short first page
+                    served = len(pages[0])
+                    max_pages = int(np.ceil(maxitems/served))
+                    probe = False
+                    print('Warning: the archive returns {0} rows per page rather than page_size={1}'.format(served, page_size))
+                    
+                pages.append(tab_i)
+                if len(tab_i) < served:
+                    if p == 1:
+                        probe = True
+                    else:
+                        last_page = True
+                        break
+            
+            page = batch[-1]+1
+    
+    nbytes = np.sum([t.meta['qbytes'][0] for t in pages])
+    parse_time = np.sum([t.meta['qparse'][0] for t in pages])
+    
+    tab = vstack(pages, metadata_conflicts='silent')
+    
+    total_time = time.time() - t0
+    rate = nbytes/total_time
+    
+    tab.meta['qbytes'] = nbytes, 'Bytes transferred'
+    tab.meta['qrate'] = rate, 'Transfer rate, bytes/s'
+    tab.meta['qparse'] = parse_time, 'Parse time, s'
+    tab.meta['qpages'] = len(pages), 'Number of pages'
+    tab.meta['qtrunc'] = (not last_page), 'Result truncated'
+    
+    if not quiet:
+        print('Fetched {0} pages, {1:.1f} MB at {2:.2f} MB/s ({3} rows)'.format(len(pages), nbytes/1.e6, rate/1.e6, len(tab)))
+        
+    return tab
+    
+def read_votable_bytes(data):
+    """
+    Parse a VOTable query result that has already been read into memory
+    """
+    import io
+    from astropy.table import Table
+    
+    stream = VOTableStream(io.BytesIO(data))
+    return Table.read(stream, format='votable')
+    
+async def run_query_async(box=None, proposid=[13871], instruments=['WFC3-IR'], filters=[], extensions=['RAW','C1M'], extra=DEFAULT_EXTRA,  fields=','.join(DEFAULT_FIELDS.split()), maxitems=100000, rename_columns=DEFAULT_RENAME, lower=True, sort_column=['OBSERVATION_ID'], quiet=True, pushdown=True, timeout=QUERY_TIMEOUT, use_cache=False, refresh_cache=False, cache_ttl=None, cache_dir=None, session=None, semaphore=None, executor=None):
+    """
+    Coroutine version of `run_query`
+    
+    The query parameters and the caching behavior are the same as for 
+    `run_query`.  Unlike `run_query`, this doesn't change the global numpy 
+    and astropy warning state (see `~hsaquery.utils.set_warnings`), so it 
+    can be run from many tasks at once.  Use `gather_queries` to run a list
+    of queries.
+    
+    Parameters
+    ----------
+    session : `aiohttp.ClientSession` or None
+        Shared HTTP session (and connection pool).  If None, the blocking 
+        `fetch_votable` is run in `executor`.
+    
+    semaphore : `asyncio.Semaphore` or None
+        Semaphore shared between tasks to limit the number of concurrent 
+        requests.
+    
+    executor : `concurrent.futures.Executor` or None
+        Executor for the VOTable parsing, the post-processing with 
+        `process_table` and the cache I/O, which all run off the event 
+        loop.  If None, use the default executor of the loop.
+    
+    Returns
+    -------
+    tab : `~astropy.table.Table` or False
+        Query result.
+    
+    """
+    import asyncio
+    import time
+    
+    from . import cache
+    
+    loop = asyncio.get_running_loop()
+    
+    if cache_ttl is None:
+        cache_ttl = cache.CACHE_TTL
+    
+    if cache_dir is None:
+        cache_dir = cache.CACHE_DIR
+    
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(1)
+        
+    query = build_query(box=box, proposid=proposid, filters=filters, 
+                        extensions=extensions, instruments=instruments,
+                        extra=extra, fields=fields, maxitems=maxitems, 
+                        pushdown=pushdown)
+    
+    if use_cache:
+        key = query_cache_key(query, extensions=extensions, 
+                              instruments=instruments, 
+                              rename_columns=rename_columns, lower=lower,
+                              sort_column=sort_column)
+        
+        if not refresh_cache:
+            tab = await loop.run_in_executor(executor, cache.read_cache, key,
+                                             cache_ttl, cache_dir)
+            if tab is not None:
+                return tab
+    
+    try:
+        async with semaphore:
+            if session is None:
+                tab = await loop.run_in_executor(executor, fetch_votable, 
+                                                 query, timeout, True)
+            else:
+                import aiohttp
+                
+                t0 = time.time()
+                client_timeout = aiohttp.ClientTimeout(total=timeout)
+                async with session.get(query, timeout=client_timeout) as resp:
+                    resp.raise_for_status()
+                    data = await resp.read()
+                
+                read_time = time.time() - t0
+                
+                t0 = time.time()
+                tab = await loop.run_in_executor(executor, read_votable_bytes,
+                                                 data)
+                parse_time = time.time() - t0
+                
+                rate = len(data)/np.maximum(read_time, 1.e-6)
+                tab.meta['qbytes'] = len(data), 'Bytes transferred'
+                tab.meta['qrate'] = rate, 'Transfer rate, bytes/s'
+                tab.meta['qparse'] = parse_time, 'Parse time, s'
+                
+    except Exception as err:
+        print('Failed to read query result ({0}).\n\nThis is likely a problem with the query that returned no results: \n\ncurl \"{1}\"'.format(err, query))
+        return False
+    
+    tab.meta['qtrunc'] = len(tab) >= maxitems, 'Result truncated'
+    if tab.meta['qtrunc'][0]:
+        print('Warning: query result truncated at maxitems={0} rows'.format(maxitems))
+        
+    tab.meta['query'] = query, 'Query string'
+    tab.meta['qtime'] = time.ctime(), 'Query timestamp'
+    
+    if not quiet:
+        print('Fetched {0:.1f} MB at {1:.2f} MB/s, parse time {2:.2f} s ({3} rows)'.format(tab.meta['qbytes'][0]/1.e6, tab.meta['qrate'][0]/1.e6, tab.meta['qparse'][0], len(tab)))
+        
+    tab = await loop.run_in_executor(executor, lambda : process_table(tab,
+                                 extensions=extensions, 
+                                 instruments=instruments,
+                                 rename_columns=rename_columns, lower=lower, 
+                                 sort_column=sort_column, quiet=quiet))
+    
+    if (tab is not False) & use_cache:
+        await loop.run_in_executor(executor, lambda : cache.write_cache(tab, 
+                                   key, cache_dir=cache_dir, ttl=cache_ttl))
+    
+    return tab
+
+async def gather_queries(specs, max_concurrent=8, quiet=True, return_exceptions=True, **kwargs):
+    """
+    Run many queries concurrently with `run_query_async`
+    
+    Parameters
+    ----------
+    specs : list of dict
+        List of keyword arguments for `run_query_async`, e.g., 
+        ``[{'box':[ra1, dec1, 3]}, {'box':[ra2, dec2, 3]}]``.
+    
+    max_concurrent : int
+        Maximum number of concurrent requests, which is also the size of the
+        connection pool and of the thread pool used for parsing and 
+        post-processing.
+    
+    quiet : bool
+        Set the global warning state once with 
+        `~hsaquery.utils.set_warnings` before starting the queries.
+        
+    return_exceptions : bool
+        Passed to `asyncio.gather`.  If True, an exception raised by one 
+        query is returned in its place in the output list rather than 
+        cancelling the others.
+        
+    kwargs : dict
+        Keyword arguments common to all queries.  Values in `specs` take 
+        precedence.
+        
+    Returns
+    -------
+    tables : list
+        List of query results (`~astropy.table.Table` or False) in the 
+        same order as `specs`.
+    
+    .. note::
+    
+    A shared `aiohttp.ClientSession` is used if `aiohttp` is available, 
+    otherwise the requests are made with `urllib` in the thread pool.
+    
+    """
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    from . import utils
+    
+    if quiet:
+        utils.set_warnings(numpy_level='ignore', astropy_level='ignore')
+    
+    semaphore = asyncio.Semaphore(max_concurrent)
+    
+    try:
+        import aiohttp
+        connector = aiohttp.TCPConnector(limit=max_concurrent)
+        session = aiohttp.ClientSession(connector=connector)
+    except ImportError:
+        session = None
+    
+    with ThreadPoolExecutor(max_workers=max_concurrent) as executor:
+        try:
+            tasks = []
+            for spec in specs:
+                kws = kwargs.copy()
+                kws.update(spec)
+                tasks.append(run_query_async(session=session, 
+                                             semaphore=semaphore,
+                                             executor=executor, **kws))
+            
+            tables = await asyncio.gather(*tasks, 
+                                      return_exceptions=return_exceptions)
+        finally:
+            if session is not None:
+                await session.close()
+    
+    return tables
+
+def run_queries(specs, max_concurrent=8, **kwargs):
+    """
+    Blocking wrapper around `gather_queries`, e.g.,
+    
+        >>> boxes = [[ra_i, dec_i, 3] for ra_i, dec_i in zip(ra, dec)]
+        >>> tables = run_queries([{'box':b} for b in boxes], proposid=[])
+    
+    If an event loop is already running in the calling thread, e.g., in a 
+    Jupyter notebook, the queries are run in a new event loop in a worker
+    thread.
+    
+    """
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    
+    def run():
+        return asyncio.run(gather_queries(specs, 
+                                          max_concurrent=max_concurrent,
+                                          **kwargs))
+    
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return run()
+    
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(run).result()
+    
+def box_limits(ra, dec, radius):
+    """
+    RA/Dec limits of the `run_query` box query for arrays of target 
+    positions
+    
+    Parameters
+    ----------
+    ra, dec : array-like
+        Target coordinates, decimal degrees.
+    
+    radius : float or array-like
+        Box half-width, arcminutes.
+    
+    Returns
+    -------
+    limits : array (N,4)
+        [ra_min, ra_max, dec_min, dec_max] for each target.
+        
+    """
+    ra = np.atleast_1d(np.asarray(ra, dtype=float))
+    dec = np.atleast_1d(np.asarray(dec, dtype=float))
+    radius = np.broadcast_to(np.asarray(radius, dtype=float), ra.shape)
+    
+    dra, ddec = radius/60./np.cos(dec/180*np.pi), radius/60.
+    return np.array([ra-dra, ra+dra, dec-ddec, dec+ddec]).T
+
+def merge_boxes(limits, merge_arcmin=1., max_arcmin=30.):
+    """
+    Merge overlapping or nearby boxes
+    
+    Parameters
+    ----------
+    limits : array (N,4)
+        Box limits from `box_limits`.
+    
+    merge_arcmin : float
+        Boxes separated by less than `merge_arcmin` in both RA and Dec are 
+        merged.
+    
+    max_arcmin : float or None
+        Maximum width and height of a merged box, arcminutes.  Boxes aren't
+        merged if their bounding box would be larger, so that chains of 
+        nearby boxes in crowded fields don't grow into very large queries.
+        No limit if None.
+        
+    Returns
+    -------
+    merged : array (M,4)
+        Limits of the bounding boxes of the connected groups of boxes.
+        
+    group : array (N)
+        Index of the merged box that contains each input box.
+    
+    """
+    N = len(limits)
+    gap = merge_arcmin/60.
+    
+    parent = np.arange(N)
+    
+    # Bounding box of each connected group, stored at its root
+    bbox = np.array(limits, dtype=float)
+    if max_arcmin is None:
+        max_size = np.inf
+    else:
+        max_size = max_arcmin/60.
+    
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+        
+    # Sweep in dec_min, with the RA gap scaled by cos(dec)
+    so = np.argsort(limits[:,2])
+    dec_min = limits[so,2]
+    cosd = np.cos(limits[:,2:].mean(axis=1)/180*np.pi)
+    
+    for k, i in enumerate(so):
+        hi = np.searchsorted(dec_min, limits[i,3]+gap, side='right')
+        if hi <= k+1:
+            continue
+        
+        j = so[k+1:hi]
+        ra_gap = gap/np.minimum(cosd[i], cosd[j])
+        test = (limits[j,0] < limits[i,1]+ra_gap) & (limits[j,1] > limits[i,0]-ra_gap)
+        for jj in j[test]:
+            ri, rj = find(i), find(jj)
+            if ri == rj:
+                continue
+            
+            union = np.array([min(bbox[ri,0], bbox[rj,0]), 
+                              max(bbox[ri,1], bbox[rj,1]),
+                              min(bbox[ri,2], bbox[rj,2]),
+                              max(bbox[ri,3], bbox[rj,3])])
+            
+            cos_union = np.cos(union[2:].mean()/180*np.pi)
+            if ((union[1]-union[0])*cos_union > max_size) | (union[3]-union[2] > max_size):
+                continue
+                
+            parent[rj] = ri
+            bbox[ri] = union
+                
+    roots = np.array([find(i) for i in range(N)])
+    un, group = np.unique(roots, return_inverse=True)
+    
+    merged = np.zeros((len(un), 4))
+    for c, func in enumerate([np.minimum, np.maximum, np.minimum, np.maximum]):
+        init = limits[un,c].copy()
+        func.at(init, group, limits[:,c])
+        merged[:,c] = init
+    
+    return merged, group
+
+def box_clause(limits):
+    """
+    Query predicate for a box from `box_limits`
+    """
+    return '(POSITION.RA > {0} AND POSITION.RA < {1} AND POSITION.DEC > {2} AND POSITION.DEC < {3})'.format(*limits)
+    
+def batch_box_queries(merged, max_url_length=7000, **kwargs):
+    """
+    Pack OR-ed box predicates into as few query URLs as possible
+    
+    Parameters
+    ----------
+    merged : array (M,4)
+        Box limits, e.g., from `merge_boxes`.
+    
+    max_url_length : int
+        Maximum length of a query URL.
+    
+    kwargs : dict
+        Keyword arguments passed to `build_query`, e.g., `extra`.
+        
+    Returns
+    -------
+    extras : list
+        List of `extra` lists for `build_query` / `run_query`, one per 
+        request, each with the position predicate prepended.
+    
+    """
+    extra = kwargs.pop('extra', DEFAULT_EXTRA)
+    
+    def url_length(clauses):
+        pos = '({0})'.format(' OR '.join(clauses))
+        q = build_query(box=None, extra=[pos]+extra, **kwargs)
+        return len(q)
+    
+    # Length without the position predicates
+    base_length = url_length([''])
+    
+    requests, current, current_length = [], [], base_length
+    for limits in merged:
+        clause = box_clause(limits)
+        # Quoted length of the clause plus ' OR '
+        clause_length = len(clause.replace(' ','%20')) + 8
+        if (len(current) > 0) & (current_length + clause_length > max_url_length):
+            requests.append(current)
+            current, current_length = [], base_length
+        
+        current.append(clause)
+        current_length += clause_length
+    
+    if len(current) > 0:
+        requests.append(current)
+    
+    extras = [['({0})'.format(' OR '.join(req))] + extra for req in requests]
+    return extras
+    
+def match_targets(tab, ra, dec, radius):
+    """
+    Match rows of a query table to the target boxes that contain them
+    
+    Parameters
+    ----------
+    tab : `~astropy.table.Table`
+        Query result, with 'ra' and 'dec' (or 'RA' and 'DEC') columns.
+        
+    ra, dec, radius : array-like
+        Target coordinates (decimal degrees) and box half-widths 
+        (arcminutes), as for `box_limits`.
+        
+    Returns
+    -------
+    mtab : `~astropy.table.Table`
+        Table with a row for every (row, target) match, sorted by target, 
+        with the target index in a 'target_index' column.  Rows that match 
+        several targets are repeated.
+    
+    """
+    ra = np.atleast_1d(np.asarray(ra, dtype=float))
+    dec = np.atleast_1d(np.asarray(dec, dtype=float))
+    limits = box_limits(ra, dec, radius)
+    dra = (limits[:,1]-limits[:,0])/2.
+    
+    rcol, dcol = ('ra', 'dec') if 'ra' in tab.colnames else ('RA', 'DEC')
+    row_ra = np.asarray(tab[rcol], dtype=float)
+    row_dec = np.asarray(tab[dcol], dtype=float)
+    
+    # Rows within the Dec range of each target
+    so = np.argsort(row_dec)
+    lo = np.searchsorted(row_dec[so], limits[:,2], side='right')
+    hi = np.searchsorted(row_dec[so], limits[:,3], side='left')
+    counts = np.maximum(hi-lo, 0)
+    
+    tidx = np.repeat(np.arange(len(ra)), counts)
+    offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts)-counts, 
+                                                 counts)
+    ridx = so[np.repeat(lo, counts) + offset]
+    
+    # RA test, with wrap at 360
+    delta = (row_ra[ridx] - ra[tidx] + 180) % 360 - 180
+    keep = np.abs(delta) < dra[tidx]
+    
+    mtab = tab[ridx[keep]]
+    mtab['target_index'] = tidx[keep]
+    return mtab
+    
+def run_batch_query(ra, dec, radius=3., merge_arcmin=1., max_merge_arcmin=30., max_url_length=7000, max_concurrent=4, quiet=True, **kwargs):
+    """
+    Box queries around many targets with as few requests as possible
+    
+    Nearby target boxes are merged (`merge_boxes`), the merged boxes are 
+    packed as OR-ed predicates into requests with URLs shorter than 
+    `max_url_length` (`batch_box_queries`) and the requests are run 
+    concurrently with `run_queries`.  The rows of the combined result are 
+    then matched back to the individual targets (`match_targets`).
+    
+    Parameters
+    ----------
+    ra, dec : array-like
+        Target coordinates, decimal degrees.
+    
+    radius : float or array-like
+        Box half-width, arcminutes, as in the `box` parameter of 
+        `run_query`.
+    
+    merge_arcmin : float
+        Merge target boxes closer than this, arcminutes.
+    
+    max_merge_arcmin : float or None
+        Maximum size of a merged box, arcminutes, see `merge_boxes`.
+    
+    max_url_length : int
+        Maximum length of a query URL.
+    
+    max_concurrent : int
+        Number of concurrent requests.
+    
+    kwargs : dict
+        Additional query parameters passed to `run_query_async`, e.g., 
+        `proposid`, `instruments`, `filters`, `extensions`, `extra`.
+        
+    Returns
+    -------
+    tab : `~astropy.table.Table` or False
+        Result table with a 'target_index' column giving the index of the
+        matching target in the input arrays.  Rows that match several 
+        targets are repeated.
+    
+    """
+    from astropy.table import vstack, unique
+    
+    if 'proposid' not in kwargs:
+        kwargs['proposid'] = []
+        
+    limits = box_limits(ra, dec, radius)
+    merged, group = merge_boxes(limits, merge_arcmin=merge_arcmin,
+                                max_arcmin=max_merge_arcmin)
+    
+    build_kws = {}
+    for k in ['proposid', 'filters', 'extensions', 'instruments', 'extra', 
+              'fields', 'maxitems', 'pushdown']:
+        if k in kwargs:
+            build_kws[k] = kwargs[k]
+        
+    extras = batch_box_queries(merged, max_url_length=max_url_length, 
+                               **build_kws)
+    
+    kwargs.pop('extra', None)
+    if not quiet:
+        print('{0} targets, {1} merged boxes, {2} requests'.format(len(limits), len(merged), len(extras)))
+        
+    specs = [{'box':None, 'extra':extra} for extra in extras]
+    tables = run_queries(specs, max_concurrent=max_concurrent, quiet=quiet,
+                         **kwargs)
+    
+    errors = [t for t in tables if isinstance(t, Exception)]
+    if len(errors) > 0:
+        print('Warning: {0} of {1} batch requests failed ({2})'.format(len(errors), len(specs), errors[0]))
+    
+    # Requests that failed or came back empty (False)
+    tables = [t for t in tables if (t is not False) & (not isinstance(t, Exception))]
+    if len(tables) == 0:
+        return False
+    
+    tab = vstack(tables, metadata_conflicts='silent')
+    
+    # Merged boxes in different requests can overlap
+    for key in ['artifact_id', 'ARTIFACT_ID', 'observation_id', 
+                'OBSERVATION_ID']:
+        if key in tab.colnames:
+            tab = unique(tab, keys=key, keep='first')
+            break
+    
+    return match_targets(tab, ra, dec, radius)
+    
+def to_str_array(col):
+    """
+    Convert a column of byte strings or objects to a unicode string array
+    """
+    arr = np.asarray(col)
+    if arr.dtype.kind == 'U':
+        return arr
+    elif arr.dtype.kind == 'S':
+        return np.char.decode(arr, 'utf-8')
+    elif (arr.dtype == np.dtype('O')) & (len(arr) > 0):
+        if isinstance(arr[0], bytes):
+            return np.char.decode(arr.astype(bytes), 'utf-8')
+    
+    return arr.astype(str)
+    
 def fix_byte_columns(tab):
+    """
+    Decode columns of byte strings in bulk
+    
+    Only bytes (`S`) columns and object columns of byte strings are 
+    converted.  Other columns are left as they are.
+    """
     for col in tab.colnames:
         try:
-            if tab[col].dtype == np.dtype('O'):
-                strcol = [item.decode('utf-8') for item in tab[col]]
-                tab.remove_column(col)
-                tab[col] = strcol
+            kind = tab[col].dtype.kind
+            if kind == 'O':
+                if (len(tab) == 0) | (not isinstance(tab[col][0], bytes)):
+                    continue
+            elif kind != 'S':
+                continue
+            
+            tab.replace_column(col, to_str_array(tab[col]))
         except:
             pass
             
@@ -298,15 +1331,16 @@ def old_parse_polygons(polystr):
     return poly
 
 def parse_polygons(polystr):
-    if hasattr(polystr, 'decode'):
-        spl = polystr.decode('utf-8').strip()[1:-1].split(',')
-    else:
-        spl = polystr.strip()[1:-1].split(',')
-
-    poly = [np.cast[float](spl).reshape((-1,2))] #[np.cast[float](p.split()).reshape((-1,2)) for p in spl]
-    return poly
-    
+    """
+    Parse a footprint string, in either the '{...}' or 'Polygon ICRS ...'
+    forms, into a list of (N,2) vertex arrays.  
     
+    See `~hsaquery.footprints.parse_footprint` and use 
+    `~hsaquery.footprints.get_footprints` to parse a whole table column at 
+    once.
+    """
+    from . import footprints
+    return footprints.parse_footprint(polystr)
 
 def set_default_formats(table, formats=DEFAULT_COLUMN_FORMAT):
     """
@@ -330,10 +1364,12 @@ def set_default_formats(table, formats=DEFAULT_COLUMN_FORMAT):
             
 def set_orientat_column(table):
     """
-    Make a column in the `table` computing each orientation with
-    `get_orientat`.
+    Make a column in the `table` computing each orientation as in
+    `get_orientat` (see `~hsaquery.footprints.FootprintArray.orientat`).
     """
-    table['orientat'] = [query.get_orientat(p) for p in table['footprint']]
+    from . import footprints
+    
+    table['orientat'] = footprints.get_footprints(table).orientat()
     table['orientat'].format = '.1f'
     
 def get_orientat(polystr='Polygon ICRS 127.465487 18.855605 127.425760 18.853486 127.423118 18.887458 127.463833 18.889591'):
@@ -343,14 +1379,17 @@ def get_orientat(polystr='Polygon ICRS 127.465487 18.855605 127.425760 18.853486
     ESA archive polygon, assuming that the first two entries of the polygon 
     are the LL and UL corners of the detector.
     
+    `polystr` can also be a list of already-parsed vertex arrays, e.g., a 
+    row of a `~hsaquery.footprints.FootprintArray`.
+    
     """
     from astropy.coordinates import Angle
     import astropy.units as u
     
-    try:
+    if isinstance(polystr, list):
+        p = polystr[0]
+    else:
         p = parse_polygons(polystr)[0]
-    except:
-        p = old_parse_polygons(polystr)[0]
         
     dra = (p[1,0]-p[0,0])*np.cos(p[0,1]/180*np.pi)
     dde = p[1,1] - p[0,1]
@@ -362,20 +1401,55 @@ def get_orientat(polystr='Polygon ICRS 127.465487 18.855605 127.425760 18.853486
     
     return orientat
     
-def show_footprints(tab, ax=None):
+def show_footprints(tab, ax=None, fps=None, rasterized=False, density=False, density_bins=128):
     """
     Show pointing footprints in a plot
+    
+    The outlines are drawn with one `~matplotlib.collections.LineCollection`
+    and one `scatter` call per filter color.
+    
+    Parameters
+    ----------
+    tab : `~astropy.table.Table`
+        Table with 'filter' and 'footprint' columns.
+        
+    ax : `~matplotlib.axes.Axes` or None
+        Plot axes.  If None, use the current axes.
+        
+    fps : `~hsaquery.footprints.FootprintArray` or None
+        Footprints of `tab`, which are otherwise taken from 
+        `~hsaquery.footprints.get_footprints`.
+    
+    rasterized : bool
+        Rasterize the collections in vector output (e.g., PDF) files.
+    
+    density : bool
+        Rather than the outlines, show a 2D histogram of the number of 
+        polygons on a `density_bins` x `density_bins` grid, which is faster 
+        for very large tables.
+    
+    density_bins : int
+        Grid size of the `density` histogram.
+        
+    Returns
+    -------
+    colors : dict
+        Plot colors of each filter.
+        
     """
     import matplotlib.pyplot as plt
+    from matplotlib.collections import LineCollection
+    from . import footprints
     
     # Show polygons
     mpl_colors = plt.rcParams['axes.prop_cycle'].by_key()['color']
-    filters = np.unique(tab['filter'])
+    tab_filters = to_str_array(tab['filter'])
+    filters = np.unique(tab_filters)
 
     colors = {}
     
-    if ax is None:
-        ax = plt
+    if (ax is None) | (ax is plt):
+        ax = plt.gca()
         
     for i, f in enumerate(filters):
         if f in MASTER_COLORS:
@@ -383,16 +1457,47 @@ def show_footprints(tab, ax=None):
         else:
             colors[f] = mpl_colors[i % len(mpl_colors)]
         
-    for i in range(len(tab)):
-        poly = parse_polygons(tab['footprint'][i])#[0]
-
-        for p in poly:
-            pclose = np.vstack([p, p[0,:]]) # repeat the first vertex to close
-            
-            ax.plot(pclose[:,0], pclose[:,1], alpha=0.1, color=colors[tab['filter'][i]])
-            
-            # Plot a point at the first vertex, pixel x=y=0.
-            ax.scatter(pclose[0,0], pclose[0,1], marker='.', color=colors[tab['filter'][i]], alpha=0.1)
+    if fps is None:
+        fps = footprints.get_footprints(tab)
+    
+    if len(fps.vertices) == 0:
+        return colors
+        
+    # Filter of each polygon
+    poly_filter = np.repeat(tab_filters, fps.n_polygons)
+    
+    # Split the vertex buffer into polygons and repeat the first vertex to 
+    # close them
+    po = fps.poly_offsets
+    closed = np.split(fps.vertices, po[1:-1])
+    closed = [np.vstack([p, p[:1,:]]) for p in closed]
+    first = fps.vertices[po[:-1]]
+    
+    if density:
+        centers = np.array([p[:-1].mean(axis=0) for p in closed])
+        hist, xe, ye = np.histogram2d(centers[:,0], centers[:,1], 
+                                      bins=density_bins)
+        ax.imshow(np.ma.masked_equal(hist.T, 0), origin='lower', 
+                  extent=(xe[0], xe[-1], ye[0], ye[-1]), aspect='auto', 
+                  cmap='Greys', interpolation='nearest', 
+                  rasterized=rasterized)
+        return colors
+        
+    linewidth = plt.rcParams['lines.linewidth']
+    
+    for f in filters:
+        sel = np.where(poly_filter == f)[0]
+        
+        lines = LineCollection([closed[k] for k in sel], colors=colors[f],
+                               alpha=0.1, linewidths=linewidth)
+        lines.set_rasterized(rasterized)
+        ax.add_collection(lines, autolim=True)
+        
+        # Plot a point at the first vertex, pixel x=y=0.
+        ax.scatter(first[sel,0], first[sel,1], marker='.', color=colors[f],
+                   alpha=0.1, rasterized=rasterized)
+    
+    ax.autoscale_view()
     
     return colors
     
@@ -53,6 +53,9 @@ def table_from_info(info):
     tab['footprint'] = footprints
     tab['stc_s_tailored'] = tab['footprint']
     
+    tab['jtargname'] = radec_to_targname_array(ra=tab['ra'], dec=tab['dec'],
+                                               scl=6)
+    
     return tab
     
 def set_warnings(numpy_level='ignore', astropy_level='ignore'):
@@ -109,12 +112,94 @@ def radec_to_targname(ra=0, dec=0, scl=10000):
     targname = targname.replace(' ', '')
     
     return targname
+
+def _sexagesimal_centi(value):
+    """
+    Split positive decimal values into integer (units, minutes, 
+    centiseconds), with the seconds rounded and carried as in 
+    `~astropy.coordinates.Angle.to_string` with `precision=2`, i.e., 
+    seconds of 59.99 or more are carried to the minutes before rounding.
+    """
+    mf, d = np.modf(value)
+    sf, m = np.modf(mf*60.)
+    s = sf*60.
+    
+    # Carry
+    carry = s >= 60. - 0.01
+    s[carry] = 0.
+    m[carry] += 1
+    
+    carry = m >= 60.
+    m[carry] = 0.
+    d[carry] += 1
+    
+    cs = np.round(s*100).astype(np.int64)
+    return d.astype(np.int64), m.astype(np.int64), cs
+
+def radec_to_targname_array(ra=[0], dec=[0], scl=10000):
+    """Turn arrays of decimal degree coordinates into strings
+    
+    Vectorized version of `radec_to_targname` that gives identical output.
+    
+    Example:
+
+        >>> from hsaquery.utils import radec_to_targname_array
+        >>> print(radec_to_targname_array(ra=[10., 150.1], dec=[-10., 2.2]))
+        ['j004000-100000' 'j100024+021200']
+    
+    Parameters
+    -----------
+    ra, dec : array-like
+        Sky coordinates in decimal degrees
+    
+    scl : float
+        Rounding scale, as in `radec_to_targname`.
+        
+    Returns
+    --------
+    targname : array of str
+        Target names like jHHMMSS[+-]DDMMSS.
+    
+    """
+    import astropy.units as u
+    
+    ra = np.atleast_1d(np.asarray(ra, dtype=float))
+    dec = np.atleast_1d(np.asarray(dec, dtype=float))
+    
+    # Rounded as floats, since ra*scl/cosd doesn't fit in an integer near 
+    # the poles
+    dec_scl = np.round(dec*scl)/scl
+    cosd = np.cos(dec_scl/180*np.pi)
+    ra_scl = np.round(ra*scl/cosd)/(scl/cosd)
+    
+    # Longitude wraps to [0, 360), as `~astropy.coordinates.Longitude`
+    out = (ra_scl < 0) | (ra_scl >= 360)
+    ra_scl[out] -= (ra_scl[out] // 360.)*360.
+    ra_scl[ra_scl >= 360] -= 360.
+    
+    rh, rm, rcs = _sexagesimal_centi(ra_scl*u.deg.to(u.hourangle))
+    dd, dm, dcs = _sexagesimal_centi(np.abs(dec_scl))
+    
+    def pad(x):
+        return np.char.zfill(x.astype(str), 2)
+    
+    sign = np.where(dec_scl < 0, '-', '+')
+    
+    targname = np.char.add('j', pad(rh))
+    for part in [pad(rm), pad(rcs // 100), sign, pad(dd), pad(dm), 
+                 pad(dcs // 100)]:
+        targname = np.char.add(targname, part)
+        
+    return targname
     
-def get_irsa_dust(ra, dec, type='SandF'):
+def get_irsa_dust(ra, dec, type='SandF', **kwargs):
     """
     Get Galactic dust reddening from NED/IRSA at a given position
     http://irsa.ipac.caltech.edu/applications/DUST/docs/dustProgramInterface.html
     
+    See `~hsaquery.dust.get_dust_ebv` for the cache and batch lookups of 
+    many positions.
+    
     Parameters
     ----------
     ra, dec : float
@@ -125,29 +210,19 @@ def get_irsa_dust(ra, dec, type='SandF'):
             SandF = Schlafly & Finkbeiner 2011 (ApJ 737, 103) 
               SFD = Schlegel et al. 1998 (ApJ 500, 525)
     
+    kwargs : dict
+        Keywords passed to `~hsaquery.dust.get_dust_ebv`.
+        
     Returns
     -------
     ebv : float
         Color excess E(B-V), in magnitudes
     
     """
-    import os
-    import tempfile   
-    import urllib.request
-    from astropy.table import Table
-    from lxml import objectify
-    
-    query = 'http://irsa.ipac.caltech.edu/cgi-bin/DUST/nph-dust?locstr={0:.4f}+{1:.4f}+equ+j2000'.format(ra, dec)
-    
-    req = urllib.request.Request(query)
-    response = urllib.request.urlopen(req)
-    resp_text = response.read().decode('utf-8')
+    from . import dust
     
-    root = objectify.fromstring(resp_text)
-    stats = root.result.statistics
-
-    if type == 'SFD':
-        return float(str(stats.refPixelValueSFD).split()[0])
-    else:
-        return float(str(stats.refPixelValueSandF).split()[0])
-        
\ No newline at end of file
+    ebv = dust.get_dust_ebv([ra], [dec], type=type, **kwargs)
+    if not np.isfinite(ebv[0]):
+        raise ValueError('Dust query failed at ({0:.4f}, {1:.4f})'.format(ra, dec))
+        
+    return float(ebv[0])
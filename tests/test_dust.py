@@ -0,0 +1,98 @@
+import threading
+import urllib.parse
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+import pytest
+
+from hsaquery import dust, utils
+
+RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<results status="ok">
+ <result>
+  <statistics>
+   <refPixelValueSFD>
+    {0:.4f} (mag)
+   </refPixelValueSFD>
+   <refPixelValueSandF>
+    {1:.4f} (mag)
+   </refPixelValueSandF>
+  </statistics>
+ </result>
+</results>
+"""
+
+def stand_in_ebv(ra, dec):
+    """
+    E(B-V) of the stand-in service
+    """
+    return np.round(0.1 + ra/1000., 4)
+
+class DustHandler(BaseHTTPRequestHandler):
+    """
+    Stand-in for the IRSA dust service, failing south of dec = -80
+    """
+    def do_GET(self):
+        self.server.requests += 1
+        query = urllib.parse.urlparse(self.path).query
+        locstr = urllib.parse.parse_qs(query)['locstr'][0]
+        ra, dec = [float(v) for v in locstr.split()[:2]]
+        
+        if dec < -80:
+            self.send_error(500)
+            return
+        
+        sfd = stand_in_ebv(ra, dec)
+        body = RESPONSE.format(sfd, sfd*dust.SANDF_SCALE).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    httpd = HTTPServer(('127.0.0.1', 0), DustHandler)
+    httpd.requests = 0
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    httpd.url = 'http://127.0.0.1:{0}/nph-dust'.format(httpd.server_port)
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+def test_get_dust_ebv(server, tmp_path):
+    ra = np.array([10., 10.+1/3600., 150., 200.])
+    dec = np.array([20., 20., -30., -85.])
+    
+    ebv = dust.get_dust_ebv(ra, dec, type='SFD', url=server.url)
+    assert np.allclose(ebv[:3], stand_in_ebv(ra[[0,0,2]], dec[[0,0,2]]))
+    assert np.isnan(ebv[3])
+    
+    # One request per pixel
+    assert server.requests == 3
+    
+    # Cache file
+    cache_file = str(tmp_path / 'dust_cache.json')
+    ebv = dust.get_dust_ebv(ra, dec, type='SandF', url=server.url, 
+                            cache_file=cache_file)
+    assert server.requests == 6
+    
+    cached = dust.get_dust_ebv(ra, dec, type='SandF', url=server.url, 
+                               cache_file=cache_file)
+    assert server.requests == 7
+    assert np.allclose(cached[:3], ebv[:3])
+    assert np.allclose(cached[:3]/dust.SANDF_SCALE, 
+                       stand_in_ebv(ra[[0,0,2]], dec[[0,0,2]]), atol=1.e-3)
+    
+    assert len(dust.read_dust_cache(cache_file)) == 2
+
+def test_get_irsa_dust(server):
+    ebv = utils.get_irsa_dust(150., -30., type='SFD', url=server.url)
+    assert np.isclose(ebv, stand_in_ebv(150., -30.))
+    
+    with pytest.raises(ValueError):
+        utils.get_irsa_dust(150., -85., url=server.url)
@@ -0,0 +1,40 @@
+import numpy as np
+import shapely
+
+from hsaquery import groupstore
+
+def test_round_trip(tmp_path):
+    polygons = [shapely.box(0, 0, 1, 1),
+                shapely.MultiPolygon([shapely.box(2, 2, 3, 3),
+                                      shapely.box(4, 4, 5, 5)]),
+                shapely.box(10, 10, 11, 12).buffer(0.1)]
+    members = [[0, 3], [1], [2, 4, 5]]
+    names = ['a', 'b', 'c']
+    boxes = [[0.5, 0.5, 1], [3, 3, 2], [10.5, 11, 1.5]]
+    
+    path = str(tmp_path / 'groups')
+    groupstore.save_groups(path, polygons, members, names=names, 
+                           boxes=boxes)
+    
+    store = groupstore.GroupStore(path)
+    assert len(store) == 3
+    
+    for i in range(3):
+        assert shapely.equals(store.polygon(i), polygons[i])
+        assert list(store.members(i)) == members[i]
+    
+    assert shapely.equals(store.polygons(), polygons).all()
+    
+    group = store['b']
+    assert group['name'] == 'b'
+    assert list(group['members']) == [1]
+    assert np.allclose(group['box'], boxes[1])
+
+def test_empty(tmp_path):
+    path = str(tmp_path / 'groups')
+    groupstore.save_groups(path, [], [], names=[], boxes=[])
+    
+    store = groupstore.GroupStore(path)
+    assert len(store) == 0
+    assert len(store.polygons()) == 0
+    assert list(store) == []
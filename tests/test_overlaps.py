@@ -0,0 +1,38 @@
+import numpy as np
+import shapely
+
+from hsaquery import overlaps
+
+def make_polygons(N=400, seed=1, size=2./60, buffer=1./60):
+    """
+    Buffered square footprints clustered in a few fields
+    """
+    rng = np.random.RandomState(seed)
+    
+    nfield = max(N//20, 1)
+    field_ra = rng.uniform(0, 10, nfield)
+    field_dec = rng.uniform(-5, 5, nfield)
+    
+    field = rng.randint(0, nfield, N)
+    ra = field_ra[field] + rng.normal(0, 3./60, N)
+    dec = field_dec[field] + rng.normal(0, 3./60, N)
+    
+    boxes = shapely.box(ra-size/2, dec-size/2, ra+size/2, dec+size/2)
+    return shapely.buffer(boxes, buffer)
+
+def test_update_groups():
+    polygons = make_polygons()
+    match_poly, match_ids = overlaps.group_polygons(polygons)
+    
+    for k in [1, 100, 250, len(polygons)-1]:
+        old_poly, old_ids = overlaps.group_polygons(polygons[:k])
+        up_poly, up_ids, changes = overlaps.update_groups(old_poly, old_ids,
+                                                          polygons[k:])
+        
+        assert up_ids == match_ids
+        for p, q in zip(up_poly, match_poly):
+            assert np.isclose(p.area, q.area)
+        
+        n = len(changes['unchanged']) + len(changes['changed']) 
+        n += len(changes['merged']) + len(changes['new'])
+        assert n == len(up_ids)
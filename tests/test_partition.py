@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from hsaquery import overlaps, partition, coverage
+
+from test_overlaps import make_polygons
+
+def test_healpix_index():
+    # Base pixels
+    ra = [0, 90, 180, 270, 45, 135, 45, 315]
+    dec = [0, 0, 0, 0, 60, 60, -60, -60]
+    pix = coverage.healpix_index(ra, dec, order=0)
+    assert np.all(pix == [4, 5, 6, 7, 0, 1, 8, 11])
+    
+    # Numpy version against the reference HEALPix implementation
+    u = pytest.importorskip('astropy.units')
+    HEALPix = pytest.importorskip('astropy_healpix').HEALPix
+    
+    rng = np.random.RandomState(2)
+    ra = rng.uniform(0, 360, 10000)
+    dec = np.degrees(np.arcsin(rng.uniform(-1, 1, 10000)))
+    
+    for order in [0, 3, 10]:
+        hp = HEALPix(nside=2**order, order='nested')
+        pix = hp.lonlat_to_healpix(ra*u.deg, dec*u.deg)
+        assert np.all(coverage._healpix_nest(ra, dec, order) == pix)
+
+def test_partition_groups(tmp_path):
+    # Fields across several order 3 tiles
+    polygons = make_polygons(N=600, seed=3)
+    match_poly, match_ids = overlaps.group_polygons(polygons)
+    
+    tiles = coverage.healpix_index([p.centroid.x for p in polygons],
+                                   [p.centroid.y for p in polygons], order=3)
+    assert len(np.unique(tiles)) > 1
+    
+    for workdir in [None, str(tmp_path / 'partition')]:
+        part_poly, part_ids = partition.partition_groups(polygons, order=3,
+                                                  n_workers=2,
+                                                  workdir=workdir)
+        assert part_ids == match_ids
+        for p, q in zip(part_poly, match_poly):
+            assert np.isclose(p.area, q.area)
@@ -0,0 +1,41 @@
+import numpy as np
+from astropy.table import Table
+
+from hsaquery import query
+
+def _archive(n_rows, served):
+    """
+    Stand-in for `fetch_page` on an archive that serves at most `served` 
+    rows per page
+    """
+    def fetch_page(q, page=1, page_size=10000, max_retries=3, timeout=None):
+        size = min(page_size, served)
+        rows = np.arange((page-1)*size, min(page*size, n_rows))
+        tab = Table([rows], names=['row'])
+        tab.meta['qbytes'] = 8*len(rows), ''
+        tab.meta['qparse'] = 0., ''
+        return tab
+    
+    return fetch_page
+
+def test_pages_complete(monkeypatch):
+    for n_rows in [0, 5, 100, 250]:
+        monkeypatch.setattr(query, 'fetch_page', _archive(n_rows, 1000))
+        for n_workers in [1, 4]:
+            tab = query.fetch_pages('', page_size=100, maxitems=1000, 
+                                    n_workers=n_workers)
+            assert np.all(tab['row'] == np.arange(n_rows))
+            assert not tab.meta['qtrunc'][0]
+
+def test_pages_server_cap(monkeypatch):
+    monkeypatch.setattr(query, 'fetch_page', _archive(250, 40))
+    for n_workers in [1, 4]:
+        tab = query.fetch_pages('', page_size=100, maxitems=1000, 
+                                n_workers=n_workers)
+        assert np.all(tab['row'] == np.arange(250))
+        assert not tab.meta['qtrunc'][0]
+    
+    # Limit reached
+    tab = query.fetch_pages('', page_size=100, maxitems=100, n_workers=2)
+    assert len(tab) >= 100
+    assert tab.meta['qtrunc'][0]
@@ -0,0 +1,41 @@
+import numpy as np
+
+from hsaquery import utils
+
+def _compare(ra, dec, scl):
+    names = utils.radec_to_targname_array(ra=ra, dec=dec, scl=scl)
+    for r, d, name in zip(ra, dec, names):
+        assert name == utils.radec_to_targname(ra=r, dec=d, scl=scl), (r, d)
+
+def test_targname_random():
+    rng = np.random.RandomState(1)
+    N = 1000
+    ra = rng.uniform(0, 360, N)
+    dec = np.degrees(np.arcsin(rng.uniform(-1, 1, N)))
+    
+    for scl in [6, 1000, 10000]:
+        _compare(ra, dec, scl)
+
+def test_targname_minute_boundaries():
+    """
+    Seconds just below 60, which are carried to the minutes
+    """
+    rng = np.random.RandomState(2)
+    N = 500
+    h, m = rng.randint(0, 24, N), rng.randint(0, 60, N)
+    sec = rng.uniform(59.98, 60., N)
+    ra = (h + m/60. + sec/3600.)*15
+    
+    d, dm = rng.randint(-89, 90, N), rng.randint(0, 60, N)
+    dec = np.sign(d+0.5)*(np.abs(d) + dm/60. + sec/3600.)
+    
+    for scl in [1000, 10000]:
+        _compare(ra, dec, scl)
+    
+    _compare([53.00029718746665], [40.431071849569435], 1000)
+
+def test_targname_poles_and_wrap():
+    ra = [0., 12., 180., 359.9999999, 360., -1.e-5, 266.4, 45.]
+    dec = [90., -90., -89.99999, 0., 10., 5., 89.999999, -1.e-9]
+    for scl in [6, 1000, 10000]:
+        _compare(ra, dec, scl)